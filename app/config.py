@@ -1,9 +1,48 @@
-from app.settings import JWTSettings, MailSettings, OAuth2Settings, PostgresSettings
+from app.settings import (
+    BroadcastSettings,
+    CacheSettings,
+    ExportSettings,
+    IngestSettings,
+    JWTSettings,
+    MailSettings,
+    MediaSettings,
+    MetricsSettings,
+    OAuth2Settings,
+    PaginationSettings,
+    PartitionSettings,
+    PasswordSettings,
+    PostgresSettings,
+    RevocationSettings,
+    SearchSettings,
+    WebsocketSettings,
+)
+from fastapi import WebSocket, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
 
 database_settings = PostgresSettings()
 jwt_settings = JWTSettings()
 mail_settings = MailSettings()
 oauth2_settings = OAuth2Settings()
+cache_settings = CacheSettings()
+password_settings = PasswordSettings()
+pagination_settings = PaginationSettings()
+websocket_settings = WebsocketSettings()
+broadcast_settings = BroadcastSettings()
+ingest_settings = IngestSettings()
+revocation_settings = RevocationSettings()
+metrics_settings = MetricsSettings()
+media_settings = MediaSettings()
+search_settings = SearchSettings()
+export_settings = ExportSettings()
+partition_settings = PartitionSettings()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login/", scheme_name="JWT")
+
+
+def websocket_oauth2_scheme(websocket: WebSocket, token: str | None = None) -> str:
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials
+    if token:
+        return token
+    raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION)
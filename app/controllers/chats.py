@@ -1,49 +1,134 @@
-import contextlib
+import json
+from bisect import bisect_left
+from collections.abc import AsyncIterator
+from datetime import datetime, timezone
 from uuid import UUID
 
-from app.exceptions.chats import NotAllowedException
+from app.config import pagination_settings
+from app.exceptions.chats import ExportsBusyException, NotAllowedException
 from app.models.chats import Chat as ChatModel
 from app.models.chats import Message as MessageModel
-from app.models.chats import ReadStatus as ReadStatusModel
 from app.models.chats import UserChat as UserChatModel
 from app.models.users import User as UserModel
 from app.schemas.chats import Chat as ChatSchema
+from app.schemas.chats import CreateMessage as CreateMessageSchema
 from app.schemas.chats import Message as MessageSchema
 from app.schemas.users import UserMember as UserMemberSchema
 from app.services.chats import ChatsService, chats_service
+from app.services.export import MessagesExporter, messages_exporter
+from app.services.ingest import MessagesIngestor, messages_ingestor
+from app.utils.broadcast import BroadcastBackend, chat_broadcast
+from app.utils.cursor import decode_cursor, encode_cursor
+from app.utils.hub import ChatHub, Connection, chat_hub
+from app.utils.search import split_highlights
 from fastapi import WebSocket
-from websockets.exceptions import ConnectionClosedOK
+
+
+def message_fields(message: MessageModel) -> dict:
+    return {
+        "id": message.id,
+        "created_at": message.created_at,
+        "from_user_id": message.from_user_id,
+        "chat_id": message.chat_id,
+        "content": message.content,
+    }
+
+
+def naive_utc(value: datetime | None) -> datetime | None:
+    # messages are stamped in naive utc
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
 
 
 class ChatsController:
-    def __init__(self, chats_service: ChatsService) -> None:
+    def __init__(
+        self,
+        chats_service: ChatsService,
+        hub: ChatHub,
+        broadcast: BroadcastBackend,
+        ingestor: MessagesIngestor,
+        exporter: MessagesExporter,
+    ) -> None:
         self.chats_service = chats_service
-        self.connection_dict = {}
+        self.hub = hub
+        self.broadcast = broadcast
+        self.ingestor = ingestor
+        self.exporter = exporter
 
     async def check_allowed_user(self, user: UserModel, chat_id: UUID) -> bool:
-        user_ids = await self.chats_service.get_members(chat_id=chat_id)
-        return user.id in user_ids
+        return await self.chats_service.is_member(chat_id=chat_id, user_id=user.id)
 
     async def add_member(self, chat_id: UUID, user: UserModel, member: UserMemberSchema) -> None:
         if not await self.check_allowed_user(user=user, chat_id=chat_id):
             raise NotAllowedException()
+        if await self.chats_service.is_member(chat_id=chat_id, user_id=member.id):
+            return
         user_chat = UserChatModel(user_id=member.id, chat_id=chat_id)
         await self.chats_service.add_member(user_chat=user_chat)
 
     async def remove_member(self, chat_id: UUID, user: UserModel, member: UserMemberSchema) -> None:
         if not await self.check_allowed_user(user=user, chat_id=chat_id):
             raise NotAllowedException()
-        user_chat = UserChatModel(user_id=member.id, chat_id=chat_id)
-        await self.chats_service.remove_member(user_chat=user_chat)
+        # the member's sockets on every worker are closed once the removal commits, see apply_membership
+        await self.chats_service.remove_member(chat_id=chat_id, user_id=member.id)
 
     async def get_members(self, user: UserModel, chat_id: UUID) -> list[UserMemberSchema]:
         if not await self.check_allowed_user(user=user, chat_id=chat_id):
             raise NotAllowedException()
-        return await self.chats_service.get_members(chat_id=chat_id)
+        user_ids = await self.chats_service.get_members(chat_id=chat_id)
+        return [UserMemberSchema(id=user_id) for user_id in user_ids]
 
     async def get_chats(self, user: UserModel) -> list[ChatModel]:
         return await self.chats_service.get_chats(user_id=user.id)
 
+    async def get_inbox(self, user: UserModel, limit: int, cursor: str | None = None) -> dict:
+        after = decode_cursor(cursor, datetime.fromisoformat, UUID) if cursor else None
+        rows = await self.chats_service.get_inbox(user_id=user.id, limit=limit, after=after)
+        items = [
+            {
+                "id": chat.id,
+                "name": chat.name,
+                "private": chat.private,
+                "active": chat.active,
+                "last_message": last_message,
+                "last_activity": last_message.created_at if last_message else None,
+                "unread_count": unread_count,
+                # counting stopped at the cap, the chat has at least that many
+                "unread_label": (
+                    f"{pagination_settings.inbox_max_unread - 1}+"
+                    if unread_count >= pagination_settings.inbox_max_unread
+                    else str(unread_count)
+                ),
+            }
+            for chat, last_message, _, unread_count in rows
+        ]
+        next_cursor = encode_cursor(rows[-1].last_activity, rows[-1][0].id) if len(rows) == limit else None
+        return {"items": items, "cursor": next_cursor}
+
+    async def search_messages(
+        self, user: UserModel, terms: str, limit: int, chat_id: UUID | None = None, cursor: str | None = None
+    ) -> dict:
+        if chat_id is not None:
+            if not await self.check_allowed_user(user=user, chat_id=chat_id):
+                raise NotAllowedException()
+            chat_ids = [chat_id]
+        else:
+            chat_ids = list(await self.chats_service.get_chat_ids(user_id=user.id))
+        if not chat_ids:
+            return {"items": [], "cursor": None}
+        after = decode_cursor(cursor, float, datetime.fromisoformat, UUID) if cursor else None
+        rows = await self.chats_service.search_messages(chat_ids=chat_ids, terms=terms, limit=limit, after=after)
+        items = []
+        for message, rank, headline in rows:
+            snippet, highlights = split_highlights(headline)
+            items.append({**message_fields(message), "rank": rank, "snippet": snippet, "highlights": highlights})
+        next_cursor = None
+        if len(rows) == limit:
+            message, rank, _ = rows[-1]
+            next_cursor = encode_cursor(rank, message.created_at, message.id)
+        return {"items": items, "cursor": next_cursor}
+
     async def create_chat(self, user: UserModel, chat_schema: ChatSchema) -> ChatModel:
         chat = ChatModel(**chat_schema.model_dump())
         created_chat = await self.chats_service.create_chat(chat=chat)
@@ -51,33 +136,133 @@ class ChatsController:
         await self.chats_service.add_member(user_chat=user_chat)
         return created_chat
 
-    async def get_messages(self, user: UserModel, chat_id: UUID) -> list[MessageModel]:
+    async def get_messages(
+        self,
+        user: UserModel,
+        chat_id: UUID,
+        limit: int,
+        before: str | None = None,
+        after: str | None = None,
+        read_statuses: str = "full",
+    ) -> dict:
         if not await self.check_allowed_user(user=user, chat_id=chat_id):
             raise NotAllowedException()
-        return await self.chats_service.get_messages(chat_id=chat_id)
+        messages, has_more = await self.chats_service.get_messages(
+            chat_id=chat_id,
+            limit=limit,
+            before=decode_cursor(before, datetime.fromisoformat, UUID) if before else None,
+            after=decode_cursor(after, datetime.fromisoformat, UUID) if after else None,
+        )
+        watermarks = await self.chats_service.get_read_watermarks(
+            chat_id=chat_id, user_id=user.id if read_statuses == "own" else None
+        )
+        if read_statuses == "count":
+            positions = sorted((mark.message_created_at, mark.message_id) for mark in watermarks)
+            items = [
+                {
+                    **message_fields(message),
+                    "read_count": len(positions) - bisect_left(positions, (message.created_at, message.id)),
+                }
+                for message in messages
+            ]
+        elif read_statuses == "own":
+            position = (watermarks[0].message_created_at, watermarks[0].message_id) if watermarks else None
+            items = [
+                {**message_fields(message), "is_read": bool(position) and (message.created_at, message.id) <= position}
+                for message in messages
+            ]
+        else:
+            items = [
+                {
+                    **message_fields(message),
+                    "read_statuses": [
+                        {"read_at": mark.read_at, "user_id": mark.user_id}
+                        for mark in watermarks
+                        if (message.created_at, message.id) <= (mark.message_created_at, mark.message_id)
+                    ],
+                }
+                for message in messages
+            ]
+        return {
+            "items": items,
+            "before_cursor": encode_cursor(messages[0].created_at, messages[0].id) if messages else None,
+            "after_cursor": encode_cursor(messages[-1].created_at, messages[-1].id) if messages else None,
+            "has_more": has_more,
+        }
 
-    async def connect(self, user: UserModel, websocket: WebSocket) -> None:
-        await websocket.accept()
-        self.connection_dict[user.id] = websocket
+    async def export_messages(
+        self,
+        user: UserModel,
+        chat_id: UUID,
+        export_format: str,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        cursor: str | None = None,
+    ) -> AsyncIterator[bytes]:
+        if not await self.check_allowed_user(user=user, chat_id=chat_id):
+            raise NotAllowedException()
+        if self.exporter.busy:
+            raise ExportsBusyException()
+        return self.exporter.export(
+            chat_id=chat_id,
+            export_format=export_format,
+            since=naive_utc(since),
+            until=naive_utc(until),
+            after=decode_cursor(cursor, datetime.fromisoformat, UUID) if cursor else None,
+        )
 
-    def disconnect(self, user_id: UUID) -> None:
-        self.connection_dict.pop(user_id)
+    async def connect(self, user: UserModel, chat_id: UUID, websocket: WebSocket) -> Connection:
+        return await self.hub.connect(websocket=websocket, user_id=user.id, chat_id=chat_id)
 
-    async def mark_as_read(self, user: UserModel, message_id: UUID) -> None:
-        read_status = ReadStatusModel(user_id=user.id, message_id=message_id)
-        await self.chats_service.add_read_status(read_status=read_status)
+    async def disconnect(self, connection: Connection) -> None:
+        await self.hub.disconnect(connection=connection)
 
-    async def send_message(self, chat_id: UUID, user: UserModel, message_schema: MessageSchema) -> None:
+    async def mark_as_read(self, user_id: UUID, message_id: UUID) -> None:
+        if message := await self.chats_service.get_message(message_id=message_id):
+            await self.chats_service.mark_read(marks=[(message.chat_id, user_id, message.created_at, message.id)])
+
+    async def send_message(self, chat_id: UUID, user: UserModel, message_schema: CreateMessageSchema) -> dict:
         if not await self.check_allowed_user(user=user, chat_id=chat_id):
             raise NotAllowedException()
-        create_message = MessageModel(content=message_schema.content, from_user_id=user.id, chat_id=chat_id)
-        message = await self.chats_service.send_message(message=create_message, chat_id=chat_id)
-        user_ids = await self.chats_service.get_members(chat_id=chat_id)
-        for idx in user_ids:
-            if websocket := self.connection_dict.get(idx):
-                with contextlib.suppress(ConnectionClosedOK):
-                    await websocket.send_text(message.content)
-                    await self.mark_as_read(user=user, message_id=message.id)
+        return await self.ingestor.submit(chat_id=chat_id, from_user_id=user.id, content=message_schema.content)
+
+    def acknowledge(self, connection: Connection, message: dict) -> None:
+        self.hub.send(connection=connection, payload=json.dumps({"ack": str(message["id"])}))
+
+    def publish_messages(self, messages: list[MessageModel]) -> None:
+        for message in messages:
+            self.broadcast.publish(
+                {
+                    "chat_id": str(message.chat_id),
+                    "message_id": str(message.id),
+                    "created_at": message.created_at.isoformat(),
+                    "payload": MessageSchema(**message_fields(message)).model_dump_json(exclude_unset=True),
+                }
+            )
+
+    async def apply_membership(self, events: list[dict]) -> None:
+        # membership changes committed on any worker, this worker's own ones included
+        for event in events:
+            chat_id, user_id = UUID(event["chat_id"]), UUID(event["user_id"])
+            self.chats_service.apply_membership(chat_id=chat_id, user_id=user_id, action=event["action"])
+            if event["action"] == "remove":
+                await self.hub.leave(chat_id=chat_id, user_id=user_id)
+
+    async def deliver(self, events: list[dict]) -> None:
+        marks = []
+        for event in events:
+            chat_id, message_id = UUID(event["chat_id"]), UUID(event["message_id"])
+            created_at = datetime.fromisoformat(event["created_at"])
+            recipients = self.hub.publish(chat_id=chat_id, payload=event["payload"])
+            marks.extend((chat_id, user_id, created_at, message_id) for user_id in recipients)
+        if marks:
+            await self.chats_service.mark_read(marks=marks)
 
 
-chats_controller = ChatsController(chats_service=chats_service)
+chats_controller = ChatsController(
+    chats_service=chats_service,
+    hub=chat_hub,
+    broadcast=chat_broadcast,
+    ingestor=messages_ingestor,
+    exporter=messages_exporter,
+)
@@ -1,6 +1,12 @@
+import hashlib
+import uuid
 from datetime import datetime, timedelta, timezone
+from uuid import UUID
 
-from app.config import jwt_settings
+from app.config import cache_settings, jwt_settings
+from app.database import set_actor
+from app.exceptions.media import FileNotFoundException
+from app.exceptions.pagination import InvalidCursorException
 from app.exceptions.users import (
     InactiveUserException,
     InsufficientCredentialsException,
@@ -15,13 +21,31 @@ from app.schemas.users import UpdatePassword as UpdatePasswordSchema
 from app.schemas.users import UserCreate as UserCreateSchema
 from app.schemas.users import UserUpdate as UserUpdateSchema
 from app.services.users import UsersService, users_service
+from app.utils.cache import TTLCache
+from app.utils.cursor import decode_cursor, encode_cursor
 from fastapi import HTTPException, UploadFile
 from jose import JWTError, jwt
 
 
+def _optional_float(value: float | None) -> float | None:
+    return None if value is None else float(value)
+
+
+def _token_id(payload: dict) -> UUID | None:
+    try:
+        return UUID(payload["jti"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _expires_at(payload: dict) -> datetime:
+    return datetime.fromtimestamp(payload["exp"], tz=timezone.utc).replace(tzinfo=None)
+
+
 class UsersController:
     def __init__(self, users_service: UsersService) -> None:
         self.users_service = users_service
+        self.tokens_cache = TTLCache(maxsize=cache_settings.auth_cache_size, ttl=cache_settings.auth_cache_ttl)
 
     async def get_user_or_404(self, email: str) -> UserModel | HTTPException:
         user = await self.users_service.get_user(email=email)
@@ -29,11 +53,15 @@ class UsersController:
             raise UserNotFoundException()
         return user
 
+    async def get_profile(self, user: UserModel) -> UserModel:
+        return await self.users_service.get_profile(user_id=user.id) or user
+
     async def register(
         self,
         user_schema: UserCreateSchema,
     ) -> UserModel | HTTPException:
         email = user_schema.email
+        set_actor(user_schema.username)
         if await self.users_service.get_user(email=email):
             raise UserExistsException()
         user = UserModel(**user_schema.model_dump())
@@ -44,85 +72,160 @@ class UsersController:
         username: str,
         password: str,
     ) -> UserModel | HTTPException:
+        set_actor(username)
         user = await self.users_service.authenticate_user(username=username, password=password)
         if not user:
             raise UnauthorizedException()
         return user
 
     async def update_user_info(self, user: UserModel, update_user_schema: UserUpdateSchema) -> UserModel:
-        user.full_name = update_user_schema.full_name
-        user.email = update_user_schema.email
-        return await self.users_service.update(user=user)
+        return await self.users_service.update(
+            user=user, full_name=update_user_schema.full_name, email=update_user_schema.email
+        )
 
     async def change_password(self, user: UserModel, data: UpdatePasswordSchema) -> UserModel:
         await self.authenticate_user(username=user.username, password=data.old_password)
         if data.password != data.new_password:
             raise PasswordsMismatchException()
-        user.password = self.users_service.get_password_hash(password=data.password)
-        return await self.users_service.update(user=user)
+        password = await self.users_service.get_password_hash(password=data.password)
+        user = await self.users_service.update(user=user, password=password)
+        await self.users_service.revoke_sessions(user=user)
+        return user
 
     async def reset_password(self, token: str, data: ResetPasswordSchema):
         if data.password != data.confirm_password:
             raise PasswordsMismatchException()
-        user = await self.verify_token(token=token, token_type="reset")
-        user.password = self.users_service.get_password_hash(password=data.password)
-        return await self.users_service.update(user=user)
-
-    async def search_users(self, data: str) -> list[UserModel] | None:
-        return await self.users_service.search_users(username__contains=data)
+        user, payload = await self.verify_token_claims(token=token, token_type="reset")
+        # reset links work once
+        if (jti := _token_id(payload)) is None or not await self.users_service.revoke_token(
+            jti=jti, user=user, expires_at=_expires_at(payload)
+        ):
+            raise InsufficientCredentialsException()
+        password = await self.users_service.get_password_hash(password=data.password)
+        user = await self.users_service.update(user=user, password=password)
+        await self.users_service.revoke_sessions(user=user)
+        return user
 
-    async def verify_token(
-        self,
-        token: str,
-        token_type: str = "access",
-    ):
+    async def logout(self, token: str, refresh_token: str | None = None) -> None:
+        user, payload = await self.verify_token_claims(token=token)
+        if (jti := _token_id(payload)) is not None:
+            await self.users_service.revoke_token(jti=jti, user=user, expires_at=_expires_at(payload))
+        if not refresh_token:
+            return
         try:
-            payload = jwt.decode(
-                token=token,
-                key=jwt_settings.secret_key if token_type == "access" else jwt_settings.refresh_secret_key,
-                algorithms=[jwt_settings.algorithm],
-            )
-
-            token_exp = payload.get("exp")
-            if not token_exp:
-                raise InsufficientCredentialsException()
-
-            now = datetime.now(timezone.utc)
-            if now > datetime.fromtimestamp(token_exp, tz=timezone.utc):
+            refresh_user, refresh_payload = await self.verify_token_claims(token=refresh_token, token_type="refresh")
+        except HTTPException:
+            return
+        if refresh_user.id == user.id and (jti := _token_id(refresh_payload)) is not None:
+            await self.users_service.revoke_token(jti=jti, user=user, expires_at=_expires_at(refresh_payload))
+
+    async def refresh_tokens(self, token: str) -> tuple[str, str]:
+        user, payload = await self.verify_token_claims(token=token, token_type="refresh", check_revoked=False)
+        session_version = payload.get("ver", 0)
+        jti = _token_id(payload)
+        if jti is None or self.users_service.is_revoked(jti=None, user=user, session_version=session_version):
+            raise InsufficientCredentialsException()
+        # the claim in the database decides, a spent token presented again means it leaked
+        if not await self.users_service.revoke_token(jti=jti, user=user, expires_at=_expires_at(payload)):
+            await self.users_service.revoke_sessions(user=user, durable=True)
+            raise InsufficientCredentialsException()
+        access_token = self.create_token(subject=user.username, session_version=session_version)
+        refresh_token = self.create_token(subject=user.username, token_type="refresh", session_version=session_version)
+        return access_token, refresh_token
+
+    async def search_users(self, data: str, mode: str, limit: int, cursor: str | None = None) -> dict:
+        after = None
+        if cursor:
+            cursor_mode, *after = decode_cursor(cursor, str, _optional_float, str, UUID)
+            if cursor_mode != mode:
+                raise InvalidCursorException()
+        rows = await self.users_service.search_users(data=data, mode=mode, limit=limit, after=after)
+        next_cursor = None
+        if len(rows) == limit:
+            _, rank, key = rows[-1]
+            next_cursor = encode_cursor(mode, rank, key, rows[-1][0].id)
+        return {"items": [user for user, _, _ in rows], "cursor": next_cursor}
+
+    def decode_token(self, token: str, token_type: str = "access") -> dict:
+        key = (token_type, hashlib.sha256(token.encode()).hexdigest())
+        if (payload := self.tokens_cache.get(key)) is None:
+            try:
+                payload = jwt.decode(
+                    token=token,
+                    key=jwt_settings.secret_key if token_type == "access" else jwt_settings.refresh_secret_key,
+                    algorithms=[jwt_settings.algorithm],
+                )
+            except JWTError:
                 raise InsufficientCredentialsException()
-            sub = payload.get("sub")
-            print(sub)
-            if not sub:
+            if not payload.get("exp") or not payload.get("sub"):
                 raise InsufficientCredentialsException()
+            self.tokens_cache.set(key, payload)
 
-        except JWTError:
+        now = datetime.now(timezone.utc)
+        if now > datetime.fromtimestamp(payload["exp"], tz=timezone.utc):
             raise InsufficientCredentialsException()
+        return payload
+
+    async def verify_token_claims(
+        self, token: str, token_type: str = "access", check_revoked: bool = True
+    ) -> tuple[UserModel, dict]:
+        payload = self.decode_token(token=token, token_type=token_type)
+        sub = payload["sub"]
         if token_type == "reset":
-            return await self.users_service.get_user(email=sub)
+            user = await self.users_service.get_user(email=sub)
         else:
-            user = await self.users_service.get_user(username=sub)
+            # access and refresh tokens name the user, whose recent writes are read back from the primary
+            set_actor(sub)
+            user = await self.users_service.get_cached_user(username=sub)
         if not user:
             raise InsufficientCredentialsException()
+        set_actor(user.username)
+        # checked against the in-memory revocation set, no database round trip
+        if check_revoked and self.users_service.is_revoked(
+            jti=_token_id(payload), user=user, session_version=payload.get("ver", 0)
+        ):
+            raise InsufficientCredentialsException()
         if user.is_disabled:
             raise InactiveUserException()
+        return user, payload
+
+    async def verify_token(
+        self,
+        token: str,
+        token_type: str = "access",
+    ):
+        user, _ = await self.verify_token_claims(token=token, token_type=token_type)
         return user
 
-    def create_token(self, subject: str, token_type: str = "access") -> str:
+    def create_token(self, subject: str, token_type: str = "access", session_version: int = 0) -> str:
         expires_delta = (
             jwt_settings.access_token_expire_minutes
             if token_type == "access"
             else jwt_settings.refresh_token_expire_minutes
         )
         expires_in = datetime.now(timezone.utc) + timedelta(minutes=expires_delta)
-        to_encode = {"exp": expires_in, "sub": subject}
+        to_encode = {"exp": expires_in, "sub": subject, "jti": uuid.uuid4().hex, "ver": session_version}
         secret_key = jwt_settings.secret_key if token_type == "access" else jwt_settings.refresh_secret_key
         return jwt.encode(to_encode, key=secret_key, algorithm=jwt_settings.algorithm)
 
     async def update_avatar(self, user: UserModel, photo: UploadFile) -> UserModel:
         return await self.users_service.update_avatar(user=user, photo=photo)
 
-    def get_avatar(self, user: UserModel) -> str | None:
-        return self.users_service.get_avatar(user=user)
+    def get_avatar(
+        self, user: UserModel, size: int | None = None, image_format: str | None = None, accept: str = ""
+    ) -> str | None:
+        if size and not image_format:
+            image_format = "webp" if "image/webp" in accept else "jpeg"
+        return self.users_service.get_avatar(user=user, size=size, image_format=image_format)
+
+    def get_public_avatar(
+        self, user_id: UUID, name: str, size: int | None = None, image_format: str | None = None, accept: str = ""
+    ) -> str:
+        if size and not image_format:
+            image_format = "webp" if "image/webp" in accept else "jpeg"
+        if not (avatar := self.users_service.get_public_avatar(user_id, name, size=size, image_format=image_format)):
+            raise FileNotFoundException()
+        return avatar
 
     def delete_avatar(self, user: UserModel):
         self.users_service.delete_avatar(user=user)
@@ -1,14 +1,81 @@
-from collections.abc import AsyncGenerator
+import logging
+from collections.abc import AsyncGenerator, Callable, Hashable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from functools import wraps
 
-from app.config import database_settings
+from app.config import database_settings, metrics_settings
+from app.utils.metrics import TimedQueuePool, instrument_engine
+from app.utils.replicas import ReplicaRouter, is_unavailable
+from fastapi import Depends
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm import ORMExecuteState, Session, declarative_base, sessionmaker
 
-engine = create_async_engine(database_settings.database_url, future=True, echo=True)
+engine = create_async_engine(database_settings.database_url, future=True, poolclass=TimedQueuePool)
+instrument_engine(
+    engine=engine.sync_engine,
+    slow_query_seconds=metrics_settings.slow_query_seconds,
+    slow_query_sample_rate=metrics_settings.slow_query_sample_rate,
+)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def replica_sessionmaker(url: str) -> sessionmaker:
+    # read only at the connection level, a write routed to a replica by mistake fails instead of diverging
+    replica_engine = create_async_engine(
+        url, future=True, poolclass=TimedQueuePool, execution_options={"postgresql_readonly": True}
+    )
+    instrument_engine(
+        engine=replica_engine.sync_engine,
+        slow_query_seconds=metrics_settings.slow_query_seconds,
+        slow_query_sample_rate=metrics_settings.slow_query_sample_rate,
+    )
+    return sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False, info={"replica": True})
+
+
+replicas = ReplicaRouter(
+    session_factories=[replica_sessionmaker(url) for url in database_settings.database_replica_urls],
+    max_lag=database_settings.database_replica_max_lag,
+    sticky_seconds=database_settings.database_replica_sticky_seconds,
+    sticky_size=database_settings.database_replica_sticky_size,
+    check_interval=database_settings.database_replica_check_interval,
+)
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
+session_context: ContextVar[AsyncSession | None] = ContextVar("session_context", default=None)
+# whoever the request acts for, their reads stick to the primary for a while after they write
+actor_context: ContextVar[Hashable | None] = ContextVar("actor_context", default=None)
+
+
+@event.listens_for(Session, "after_flush")
+def _flushed(session: Session, flush_context) -> None:
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _executed(orm_execute_state: ORMExecuteState) -> None:
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+def has_written(session: AsyncSession) -> bool:
+    return bool(session.info.get("wrote") or session.new or session.dirty or session.deleted)
+
+
+def set_actor(actor: Hashable | None) -> None:
+    actor_context.set(actor)
+
+
+def stick_to_primary() -> None:
+    replicas.stick(actor_context.get())
+
+
+def pool_stats() -> dict[str, int]:
+    return {"size": engine.pool.size(), "checked_out": engine.pool.checkedout(), "overflow": engine.pool.overflow()}
+
 
 async def get_session() -> AsyncSession | AsyncGenerator:
     async with async_session() as session:
@@ -16,11 +83,81 @@ async def get_session() -> AsyncSession | AsyncGenerator:
     await session.close()
 
 
+def on_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    session.info.setdefault("on_commit", []).append(callback)
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    if (session := session_context.get()) is None:
+        callback()
+    else:
+        on_commit(session, callback)
+
+
+async def commit(session: AsyncSession) -> None:
+    await session.commit()
+    if session.info.get("wrote"):
+        stick_to_primary()
+    for callback in session.info.pop("on_commit", []):
+        callback()
+
+
+@asynccontextmanager
+async def bind_session(session: AsyncSession) -> AsyncGenerator[AsyncSession, None]:
+    token = session_context.set(session)
+    try:
+        yield session
+        await commit(session=session)
+    except BaseException:
+        session.info.pop("on_commit", None)
+        await session.rollback()
+        raise
+    finally:
+        session_context.reset(token)
+
+
+async def unit_of_work(session: AsyncSession = Depends(get_session)) -> AsyncGenerator[AsyncSession, None]:
+    async with bind_session(session=session):
+        yield session
+
+
 def with_async_session(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        async with async_session() as session:
+        # never a replica session, whatever an outer read bound, writes and cache fills go to the primary
+        if (session := session_context.get()) is not None and not session.info.get("replica"):
+            kwargs["session"] = session
+            return await func(*args, **kwargs)
+        async with async_session() as session, bind_session(session=session):
+            kwargs["session"] = session
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def with_replica_session(func):
+    # for reads only, they go to a replica unless the request already wrote or its actor wrote recently
+    primary = with_async_session(func)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        if (session := session_context.get()) is not None and session.info.get("replica"):
             kwargs["session"] = session
             return await func(*args, **kwargs)
+        # a request that wrote reads its own writes
+        if session is not None and has_written(session):
+            return await primary(*args, **kwargs)
+        if (session_factory := replicas.pick(actor_context.get())) is None:
+            return await primary(*args, **kwargs)
+        try:
+            async with session_factory() as session, bind_session(session=session):
+                kwargs["session"] = session
+                return await func(*args, **kwargs)
+        except Exception as exc:
+            if not is_unavailable(exc):
+                raise
+            logger.warning("replica unavailable, reading from the primary", exc_info=True)
+            replicas.mark_unavailable(session_factory)
+        return await primary(*args, **kwargs)
 
     return wrapper
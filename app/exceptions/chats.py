@@ -7,3 +7,12 @@ class NotAllowedException(HTTPException):
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not allowed to access this resource",
         )
+
+
+class ExportsBusyException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many exports in progress, try again later",
+            headers={"Retry-After": "5"},
+        )
@@ -0,0 +1,25 @@
+from fastapi import HTTPException, status
+
+
+class FileTooLargeException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail="File is too large",
+        )
+
+
+class UnsupportedMediaTypeException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Unsupported file type",
+        )
+
+
+class FileNotFoundException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found",
+        )
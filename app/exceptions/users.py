@@ -49,3 +49,12 @@ class InactiveUserException(HTTPException):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Inactive user",
         )
+
+
+class HashingOverloadedException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password operations in progress, try again later",
+            headers={"Retry-After": "1"},
+        )
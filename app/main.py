@@ -1,17 +1,81 @@
+from contextlib import asynccontextmanager
+
 import stackprinter
 import uvicorn
+from app.controllers.chats import chats_controller
+from app.controllers.users import users_controller
+from app.database import pool_stats, replicas
+from app.routers.avatars import router as avatars_router
 from app.routers.chats import router as chats_router
+from app.routers.chats import websocket_router as chats_websocket_router
+from app.routers.metrics import router as metrics_router
 from app.routers.users import router as users_router
+from app.services.chats import chats_service
+from app.services.export import messages_exporter
+from app.services.ingest import messages_ingestor
+from app.services.mail import mail_outbox
+from app.services.partitions import partition_maintainer
+from app.services.users import users_service
+from app.utils.broadcast import chat_broadcast
+from app.utils.hub import chat_hub
+from app.utils.images import image_pipeline
+from app.utils.metrics import MetricsMiddleware, StatsCollector
 from fastapi import FastAPI
 from fastapi_pagination import add_pagination
+from prometheus_client import REGISTRY
 
 stackprinter.set_excepthook()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await replicas.start()
+    await users_service.revocations.start(sync=users_service.sync_revocations)
+    chat_broadcast.subscribe("member", chats_controller.apply_membership)
+    chat_broadcast.subscribe("user", users_service.apply_invalidations)
+    await chat_broadcast.start(handler=chats_controller.deliver)
+    await messages_ingestor.start(on_persisted=chats_controller.publish_messages)
+    await mail_outbox.start()
+    await partition_maintainer.start()
+    yield
+    await partition_maintainer.stop()
+    await mail_outbox.stop()
+    await messages_ingestor.stop()
+    await chat_broadcast.stop()
+    await chat_hub.close()
+    await users_service.revocations.stop()
+    image_pipeline.shutdown()
+    await replicas.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 add_pagination(app)
+app.add_middleware(MetricsMiddleware)
 app.include_router(users_router)
+app.include_router(avatars_router)
 app.include_router(chats_router)
+app.include_router(chats_websocket_router)
+app.include_router(metrics_router)
+
+for collector in (
+    StatsCollector(name="db_pool", source=pool_stats),
+    StatsCollector(name="db_replicas", source=lambda: replicas.stats),
+    StatsCollector(name="chat_hub", source=lambda: chat_hub.stats),
+    StatsCollector(name="chat_room_fanout", source=lambda: chat_hub.room_stats, label="chat_id"),
+    StatsCollector(name="chat_membership_cache", source=lambda: chats_service.membership.stats),
+    StatsCollector(name="chat_broadcast", source=lambda: chat_broadcast.stats),
+    StatsCollector(name="messages_ingestor", source=lambda: messages_ingestor.stats),
+    StatsCollector(name="users_cache", source=lambda: users_service.users_cache.stats),
+    StatsCollector(name="tokens_cache", source=lambda: users_controller.tokens_cache.stats),
+    StatsCollector(name="password_hasher", source=lambda: users_service.password_hasher.stats),
+    StatsCollector(name="token_revocations", source=lambda: users_service.revocations.stats),
+    StatsCollector(name="image_pipeline", source=lambda: image_pipeline.stats),
+    StatsCollector(name="mail_outbox", source=lambda: mail_outbox.stats),
+    StatsCollector(name="messages_exporter", source=lambda: messages_exporter.stats),
+    StatsCollector(name="partitions", source=lambda: partition_maintainer.stats),
+):
+    REGISTRY.register(collector)
 # app.include_router(oauth2_router)
 
 # app.add_middleware(
@@ -2,9 +2,11 @@ import uuid
 from datetime import datetime
 
 from app.database import Base
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, text
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, Computed, DateTime, ForeignKey, Index, String, text
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import deferred
+from sqlalchemy.schema import CreateColumn
 
 
 class Chat(Base):
@@ -22,7 +24,17 @@ class Chat(Base):
 
 
 class Message(Base):
+    # partitioned by month on created_at in postgres, so the partition key is part of the primary key
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_id_created_at_id", "chat_id", "created_at", "id"),
+        # btree_gin lets one GIN index answer both the chat scope and the text match
+        Index("ix_messages_chat_id_search_vector", "chat_id", "search_vector", postgresql_using="gin").ddl_if(
+            dialect="postgresql"
+        ),
+    )
+    # the generated search vector is not read back after an insert
+    __mapper_args__ = {"eager_defaults": False}
 
     id = Column(
         UUID(as_uuid=True),
@@ -30,16 +42,25 @@ class Message(Base):
         default=uuid.uuid4,
         server_default=text("gen_random_uuid()"),
     )
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow, nullable=False)
     from_user_id = Column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     chat_id = Column(ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     content = Column(String(255), nullable=False)
+    # kept current by postgres, only ever read by the search query and never loaded with the message
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('simple', content)", persisted=True)))
+
 
-    read_statuses = relationship("ReadStatus", back_populates="message")
+@compiles(CreateColumn, "sqlite")
+def create_column(element: CreateColumn, compiler, **kw) -> str | None:
+    # sqlite has no full text search column, messages are searched with LIKE there
+    if isinstance(element.element.type, TSVECTOR):
+        return None
+    return compiler.visit_create_column(element, **kw)
 
 
-class ReadStatus(Base):
-    __tablename__ = "read_statuses"
+class ReadWatermark(Base):
+    __tablename__ = "read_watermarks"
+    __table_args__ = (Index("ix_read_watermarks_chat_id_user_id", "chat_id", "user_id", unique=True),)
 
     id = Column(
         UUID(as_uuid=True),
@@ -47,15 +68,20 @@ class ReadStatus(Base):
         default=uuid.uuid4,
         server_default=text("gen_random_uuid()"),
     )
-    read_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    chat_id = Column(ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    message_id = Column(ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
-
-    message = relationship("Message", back_populates="read_statuses")
+    # (message_created_at, message_id) of the last read message, everything up to it counts as read
+    message_created_at = Column(DateTime, nullable=False)
+    message_id = Column(UUID(as_uuid=True), nullable=False)
+    read_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 
 class UserChat(Base):
     __tablename__ = "users_chats"
+    __table_args__ = (
+        Index("ix_users_chats_chat_id_user_id", "chat_id", "user_id", unique=True),
+        Index("ix_users_chats_user_id", "user_id"),
+    )
 
     id = Column(
         UUID(as_uuid=True),
@@ -0,0 +1,22 @@
+import uuid
+from datetime import datetime
+
+from app.database import Base
+from sqlalchemy import JSON, Column, DateTime, Index, Integer, String, Text
+from sqlalchemy.dialects.postgresql import UUID
+
+
+class OutboxMail(Base):
+    __tablename__ = "mail_outbox"
+    __table_args__ = (Index("ix_mail_outbox_next_attempt_at", "next_attempt_at"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    recipients = Column(JSON, nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    # counted when a sender claims the mail, so a crash mid send still uses up an attempt
+    attempts = Column(Integer, default=0, nullable=False)
+    # null once the mail is given up on, the row stays for inspection
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
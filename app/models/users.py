@@ -1,7 +1,8 @@
 import uuid
+from datetime import datetime
 
 from app.database import Base
-from sqlalchemy import Boolean, Column, String, text
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String, func, text
 from sqlalchemy.dialects.postgresql import UUID
 
 
@@ -20,6 +21,30 @@ class User(Base):
     is_disabled = Column(Boolean, default=False, nullable=False)
     password = Column(String(255), nullable=False)
     avatar = Column(String(255), nullable=True)
+    # tokens carry the version they were issued at, bumping it signs the user out everywhere
+    session_version = Column(Integer, default=0, server_default=text("0"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_users_username_prefix", func.lower(username).collate("C")).ddl_if(dialect="postgresql"),
+        Index("ix_users_username_trgm", text("lower(username) gin_trgm_ops"), postgresql_using="gin").ddl_if(
+            dialect="postgresql"
+        ),
+        Index("ix_users_email_lower", func.lower(email)),
+    )
 
     def __repr__(self):
         return f"<User(id={self.id}, username={self.username}, email={self.email})>"
+
+
+class TokenRevocation(Base):
+    __tablename__ = "token_revocations"
+    __table_args__ = (Index("ix_token_revocations_revoked_at", "revoked_at"),)
+
+    # the jti of a revoked token, or a random id for a session version bump
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # set for version bumps, every token of the user issued below it is revoked
+    session_version = Column(Integer, nullable=True)
+    # once every token the row covers has expired it can be forgotten
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -1,7 +1,9 @@
 from collections.abc import Iterable
 from typing import Type, TypeVar
 
-from sqlalchemy import and_, select
+from sqlalchemy import and_, delete, inspect, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 TypeModel = TypeVar("TypeModel")
@@ -14,16 +16,14 @@ class BaseRepository:
     async def create(self, instance: TypeModel, session: AsyncSession) -> TypeModel:
         session.add(instance)
         await session.flush()
-        await session.commit()
         return instance
 
     async def bulk_create(self, instances: Iterable[TypeModel], session: AsyncSession) -> Iterable[TypeModel]:
         session.add_all(instances)
         await session.flush()
-        await session.commit()
         return instances
 
-    def set_filters(self, query, kwargs: dict[str, str]):
+    def build_filters(self, kwargs: dict[str, str]) -> list | None:
         filters = []
         for field, value in kwargs.items():
             if value:
@@ -51,9 +51,23 @@ class BaseRepository:
                         filters.append(model_field == value)
                 except AttributeError:
                     return None
+        return filters
+
+    def set_filters(self, query, kwargs: dict[str, str]):
+        if (filters := self.build_filters(kwargs=kwargs)) is None:
+            return None
         query = query.filter(and_(*filters))
         return query
 
+    def required_filters(self, kwargs: dict[str, str]) -> list:
+        # empty values are skipped, a set based statement must not widen to the whole table because of that
+        if not (filters := self.build_filters(kwargs=kwargs)):
+            raise ValueError(f"refusing to touch every {self.model.__tablename__} row, no usable filters in {kwargs}")
+        return filters
+
+    def dialect_insert(self, session: AsyncSession):
+        return postgresql_insert if session.bind.dialect.name == "postgresql" else sqlite_insert
+
     def set_order_by(self, query, order_by: str):
         if order_by[0] == "-":
             order_by_field = getattr(self.model, order_by[1:]).desc()
@@ -70,11 +84,38 @@ class BaseRepository:
             return result.scalars().first()
         return None
 
-    async def get_or_create(self, instance: TypeModel, session: AsyncSession) -> TypeModel:
-        instance_dict = {field: value for field, value in instance.__dict__.items() if field != "_sa_instance_state"}
-        if got_instance := await self.get(**instance_dict, session=session):  # type: ignore
-            return got_instance
-        return await self.create(instance=instance, session=session)
+    async def get_or_create(self, instance: TypeModel, session: AsyncSession, index_elements: list[str]) -> TypeModel:
+        # one statement, the no-op update on conflict makes returning hand back the existing row as well
+        values = {
+            column.key: value
+            for column in self.model.__table__.c
+            if (value := inspect(instance).dict.get(column.key)) is not None
+        }
+        query = self.dialect_insert(session)(self.model).values(**values)
+        query = query.on_conflict_do_update(
+            index_elements=index_elements, set_={index_elements[0]: query.excluded[index_elements[0]]}
+        )
+        return await session.scalar(query.returning(self.model), execution_options={"populate_existing": True})
+
+    async def bulk_upsert(
+        self,
+        rows: list[dict],
+        session: AsyncSession,
+        index_elements: list[str],
+        update_fields: Iterable[str] = (),
+    ) -> list[TypeModel]:
+        # without update fields conflicting rows are left alone and missing from the result
+        if not rows:
+            return []
+        query = self.dialect_insert(session)(self.model)
+        if update_fields:
+            query = query.on_conflict_do_update(
+                index_elements=index_elements, set_={field: query.excluded[field] for field in update_fields}
+            )
+        else:
+            query = query.on_conflict_do_nothing(index_elements=index_elements)
+        result = await session.scalars(query.returning(self.model), rows, execution_options={"populate_existing": True})
+        return list(result.all())
 
     async def all(self, session: AsyncSession) -> Iterable[TypeModel] | None:
         query = select(self.model)
@@ -92,22 +133,49 @@ class BaseRepository:
             return result.scalars().all()
         return None
 
+    async def values_list(
+        self, session: AsyncSession, *fields: str, flat: bool = False, order_by: str | None = None, **kwargs
+    ) -> list:
+        # plain column values, no entities are built or put into the identity map
+        query = select(*(getattr(self.model, field) for field in fields))
+        if kwargs:
+            query = self.set_filters(query=query, kwargs=kwargs)
+        if order_by:
+            query = self.set_order_by(query=query, order_by=order_by)
+        result = await session.execute(query)
+        if flat:
+            return list(result.scalars().all())
+        return list(result.tuples().all())
+
     async def update(self, instance: TypeModel, session: AsyncSession) -> TypeModel:
         await session.merge(instance)
-        await session.commit()
+        await session.flush()
         return instance
 
     async def bulk_update(self, instances: Iterable[TypeModel], session: AsyncSession) -> Iterable[TypeModel]:
-        for instance in instances:
-            await session.merge(instance)
-        await session.commit()
+        # update by primary key, one executemany instead of a merge and a select per instance
+        columns = {column.key for column in self.model.__table__.c}
+        rows = [
+            {key: value for key, value in inspect(instance).dict.items() if key in columns} for instance in instances
+        ]
+        if rows:
+            await session.execute(update(self.model), rows)
         return instances
 
+    async def update_where(self, values: dict, session: AsyncSession, **kwargs) -> int:
+        query = update(self.model).where(*self.required_filters(kwargs=kwargs)).values(**values)
+        return (await session.execute(query)).rowcount
+
     async def delete(self, instance, session: AsyncSession) -> None:
         await session.delete(instance)
-        await session.commit()
+        await session.flush()
 
     async def bulk_delete(self, instances: Iterable[TypeModel], session: AsyncSession) -> None:
-        for instance in instances:
-            await session.delete(instance)
-        await session.commit()
+        # matched on the whole primary key, the id of a partitioned table is only unique with its partition key
+        primary_key = inspect(self.model).primary_key
+        if keys := [tuple(getattr(instance, column.key) for column in primary_key) for instance in instances]:
+            await session.execute(delete(self.model).where(tuple_(*primary_key).in_(keys)))
+
+    async def delete_where(self, session: AsyncSession, **kwargs) -> int:
+        query = delete(self.model).where(*self.required_filters(kwargs=kwargs))
+        return (await session.execute(query)).rowcount
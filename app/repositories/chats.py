@@ -1,31 +1,263 @@
+from collections.abc import Iterable, Sequence
+from datetime import datetime
+from uuid import UUID
+
 from app.models.chats import Chat as ChatModel
 from app.models.chats import Message as MessageModel
-from app.models.chats import ReadStatus as ReadStatusModel
+from app.models.chats import ReadWatermark as ReadWatermarkModel
 from app.models.chats import UserChat as UserChatModel
 from app.repositories.base import BaseRepository
+from app.utils.search import HEADLINE_OPTIONS, mark_terms, search_terms
+from sqlalchemy import DateTime, Float, Row, and_, cast, func, insert, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import UUID as UUIDType
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.base import ExecutableOption
+
+# sort key for chats without messages, keeps them after every active chat
+NO_ACTIVITY = datetime(1970, 1, 1)
+NO_MESSAGE = UUID(int=0)
+
+# must match the config the search vector is generated with
+SEARCH_CONFIG = "simple"
 
 
 class ChatsRepository(BaseRepository):
     def __init__(self):
         super().__init__(model=ChatModel)
 
+    async def inbox(
+        self,
+        session: AsyncSession,
+        user_id: UUID,
+        limit: int,
+        max_unread: int,
+        after: tuple[datetime, UUID] | None = None,
+    ) -> list[Row]:
+        last_message_id = (
+            select(MessageModel.id)
+            .where(MessageModel.chat_id == ChatModel.id)
+            .order_by(MessageModel.created_at.desc(), MessageModel.id.desc())
+            .limit(1)
+            .correlate(ChatModel)
+            .scalar_subquery()
+        )
+        unread = aliased(MessageModel)
+        read_up_to = func.coalesce(ReadWatermarkModel.message_created_at, literal(NO_ACTIVITY, DateTime))
+        # stops counting at max_unread, a chat nobody reads must not cost a scan of its whole history
+        unread_messages = (
+            select(literal(1))
+            .where(
+                unread.chat_id == ChatModel.id,
+                unread.from_user_id != user_id,
+                # the plain bound lets postgres skip the months before the watermark, the row comparison cannot
+                unread.created_at >= read_up_to,
+                tuple_(unread.created_at, unread.id)
+                > tuple_(
+                    read_up_to,
+                    func.coalesce(ReadWatermarkModel.message_id, literal(NO_MESSAGE, UUIDType(as_uuid=True))),
+                ),
+            )
+            .limit(max_unread)
+            .correlate(ChatModel, ReadWatermarkModel)
+            .subquery()
+        )
+        unread_count = select(func.count()).select_from(unread_messages).scalar_subquery()
+        last_message = aliased(MessageModel)
+        activity = func.coalesce(last_message.created_at, literal(NO_ACTIVITY, DateTime))
+        query = (
+            select(ChatModel, last_message, activity.label("last_activity"), unread_count.label("unread_count"))
+            .join(UserChatModel, and_(UserChatModel.chat_id == ChatModel.id, UserChatModel.user_id == user_id))
+            .outerjoin(last_message, last_message.id == last_message_id)
+            .outerjoin(
+                ReadWatermarkModel,
+                and_(ReadWatermarkModel.chat_id == ChatModel.id, ReadWatermarkModel.user_id == user_id),
+            )
+        )
+        if after:
+            query = query.where(tuple_(activity, ChatModel.id) < after)
+        query = query.order_by(activity.desc(), ChatModel.id.desc()).limit(limit)
+        return list((await session.execute(query)).all())
+
 
 class MessagesRepository(BaseRepository):
     def __init__(self):
         super().__init__(model=MessageModel)
 
+    async def paginate(
+        self,
+        session: AsyncSession,
+        chat_id: UUID,
+        limit: int,
+        before: tuple[datetime, UUID] | None = None,
+        after: tuple[datetime, UUID] | None = None,
+        options: Iterable[ExecutableOption] = (),
+    ) -> tuple[list[MessageModel], bool]:
+        key = tuple_(MessageModel.created_at, MessageModel.id)
+        query = select(MessageModel).where(MessageModel.chat_id == chat_id).options(*options)
+        # created_at is bounded on its own as well, partitions are pruned on it but not on the row comparison
+        if before:
+            query = query.where(MessageModel.created_at <= before[0], key < before)
+        if after:
+            query = query.where(MessageModel.created_at >= after[0], key > after).order_by(
+                MessageModel.created_at, MessageModel.id
+            )
+        else:
+            query = query.order_by(MessageModel.created_at.desc(), MessageModel.id.desc())
+        result = await session.execute(query.limit(limit + 1))
+        messages = list(result.scalars().all())
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if not after:
+            messages.reverse()
+        return messages, has_more
+
+    async def search(
+        self,
+        session: AsyncSession,
+        chat_ids: list[UUID],
+        terms: str,
+        limit: int,
+        max_candidates: int,
+        after: tuple[float, datetime, UUID] | None = None,
+    ) -> list[tuple[MessageModel, float, str]]:
+        postgres = session.bind.dialect.name == "postgresql"
+        if postgres:
+            ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+            condition = MessageModel.search_vector.op("@@")(ts_query)
+            rank = cast(func.ts_rank_cd(MessageModel.search_vector, ts_query, 32), Float)
+        else:
+            words = search_terms(terms)
+            if not words:
+                return []
+            condition = and_(*(MessageModel.content.icontains(word, autoescape=True) for word in words))
+            rank = cast(sum(len(word) for word in words), Float) / func.length(MessageModel.content)
+        # only the newest matches are ranked, a common word must not make postgres rank the whole history
+        candidates = (
+            select(MessageModel.id)
+            .where(MessageModel.chat_id.in_(chat_ids), condition)
+            .order_by(MessageModel.created_at.desc(), MessageModel.id.desc())
+            .limit(max_candidates)
+            .subquery()
+        )
+        key = tuple_(rank, MessageModel.created_at, MessageModel.id)
+        page = select(MessageModel.id, rank.label("rank")).join(candidates, candidates.c.id == MessageModel.id)
+        if after:
+            page = page.where(key < after)
+        page = (
+            page.order_by(rank.desc(), MessageModel.created_at.desc(), MessageModel.id.desc()).limit(limit).subquery()
+        )
+        # headlines are the expensive part, they are built for the page only
+        if postgres:
+            headline = func.ts_headline(SEARCH_CONFIG, MessageModel.content, ts_query, HEADLINE_OPTIONS)
+        else:
+            headline = MessageModel.content
+        query = (
+            select(MessageModel, page.c.rank, headline)
+            .join(page, page.c.id == MessageModel.id)
+            .order_by(page.c.rank.desc(), MessageModel.created_at.desc(), MessageModel.id.desc())
+        )
+        rows = (await session.execute(query)).all()
+        if postgres:
+            return [tuple(row) for row in rows]
+        return [(message, rank, mark_terms(content, words)) for message, rank, content in rows]
+
+    async def export_batch(
+        self,
+        session: AsyncSession,
+        chat_id: UUID,
+        limit: int,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        after: tuple[datetime, UUID] | None = None,
+    ) -> Sequence[Row]:
+        # plain rows, oldest first; the caller passes the last row back as after to read the next batch
+        query = select(
+            MessageModel.id,
+            MessageModel.created_at,
+            MessageModel.from_user_id,
+            MessageModel.chat_id,
+            MessageModel.content,
+        ).where(MessageModel.chat_id == chat_id)
+        if since:
+            query = query.where(MessageModel.created_at >= since)
+        if until:
+            query = query.where(MessageModel.created_at < until)
+        if after:
+            query = query.where(
+                MessageModel.created_at >= after[0], tuple_(MessageModel.created_at, MessageModel.id) > after
+            )
+        query = query.order_by(MessageModel.created_at, MessageModel.id).limit(limit)
+        return (await session.execute(query)).all()
+
+    async def insert_many(self, session: AsyncSession, rows: list[dict]) -> list[MessageModel]:
+        result = await session.execute(insert(MessageModel).returning(MessageModel), rows)
+        return list(result.scalars().all())
+
 
 class UsersChatsRepository(BaseRepository):
     def __init__(self):
         super().__init__(model=UserChatModel)
 
 
-class ReadStatusesRepository(BaseRepository):
+class ReadWatermarksRepository(BaseRepository):
     def __init__(self):
-        super().__init__(model=ReadStatusModel)
+        super().__init__(model=ReadWatermarkModel)
+
+    async def of_members(
+        self, session: AsyncSession, chat_id: UUID, user_id: UUID | None = None
+    ) -> list[ReadWatermarkModel]:
+        # members who left keep their watermark, only the current ones count as readers
+        query = (
+            select(ReadWatermarkModel)
+            .join(
+                UserChatModel,
+                and_(
+                    UserChatModel.chat_id == ReadWatermarkModel.chat_id,
+                    UserChatModel.user_id == ReadWatermarkModel.user_id,
+                ),
+            )
+            .where(ReadWatermarkModel.chat_id == chat_id)
+        )
+        if user_id:
+            query = query.where(ReadWatermarkModel.user_id == user_id)
+        return list((await session.scalars(query)).all())
+
+    async def advance(self, session: AsyncSession, marks: Iterable[tuple[UUID, UUID, datetime, UUID]]) -> None:
+        # one row per (chat, user), postgres refuses to touch the same row twice in one statement
+        latest: dict[tuple[UUID, UUID], tuple[datetime, UUID]] = {}
+        for chat_id, user_id, created_at, message_id in marks:
+            if (key := (chat_id, user_id)) not in latest or latest[key] < (created_at, message_id):
+                latest[key] = (created_at, message_id)
+        if not latest:
+            return
+        read_at = datetime.utcnow()
+        rows = [
+            {
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "message_created_at": created_at,
+                "message_id": message_id,
+                "read_at": read_at,
+            }
+            for (chat_id, user_id), (created_at, message_id) in latest.items()
+        ]
+        query = self.dialect_insert(session)(ReadWatermarkModel)
+        query = query.on_conflict_do_update(
+            index_elements=["chat_id", "user_id"],
+            set_={
+                "message_created_at": query.excluded.message_created_at,
+                "message_id": query.excluded.message_id,
+                "read_at": query.excluded.read_at,
+            },
+            # watermarks only move forward, late or replayed deliveries are no-ops
+            where=tuple_(ReadWatermarkModel.message_created_at, ReadWatermarkModel.message_id)
+            < tuple_(query.excluded.message_created_at, query.excluded.message_id),
+        )
+        await session.execute(query, rows)
 
 
 chats_repository = ChatsRepository()
 messages_repository = MessagesRepository()
 users_chats_repository = UsersChatsRepository()
-read_statuses_repository = ReadStatusesRepository()
+read_watermarks_repository = ReadWatermarksRepository()
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from app.models.mail import OutboxMail as OutboxMailModel
+from app.repositories.base import BaseRepository
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class MailOutboxRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(model=OutboxMailModel)
+
+    async def enqueue(self, session: AsyncSession, recipients: list[str], subject: str, body: str) -> OutboxMailModel:
+        return await self.create(
+            instance=OutboxMailModel(recipients=recipients, subject=subject, body=body), session=session
+        )
+
+    async def claim(self, session: AsyncSession, now: datetime, lease: timedelta, limit: int) -> list[OutboxMailModel]:
+        # skip locked hands every sender its own batch, the lease hides it from the others until it is finished
+        due = (
+            select(OutboxMailModel.id)
+            .where(OutboxMailModel.next_attempt_at <= now)
+            .order_by(OutboxMailModel.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        query = (
+            update(OutboxMailModel)
+            .where(OutboxMailModel.id.in_(due), OutboxMailModel.next_attempt_at <= now)
+            .values(next_attempt_at=now + lease, attempts=OutboxMailModel.attempts + 1)
+            .returning(OutboxMailModel)
+            .execution_options(synchronize_session=False)
+        )
+        return (await session.scalars(query)).all()
+
+    async def finish(self, session: AsyncSession, sent: list[UUID], failed: list[dict]) -> None:
+        if sent:
+            await session.execute(
+                delete(OutboxMailModel).where(OutboxMailModel.id.in_(sent)).execution_options(synchronize_session=False)
+            )
+        if failed:
+            # bulk update by primary key, one executemany for the whole batch
+            await session.execute(update(OutboxMailModel), failed)
+
+
+mail_outbox_repository = MailOutboxRepository()
@@ -0,0 +1,73 @@
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+
+from app.utils.partitions import PARTITIONED, add_months, months_between, parse_partition, partition_name
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# names only ever come from partition_name, ddl takes no bound parameters
+
+
+class PartitionsRepository:
+    async def try_lock(self, session: AsyncSession, name: str) -> bool:
+        # held until the transaction ends, a second worker skips instead of waiting
+        return await session.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"), {"name": name})
+
+    async def set_lock_timeout(self, session: AsyncSession, seconds: float) -> None:
+        await session.execute(text(f"SET LOCAL lock_timeout = '{int(seconds * 1000)}ms'"))
+
+    async def attached(self, session: AsyncSession, parent: str) -> list[tuple[str, datetime]]:
+        query = text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE parent.relname = :parent AND pg_table_is_visible(parent.oid)"
+        )
+        names = (await session.scalars(query, {"parent": parent})).all()
+        return sorted(partition for name in names if (partition := parse_partition(name)))
+
+    async def detached(self, session: AsyncSession, parent: str) -> list[tuple[str, datetime]]:
+        # left behind by a detach whose archive has not been written yet
+        query = text(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relname LIKE :pattern AND pg_table_is_visible(oid) "
+            "AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE pg_inherits.inhrelid = pg_class.oid)"
+        )
+        names = (await session.scalars(query, {"pattern": f"{parent}_p%"})).all()
+        return sorted(partition for name in names if (partition := parse_partition(name)))
+
+    async def create(self, session: AsyncSession, parent: str, month: datetime) -> None:
+        await session.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(parent, month)} PARTITION OF {parent} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+            )
+        )
+
+    async def ensure(self, session: AsyncSession, start: datetime, end: datetime) -> int:
+        # every partitioned table gets a partition for each month of [start, end) it does not have yet
+        created = 0
+        for parent in PARTITIONED:
+            existing = {month for _, month in await self.attached(session, parent)}
+            for month in months_between(start, end):
+                if month not in existing:
+                    await self.create(session=session, parent=parent, month=month)
+                    created += 1
+        return created
+
+    async def detach(self, session: AsyncSession, parent: str, month: datetime) -> None:
+        name = partition_name(parent, month)
+        await session.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {name}"))
+        # the detached table keeps its parent's foreign keys, which would pin the referenced month in place
+        query = text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'")
+        for constraint in (await session.scalars(query, {"name": name})).all():
+            await session.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+
+    async def copy_out(self, session: AsyncSession, name: str, write: Callable[[bytes], Awaitable[None]]) -> None:
+        connection = await (await session.connection()).get_raw_connection()
+        await connection.driver_connection.copy_from_table(name, output=write, format="csv", header=True)
+
+    async def drop(self, session: AsyncSession, name: str) -> None:
+        await session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+
+partitions_repository = PartitionsRepository()
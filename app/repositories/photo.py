@@ -1,6 +1,12 @@
 import os
+from functools import partial
 from typing import TypeVar
+from uuid import UUID
 
+from app.config import media_settings
+from app.database import after_commit
+from app.utils.images import image_pipeline
+from app.utils.media import remove_in_background, save_upload
 from fastapi import UploadFile
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -10,20 +16,43 @@ TypeModel = TypeVar("TypeModel")
 class PhotoRepository:
     async def upload_photo(self, instance: TypeModel, photo: UploadFile, session: AsyncSession) -> TypeModel:
         cls = type(instance)
-        if instance.avatar and os.path.exists(instance.avatar):
-            os.remove(instance.avatar)
-        photo_path = os.path.join("media", cls.__name__.lower(), instance.username, photo.filename)
-        if not os.path.exists(os.path.dirname(photo_path)):
-            os.makedirs(os.path.dirname(photo_path))
-        with open(photo_path, "wb") as buffer:
-            buffer.write(await photo.read())
-        instance.avatar = photo_path
-        return await self.update(instance=instance, session=session)
-
-    def download_photo(self, instance: TypeModel):
-        if instance.avatar and os.path.exists(instance.avatar):
-            return instance.avatar
+        previous = instance.avatar
+        path = await save_upload(
+            upload=photo,
+            directory=os.path.join(media_settings.media_root, cls.__name__.lower(), str(instance.id)),
+            max_size=media_settings.avatar_max_size,
+            content_types=media_settings.avatar_content_types,
+            chunk_size=media_settings.upload_chunk_size,
+        )
+        try:
+            await image_pipeline.render(path)
+        except Exception:
+            if path != previous:
+                remove_in_background(path, *image_pipeline.variants(path))
+            raise
+        await self.update_where({"avatar": path}, session=session, id=instance.id)
+        instance.avatar = path
+        if previous and previous != path:
+            after_commit(partial(remove_in_background, previous, *image_pipeline.variants(previous)))
+        return instance
+
+    def photo_path(self, model: type, id: UUID, name: str) -> str:
+        return os.path.join(media_settings.media_root, model.__name__.lower(), str(id), name)
+
+    def download_photo(self, instance: TypeModel, size: int | None = None, image_format: str | None = None):
+        if not instance.avatar:
+            return None
+        return self.pick_photo(path=instance.avatar, size=size, image_format=image_format)
+
+    def pick_photo(self, path: str, size: int | None = None, image_format: str | None = None) -> str | None:
+        if size and image_format:
+            # avatars uploaded before variants existed fall back to the original
+            if os.path.exists(variant := image_pipeline.pick(path, size=size, image_format=image_format)):
+                return variant
+        if os.path.exists(path):
+            return path
 
     def delete_photo(self, instance: TypeModel):
         if instance.avatar and os.path.exists(instance.avatar):
             os.remove(instance.avatar)
+            remove_in_background(*image_pipeline.variants(instance.avatar))
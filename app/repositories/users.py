@@ -1,11 +1,110 @@
+from datetime import datetime
+from uuid import UUID
+
+from app.models.users import TokenRevocation as TokenRevocationModel
 from app.models.users import User as UserModel
 from app.repositories.base import BaseRepository
 from app.repositories.photo import PhotoRepository
+from sqlalchemy import Float, and_, cast, delete, func, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# trigram matching needs at least one full trigram to use the GIN index
+FUZZY_MIN_LENGTH = 3
 
 
 class UsersRepository(BaseRepository, PhotoRepository):
     def __init__(self):
         super().__init__(model=UserModel)
 
+    async def search(
+        self,
+        session: AsyncSession,
+        data: str,
+        mode: str,
+        limit: int,
+        after: tuple | None = None,
+    ) -> list[tuple[UserModel, float | None, str]]:
+        value = data.lower()
+        postgres = session.bind.dialect.name == "postgresql"
+        rank = None
+        if mode == "email":
+            key = func.lower(UserModel.email)
+            condition = key == value
+        elif mode == "fuzzy" and len(value) >= FUZZY_MIN_LENGTH:
+            key = func.lower(UserModel.username)
+            if postgres:
+                condition = or_(key.contains(value, autoescape=True), key.op("%")(value))
+                rank = func.similarity(key, value)
+            else:
+                condition = key.contains(value, autoescape=True)
+                rank = cast(func.length(value), Float) / func.length(key)
+        else:
+            key = func.lower(UserModel.username)
+            if postgres:
+                key = key.collate("C")
+            condition = key.startswith(value, autoescape=True)
+
+        if rank is None:
+            query = select(UserModel, key).where(condition)
+            if after:
+                query = query.where(tuple_(key, UserModel.id) > tuple(after[1:]))
+            query = query.order_by(key, UserModel.id)
+        else:
+            query = select(UserModel, rank, key).where(condition)
+            if after:
+                after_rank, after_key, after_id = after
+                query = query.where(
+                    or_(rank < after_rank, and_(rank == after_rank, tuple_(key, UserModel.id) > (after_key, after_id)))
+                )
+            query = query.order_by(rank.desc(), key, UserModel.id)
+        rows = (await session.execute(query.limit(limit))).all()
+        if rank is None:
+            return [(user, None, user_key) for user, user_key in rows]
+        return [tuple(row) for row in rows]
+
+    async def bump_session_version(self, session: AsyncSession, user_id: UUID) -> int:
+        query = (
+            update(UserModel)
+            .where(UserModel.id == user_id)
+            .values(session_version=UserModel.session_version + 1)
+            .returning(UserModel.session_version)
+            .execution_options(synchronize_session=False)
+        )
+        return await session.scalar(query)
+
+
+class TokenRevocationsRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(model=TokenRevocationModel)
+
+    async def revoke(
+        self,
+        session: AsyncSession,
+        id: UUID,
+        user_id: UUID,
+        expires_at: datetime,
+        session_version: int | None = None,
+    ) -> bool:
+        # False when the id was revoked before, which makes it a single-use claim for rotated tokens
+        query = (
+            self.dialect_insert(session)(TokenRevocationModel)
+            .values(id=id, user_id=user_id, session_version=session_version, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=["id"])
+            .returning(TokenRevocationModel.id)
+        )
+        return await session.scalar(query) is not None
+
+    async def changes(
+        self, session: AsyncSession, now: datetime, since: datetime | None = None
+    ) -> list[TokenRevocationModel]:
+        query = select(TokenRevocationModel).where(TokenRevocationModel.expires_at > now)
+        if since is not None:
+            query = query.where(TokenRevocationModel.revoked_at > since)
+        return (await session.scalars(query.order_by(TokenRevocationModel.revoked_at))).all()
+
+    async def purge(self, session: AsyncSession, now: datetime) -> None:
+        await session.execute(delete(TokenRevocationModel).where(TokenRevocationModel.expires_at <= now))
+
 
 users_repository = UsersRepository()
+token_revocations_repository = TokenRevocationsRepository()
@@ -0,0 +1,30 @@
+from typing import Literal
+from uuid import UUID
+
+from app.controllers.users import users_controller
+from app.utils.media import IMMUTABLE, file_response
+from fastapi import APIRouter, Header, Path, Query
+
+# no session dependency, content addressed avatars are served straight from disk
+router = APIRouter(
+    prefix="/users",
+    tags=["users"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/{user_id}/avatar/{name}", summary="Get User Avatar By Url")
+async def get_public_avatar(
+    user_id: UUID,
+    name: str = Path(pattern=r"^[0-9a-f]{64}\.(jpg|png|gif|webp)$"),
+    size: int | None = Query(default=None, ge=1, le=4096),
+    image_format: Literal["webp", "jpeg"] | None = Query(default=None, alias="format"),
+    accept: str = Header(default=""),
+    if_none_match: str | None = Header(default=None),
+):
+    avatar = users_controller.get_public_avatar(
+        user_id=user_id, name=name, size=size, image_format=image_format, accept=accept
+    )
+    # only a negotiated format depends on the accept header
+    headers = {"Vary": "Accept"} if size and not image_format else None
+    return file_response(avatar, cache_control=IMMUTABLE, if_none_match=if_none_match, headers=headers)
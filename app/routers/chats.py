@@ -1,15 +1,31 @@
+from datetime import datetime
+from typing import Literal
 from uuid import UUID
 
-from app.config import oauth2_scheme
+from app.config import oauth2_scheme, pagination_settings, websocket_oauth2_scheme
 from app.controllers.chats import chats_controller
 from app.controllers.users import users_controller
+from app.database import bind_session, get_session, unit_of_work
+from app.exceptions.chats import NotAllowedException
 from app.schemas.chats import Chat as ChatSchema
-from app.schemas.chats import Message as MessageSchema
+from app.schemas.chats import CreateMessage as CreateMessageSchema
+from app.schemas.chats import InboxPage as InboxPageSchema
+from app.schemas.chats import MessageSearchPage as MessageSearchPageSchema
+from app.schemas.chats import MessagesPage as MessagesPageSchema
 from app.schemas.chats import ShowChat as ShowChatSchema
 from app.schemas.users import UserMember as UserMemberSchema
-from fastapi import APIRouter, Depends, WebSocket, status
-
-router = APIRouter(prefix="/chats", tags=["chats"], responses={404: {"description": "Not found"}})
+from app.utils.export import MEDIA_TYPES
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect, WebSocketException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+router = APIRouter(
+    prefix="/chats",
+    tags=["chats"],
+    responses={404: {"description": "Not found"}},
+    dependencies=[Depends(unit_of_work, scope="function")],
+)
+websocket_router = APIRouter(prefix="/chats", tags=["chats"])
 
 
 @router.get("/all/", response_model=list[ShowChatSchema])
@@ -18,6 +34,40 @@ async def get_chats(token: str = Depends(oauth2_scheme)):
     return await chats_controller.get_chats(user=current_user)
 
 
+@router.get(
+    "/inbox/",
+    response_model=InboxPageSchema,
+    status_code=status.HTTP_200_OK,
+    summary="Get chats with last message and unread count",
+)
+async def get_inbox(
+    cursor: str | None = None,
+    limit: int = Query(default=pagination_settings.page_size, ge=1, le=pagination_settings.max_page_size),
+    token: str = Depends(oauth2_scheme),
+):
+    current_user = await users_controller.verify_token(token=token)
+    return await chats_controller.get_inbox(user=current_user, limit=limit, cursor=cursor)
+
+
+@router.get(
+    "/search/",
+    response_model=MessageSearchPageSchema,
+    status_code=status.HTTP_200_OK,
+    summary="Search messages in the user's chats",
+)
+async def search_messages(
+    q: str = Query(min_length=1, max_length=256),
+    chat_id: UUID | None = None,
+    cursor: str | None = None,
+    limit: int = Query(default=pagination_settings.page_size, ge=1, le=pagination_settings.max_page_size),
+    token: str = Depends(oauth2_scheme),
+):
+    current_user = await users_controller.verify_token(token=token)
+    return await chats_controller.search_messages(
+        user=current_user, terms=q, limit=limit, chat_id=chat_id, cursor=cursor
+    )
+
+
 @router.post(
     "/new/",
     response_model=ChatSchema,
@@ -34,16 +84,48 @@ async def create_chat(
 
 @router.get(
     "/{chat_id}/messages/",
-    response_model=list[MessageSchema],
+    response_model=MessagesPageSchema,
+    response_model_exclude_unset=True,
     status_code=status.HTTP_200_OK,
     summary="Get messages for chat",
 )
 async def get_messages(
     chat_id: UUID,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = Query(default=pagination_settings.page_size, ge=1, le=pagination_settings.max_page_size),
+    read_statuses: Literal["full", "count", "own"] = "full",
     token: str = Depends(oauth2_scheme),
 ):
     current_user = await users_controller.verify_token(token=token)
-    return await chats_controller.get_messages(user=current_user, chat_id=chat_id)
+    return await chats_controller.get_messages(
+        user=current_user, chat_id=chat_id, limit=limit, before=before, after=after, read_statuses=read_statuses
+    )
+
+
+@router.get(
+    "/{chat_id}/export/",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Export chat history, oldest first",
+)
+async def export_messages(
+    chat_id: UUID,
+    export_format: Literal["ndjson", "csv"] = Query(default="ndjson", alias="format"),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+    token: str = Depends(oauth2_scheme),
+):
+    current_user = await users_controller.verify_token(token=token)
+    content = await chats_controller.export_messages(
+        user=current_user, chat_id=chat_id, export_format=export_format, since=since, until=until, cursor=cursor
+    )
+    return StreamingResponse(
+        content,
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="chat-{chat_id}.{export_format}"'},
+    )
 
 
 @router.post(
@@ -55,7 +137,9 @@ async def get_messages(
 async def add_member(chat_id: UUID, member: UserMemberSchema, token: str = Depends(oauth2_scheme)):
     user = await users_controller.verify_token(token=token)
     await chats_controller.add_member(chat_id=chat_id, member=member, user=user)
-    return await chats_controller.get_members(chat_id=chat_id, user=user)
+    members = await chats_controller.get_members(chat_id=chat_id, user=user)
+    # the membership index only changes once this request commits
+    return members if member in members else [*members, member]
 
 
 @router.delete(
@@ -67,7 +151,8 @@ async def add_member(chat_id: UUID, member: UserMemberSchema, token: str = Depen
 async def remove_member(chat_id: UUID, member: UserMemberSchema, token: str = Depends(oauth2_scheme)):
     user = await users_controller.verify_token(token=token)
     await chats_controller.remove_member(chat_id=chat_id, member=member, user=user)
-    return await chats_controller.get_members(chat_id=chat_id, user=user)
+    members = await chats_controller.get_members(chat_id=chat_id, user=user)
+    return [other for other in members if other.id != member.id]
 
 
 @router.get(
@@ -81,21 +166,28 @@ async def members(chat_id: UUID, token: str = Depends(oauth2_scheme)):
     return await chats_controller.get_members(chat_id=chat_id, user=user)
 
 
-@router.websocket("/{chat_id}/")
+@websocket_router.websocket("/{chat_id}/")
 async def chatting(
     websocket: WebSocket,
     chat_id: UUID,
-    message_schema: MessageSchema,
-    token: str = Depends(oauth2_scheme),
+    token: str = Depends(websocket_oauth2_scheme),
+    session: AsyncSession = Depends(get_session),
 ):
-    user = await users_controller.verify_token(token=token)
-    await chats_controller.check_allowed_user(user=user, chat_id=chat_id)
-    await chats_controller.connect(websocket=websocket, user=user)
+    async with bind_session(session=session):
+        user = await users_controller.verify_token(token=token)
+        allowed = await chats_controller.check_allowed_user(user=user, chat_id=chat_id)
+    if not allowed:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION)
+    connection = await chats_controller.connect(websocket=websocket, user=user, chat_id=chat_id)
     try:
         while True:
             data = await websocket.receive_text()
-            await chats_controller.send_message(data=data, chat_id=chat_id, user=user, message_schema=message_schema)
-    except Exception as e:
-        print(e)
+            async with bind_session(session=session):
+                message = await chats_controller.send_message(
+                    chat_id=chat_id, user=user, message_schema=CreateMessageSchema(content=data)
+                )
+            chats_controller.acknowledge(connection=connection, message=message)
+    except (WebSocketDisconnect, NotAllowedException):
+        pass
     finally:
-        await chats_controller.disconnect(user_id=user.id)
+        await chats_controller.disconnect(connection=connection)
@@ -1,18 +1,28 @@
-from app.config import oauth2_scheme
+from typing import Literal
+
+from app.config import oauth2_scheme, pagination_settings
 from app.controllers.users import users_controller
+from app.database import unit_of_work
 from app.schemas.tokens import Token
 from app.schemas.users import ResetPassword as ResetPasswordSchema
 from app.schemas.users import UpdatePassword as UpdatePasswordSchema
 from app.schemas.users import UserCreate as UserCreateSchema
 from app.schemas.users import UserEmail as UserEmailSchema
 from app.schemas.users import UserShow as UserShowSchema
+from app.schemas.users import UsersPage as UsersPageSchema
 from app.schemas.users import UserUpdate as UserUpdateSchema
-from app.utils.mail import html_reset_password_mail, send_mail
-from fastapi import APIRouter, Depends, Response, UploadFile, status
-from fastapi.responses import FileResponse
+from app.services.mail import mail_outbox
+from app.utils.mail import html_reset_password_mail
+from app.utils.media import file_response
+from fastapi import APIRouter, Cookie, Depends, Header, Query, Response, UploadFile, status
 from fastapi.security import OAuth2PasswordRequestForm
 
-router = APIRouter(prefix="/users", tags=["users"], responses={404: {"description": "Not found"}})
+router = APIRouter(
+    prefix="/users",
+    tags=["users"],
+    responses={404: {"description": "Not found"}},
+    dependencies=[Depends(unit_of_work, scope="function")],
+)
 
 
 @router.post(
@@ -31,9 +41,11 @@ async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
     username = form_data.username
-    await users_controller.authenticate_user(username=username, password=form_data.password)
-    access_token = users_controller.create_token(subject=username)
-    refresh_token = users_controller.create_token(subject=username, token_type="refresh")
+    user = await users_controller.authenticate_user(username=username, password=form_data.password)
+    access_token = users_controller.create_token(subject=username, session_version=user.session_version)
+    refresh_token = users_controller.create_token(
+        subject=username, token_type="refresh", session_version=user.session_version
+    )
     response.set_cookie(key="access_token", value=access_token, httponly=True)
     response.set_cookie(key="refresh_token", value=refresh_token, httponly=True)
     return {
@@ -42,8 +54,12 @@ async def login(
 
 
 @router.delete("/logout/", status_code=status.HTTP_200_OK, summary="Logout")
-async def logout(response: Response, token: str = Depends(oauth2_scheme)):
-    await users_controller.verify_token(token=token)
+async def logout(
+    response: Response,
+    token: str = Depends(oauth2_scheme),
+    refresh_token: str | None = Cookie(default=None),
+):
+    await users_controller.logout(token=token, refresh_token=refresh_token)
     response.delete_cookie(key="access_token")
     response.delete_cookie(key="refresh_token")
     return {"detail": "logout"}
@@ -67,12 +83,14 @@ async def change_password(data: UpdatePasswordSchema, token: str = Depends(oauth
 )
 async def forgot_password(data: UserEmailSchema):
     email = data.email
-    await users_controller.get_user_or_404(email=email)
-    reset_password_token = users_controller.create_token(subject=email, token_type="reset")
+    user = await users_controller.get_user_or_404(email=email)
+    reset_password_token = users_controller.create_token(
+        subject=email, token_type="reset", session_version=user.session_version
+    )
     subject = "Reset password"
     recipients = [email]
     body = html_reset_password_mail(reset_password_token=reset_password_token)
-    await send_mail(subject=subject, recipients=recipients, body=body)
+    await mail_outbox.send_mail(subject=subject, recipients=recipients, body=body)
     return {"detail": "reset token sent"}
 
 
@@ -96,9 +114,7 @@ async def reset_password(
     summary="Refresh Access Token",
 )
 async def refresh_token(response: Response, refresh_token: str):
-    user = await users_controller.verify_token(token=refresh_token, token_type="refresh")
-    access_token = users_controller.create_token(subject=user.username)
-    new_refresh_token = users_controller.create_token(subject=user.username, token_type="refresh")
+    access_token, new_refresh_token = await users_controller.refresh_tokens(token=refresh_token)
 
     response.set_cookie(key="access_token", value=access_token, httponly=True)
     response.set_cookie(key="refresh_token", value=new_refresh_token, httponly=True)
@@ -115,18 +131,25 @@ async def refresh_token(response: Response, refresh_token: str):
     summary="Get user info",
 )
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    return await users_controller.verify_token(token=token)
+    user = await users_controller.verify_token(token=token)
+    return await users_controller.get_profile(user=user)
 
 
 @router.get(
     "/search/{data}",
-    response_model=list[UserShowSchema],
+    response_model=UsersPageSchema,
     status_code=status.HTTP_200_OK,
     summary="Search users",
 )
-async def search_users(data: str, token: str = Depends(oauth2_scheme)):
+async def search_users(
+    data: str,
+    mode: Literal["prefix", "fuzzy", "email"] = "prefix",
+    cursor: str | None = None,
+    limit: int = Query(default=pagination_settings.page_size, ge=1, le=pagination_settings.max_page_size),
+    token: str = Depends(oauth2_scheme),
+):
     await users_controller.verify_token(token=token)
-    return await users_controller.search_users(data=data)
+    return await users_controller.search_users(data=data, mode=mode, limit=limit, cursor=cursor)
 
 
 @router.put(
@@ -151,10 +174,21 @@ async def update_user_avatar(photo: UploadFile, token: str = Depends(oauth2_sche
 
 
 @router.get("/avatar/", status_code=status.HTTP_200_OK, summary="Get User Avatar")
-async def get_avatar(token: str = Depends(oauth2_scheme)):
+async def get_avatar(
+    size: int | None = Query(default=None, ge=1, le=4096),
+    image_format: Literal["webp", "jpeg"] | None = Query(default=None, alias="format"),
+    accept: str = Header(default=""),
+    if_none_match: str | None = Header(default=None),
+    token: str = Depends(oauth2_scheme),
+):
     current_user = await users_controller.verify_token(token=token)
-    avatar = users_controller.get_avatar(user=current_user)
-    return FileResponse(avatar) if avatar else {"detail": "no avatar"}
+    avatar = users_controller.get_avatar(user=current_user, size=size, image_format=image_format, accept=accept)
+    if not avatar:
+        return {"detail": "no avatar"}
+    # same url for every upload, so caches revalidate against the etag
+    return file_response(
+        avatar, cache_control="private, no-cache", if_none_match=if_none_match, headers={"Vary": "Accept"}
+    )
 
 
 @router.delete("/avatar/", status_code=status.HTTP_200_OK, summary="Delete User Avatar")
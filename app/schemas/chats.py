@@ -10,11 +10,21 @@ class ReadStatus(BaseModel):
 
 
 class Message(BaseModel):
+    id: UUID
     created_at: datetime
     from_user_id: UUID
     chat_id: UUID
     content: str
-    read_statuses: list[ReadStatus]
+    read_statuses: list[ReadStatus] | None = None
+    read_count: int | None = None
+    is_read: bool | None = None
+
+
+class MessagesPage(BaseModel):
+    items: list[Message]
+    before_cursor: str | None = None
+    after_cursor: str | None = None
+    has_more: bool
 
 
 class CreateMessage(BaseModel):
@@ -32,3 +42,42 @@ class ShowChat(BaseModel):
     name: str
     private: bool
     active: bool
+
+
+class MessagePreview(BaseModel):
+    id: UUID
+    from_user_id: UUID
+    content: str
+    created_at: datetime
+
+
+class InboxChat(BaseModel):
+    id: UUID
+    name: str | None = None
+    private: bool
+    active: bool
+    last_message: MessagePreview | None = None
+    last_activity: datetime | None = None
+    unread_count: int
+    unread_label: str
+
+
+class InboxPage(BaseModel):
+    items: list[InboxChat]
+    cursor: str | None = None
+
+
+class MessageSearchHit(BaseModel):
+    id: UUID
+    created_at: datetime
+    from_user_id: UUID
+    chat_id: UUID
+    content: str
+    rank: float
+    snippet: str
+    highlights: list[tuple[int, int]]
+
+
+class MessageSearchPage(BaseModel):
+    items: list[MessageSearchHit]
+    cursor: str | None = None
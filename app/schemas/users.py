@@ -1,6 +1,7 @@
+import os
 from uuid import UUID
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, computed_field
 
 
 class User(BaseModel):
@@ -22,6 +23,18 @@ class UserShow(BaseModel):
     username: str
     email: str | None = None
     full_name: str | None = None
+    avatar: str | None = Field(default=None, exclude=True)
+
+    @computed_field
+    @property
+    def avatar_url(self) -> str | None:
+        # the file name is the content hash, a new upload gets a new url
+        return f"/users/{self.id}/avatar/{os.path.basename(self.avatar)}" if self.avatar else None
+
+
+class UsersPage(BaseModel):
+    items: list[UserShow]
+    cursor: str | None = None
 
 
 class UserUpdate(BaseModel):
@@ -1,20 +1,26 @@
+from datetime import datetime
+from functools import partial
 from uuid import UUID
 
-from app.database import with_async_session
+from app.config import cache_settings, pagination_settings, search_settings
+from app.database import on_commit, with_async_session, with_replica_session
 from app.models.chats import Chat as ChatModel
 from app.models.chats import Message as MessageModel
-from app.models.chats import ReadStatus as ReadStatusModel
+from app.models.chats import ReadWatermark as ReadWatermarkModel
 from app.models.chats import UserChat as UserChatModel
 from app.repositories.chats import (
     ChatsRepository,
     MessagesRepository,
-    ReadStatusesRepository,
+    ReadWatermarksRepository,
     UsersChatsRepository,
     chats_repository,
     messages_repository,
-    read_statuses_repository,
+    read_watermarks_repository,
     users_chats_repository,
 )
+from app.utils.broadcast import BroadcastBackend, chat_broadcast
+from app.utils.membership import MembershipIndex
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -24,38 +30,119 @@ class ChatsService:
         chats_repository: ChatsRepository,
         messages_repository: MessagesRepository,
         users_chats_repository: UsersChatsRepository,
-        read_statuses_repository: ReadStatusesRepository,
+        read_watermarks_repository: ReadWatermarksRepository,
+        broadcast: BroadcastBackend,
     ) -> None:
         self.chats_repository = chats_repository
         self.messages_repository = messages_repository
         self.users_chats_repository = users_chats_repository
-        self.read_statuses_repository = read_statuses_repository
+        self.read_watermarks_repository = read_watermarks_repository
+        self.broadcast = broadcast
+        self.membership = MembershipIndex(
+            maxsize=cache_settings.membership_cache_size, ttl=cache_settings.membership_cache_ttl
+        )
 
     @with_async_session
-    async def get_chats(self, session: AsyncSession | None = None, **kwargs) -> ChatModel:
-        chats_ids = [
-            user_chat.chat_id for user_chat in await self.users_chats_repository.filter(session=session, **kwargs)
-        ]
-        return await self.chats_repository.filter(session=session, id__in=chats_ids)
+    async def get_chat_ids(self, user_id: UUID, session: AsyncSession | None = None) -> set[UUID]:
+        if (chats_ids := self.membership.get_chats(user_id)) is None:
+            chats_ids = self.membership.set_chats(
+                user_id,
+                await self.users_chats_repository.values_list(session, "chat_id", flat=True, user_id=user_id),
+            )
+        return chats_ids
+
+    @with_replica_session
+    async def get_chats(self, user_id: UUID, session: AsyncSession | None = None) -> list[ChatModel]:
+        if not (chats_ids := await self.get_chat_ids(user_id=user_id)):
+            return []
+        return await self.chats_repository.filter(session=session, id__in=list(chats_ids))
+
+    @with_replica_session
+    async def get_inbox(
+        self,
+        user_id: UUID,
+        limit: int,
+        after: tuple[datetime, UUID] | None = None,
+        session: AsyncSession | None = None,
+    ) -> list[Row]:
+        return await self.chats_repository.inbox(
+            session=session,
+            user_id=user_id,
+            limit=limit,
+            max_unread=pagination_settings.inbox_max_unread,
+            after=after,
+        )
 
     @with_async_session
-    async def get_members(self, chat_id: UUID, session: AsyncSession | None = None) -> list[UUID]:
-        chat_users = await self.users_chats_repository.filter(session=session, chat_id=chat_id)
-        return [chat_user.user_id for chat_user in chat_users]
+    async def load_members(self, chat_id: UUID, session: AsyncSession | None = None) -> set[UUID]:
+        user_ids = await self.users_chats_repository.values_list(session, "user_id", flat=True, chat_id=chat_id)
+        return self.membership.set_members(chat_id, user_ids)
+
+    @with_replica_session
+    async def read_members(self, chat_id: UUID, session: AsyncSession | None = None) -> list[UUID]:
+        # not cached, a lagging replica must not pin a stale member list for the cache ttl
+        return await self.users_chats_repository.values_list(session, "user_id", flat=True, chat_id=chat_id)
+
+    async def get_members(self, chat_id: UUID) -> list[UUID]:
+        if (user_ids := self.membership.get_members(chat_id)) is None:
+            return await self.read_members(chat_id=chat_id)
+        return list(user_ids)
+
+    async def is_member(self, chat_id: UUID, user_id: UUID) -> bool:
+        if (user_ids := self.membership.get_members(chat_id)) is None:
+            user_ids = await self.load_members(chat_id=chat_id)
+        return user_id in user_ids
+
+    @with_replica_session
+    async def get_messages(
+        self,
+        chat_id: UUID,
+        limit: int,
+        before: tuple[datetime, UUID] | None = None,
+        after: tuple[datetime, UUID] | None = None,
+        session: AsyncSession | None = None,
+    ) -> tuple[list[MessageModel], bool]:
+        return await self.messages_repository.paginate(
+            session=session, chat_id=chat_id, limit=limit, before=before, after=after
+        )
+
+    @with_replica_session
+    async def search_messages(
+        self,
+        chat_ids: list[UUID],
+        terms: str,
+        limit: int,
+        after: tuple[float, datetime, UUID] | None = None,
+        session: AsyncSession | None = None,
+    ) -> list[tuple[MessageModel, float, str]]:
+        return await self.messages_repository.search(
+            session=session,
+            chat_ids=chat_ids,
+            terms=terms,
+            limit=limit,
+            max_candidates=search_settings.search_max_candidates,
+            after=after,
+        )
+
+    @with_async_session
+    async def get_message(self, message_id: UUID, session: AsyncSession | None = None) -> MessageModel | None:
+        return await self.messages_repository.get(session=session, id=message_id)
 
     @with_async_session
-    async def get_messages(self, chat_id: UUID, session: AsyncSession | None = None) -> list[MessageModel]:
-        return await self.messages_repository.filter(session=session, chat_id=chat_id)
+    async def get_read_watermarks(
+        self, chat_id: UUID, user_id: UUID | None = None, session: AsyncSession | None = None
+    ) -> list[ReadWatermarkModel]:
+        return await self.read_watermarks_repository.of_members(session=session, chat_id=chat_id, user_id=user_id)
 
     @with_async_session
     async def send_message(self, message: MessageModel, session: AsyncSession | None = None) -> MessageModel:
         return await self.messages_repository.create(instance=message, session=session)
 
     @with_async_session
-    async def add_read_status(
-        self, read_status: ReadStatusModel, session: AsyncSession | None = None
-    ) -> ReadStatusModel:
-        return await self.read_statuses_repository.create(instance=read_status, session=session)
+    async def mark_read(
+        self, marks: list[tuple[UUID, UUID, datetime, UUID]], session: AsyncSession | None = None
+    ) -> None:
+        await self.read_watermarks_repository.advance(session=session, marks=marks)
 
     @with_async_session
     async def create_chat(self, chat: ChatModel, session: AsyncSession | None = None) -> ChatModel:
@@ -63,16 +150,36 @@ class ChatsService:
 
     @with_async_session
     async def add_member(self, user_chat: UserChatModel, session: AsyncSession | None = None):
-        await self.users_chats_repository.create(instance=user_chat, session=session)
+        # a concurrent add of the same member finds the existing row instead of failing on the unique index
+        await self.users_chats_repository.get_or_create(
+            instance=user_chat, session=session, index_elements=["chat_id", "user_id"]
+        )
+        on_commit(session, partial(self.publish_membership, user_chat.chat_id, user_chat.user_id, "add"))
 
     @with_async_session
-    async def remove_member(self, user_chat: UserChatModel, session: AsyncSession | None = None):
-        await self.users_chats_repository.delete(instance=user_chat, session=session)
+    async def remove_member(self, chat_id: UUID, user_id: UUID, session: AsyncSession | None = None):
+        await self.users_chats_repository.delete_where(session=session, chat_id=chat_id, user_id=user_id)
+        on_commit(session, partial(self.publish_membership, chat_id, user_id, "remove"))
+
+    def publish_membership(self, chat_id: UUID, user_id: UUID, action: str) -> None:
+        # applied here right away, every other worker's index follows once the event arrives
+        self.apply_membership(chat_id=chat_id, user_id=user_id, action=action)
+        self.broadcast.publish(
+            {"type": "member", "chat_id": str(chat_id), "user_id": str(user_id), "action": action},
+            key=f"member:{chat_id}:{user_id}",
+        )
+
+    def apply_membership(self, chat_id: UUID, user_id: UUID, action: str) -> None:
+        if action == "add":
+            self.membership.add(chat_id=chat_id, user_id=user_id)
+        else:
+            self.membership.remove(chat_id=chat_id, user_id=user_id)
 
 
 chats_service = ChatsService(
     chats_repository=chats_repository,
     messages_repository=messages_repository,
     users_chats_repository=users_chats_repository,
-    read_statuses_repository=read_statuses_repository,
+    read_watermarks_repository=read_watermarks_repository,
+    broadcast=chat_broadcast,
 )
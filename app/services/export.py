@@ -0,0 +1,76 @@
+import asyncio
+from collections.abc import AsyncIterator, Callable
+from datetime import datetime
+from uuid import UUID
+
+from app.config import export_settings
+from app.database import async_session
+from app.repositories.chats import MessagesRepository, messages_repository
+from app.utils.export import encode_rows, export_header
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class MessagesExporter:
+    def __init__(
+        self,
+        messages_repository: MessagesRepository,
+        batch_size: int,
+        max_running: int,
+        session_factory: Callable[[], AsyncSession] = async_session,
+    ) -> None:
+        self.messages_repository = messages_repository
+        self.batch_size = batch_size
+        self.max_running = max_running
+        self.session_factory = session_factory
+        self.running = 0
+        self.exported = 0
+        self._slots = asyncio.Semaphore(max_running)
+
+    @property
+    def busy(self) -> bool:
+        return self.running >= self.max_running
+
+    async def export(
+        self,
+        chat_id: UUID,
+        export_format: str,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        after: tuple[datetime, UUID] | None = None,
+    ) -> AsyncIterator[bytes]:
+        # runs while the response streams, after the request's unit of work is gone; every batch is read in a
+        # short session of its own, a slow client holds no connection or snapshot while it drains the last one
+        async with self._slots:
+            self.running += 1
+            try:
+                yield export_header(export_format)
+                while True:
+                    async with self.session_factory() as session:
+                        rows = await self.messages_repository.export_batch(
+                            session=session,
+                            chat_id=chat_id,
+                            limit=self.batch_size,
+                            since=since,
+                            until=until,
+                            after=after,
+                        )
+                    if not rows:
+                        break
+                    self.exported += len(rows)
+                    yield encode_rows(rows, export_format)
+                    if len(rows) < self.batch_size:
+                        break
+                    after = (rows[-1].created_at, rows[-1].id)
+            finally:
+                self.running -= 1
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"running": self.running, "max_running": self.max_running, "exported": self.exported}
+
+
+messages_exporter = MessagesExporter(
+    messages_repository=messages_repository,
+    batch_size=export_settings.export_batch_size,
+    max_running=export_settings.export_max_running,
+)
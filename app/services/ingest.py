@@ -0,0 +1,161 @@
+import asyncio
+import contextlib
+import logging
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from app.config import ingest_settings
+from app.database import after_commit, async_session, bind_session, stick_to_primary, with_async_session
+from app.models.chats import Message as MessageModel
+from app.repositories.chats import MessagesRepository, messages_repository
+from app.utils.replicas import is_unavailable
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+OnPersisted = Callable[[list[MessageModel]], None]
+
+
+class MessagesIngestor:
+    def __init__(
+        self,
+        messages_repository: MessagesRepository,
+        durability: str,
+        batch_size: int,
+        flush_interval: float,
+        queue_size: int,
+        session_factory: Callable[[], AsyncSession] = async_session,
+    ) -> None:
+        self.messages_repository = messages_repository
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.session_factory = session_factory
+        self.on_persisted: OnPersisted | None = None
+        self.enqueued = 0
+        self.persisted = 0
+        self.batches = 0
+        self.failed = 0
+        self._last_created_at = datetime.min
+        self._pending: list[tuple[dict, asyncio.Future]] = []
+        self._ready: asyncio.Event | None = None
+        self._running = False
+        self._flusher: asyncio.Task | None = None
+
+    async def start(self, on_persisted: OnPersisted | None = None) -> None:
+        self.on_persisted = on_persisted
+        if self.durability != "sync":
+            self._ready = asyncio.Event()
+            self._running = True
+            self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def stop(self) -> None:
+        # let the flusher drain instead of cancelling it halfway through a batch
+        if self._flusher:
+            self._running = False
+            self._ready.set()
+            await self._flusher
+            self._flusher = None
+        while self._pending:
+            await self._flush()
+
+    async def submit(self, chat_id: uuid.UUID, from_user_id: uuid.UUID, content: str) -> dict:
+        row = {
+            "id": uuid.uuid4(),
+            "created_at": self._stamp(),
+            "chat_id": chat_id,
+            "from_user_id": from_user_id,
+            "content": content,
+        }
+        self.enqueued += 1
+        # batches are written outside the sender's request, the sender is pinned to the primary here
+        stick_to_primary()
+        if self._flusher is None:
+            await self._insert(rows=[row])
+            return row
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self.batch_size:
+            self._ready.set()
+        # async acks on enqueue until the queue is full, then falls back to waiting like group commit
+        if self.durability == "group" or len(self._pending) > self.queue_size:
+            await future
+        return row
+
+    def _stamp(self) -> datetime:
+        # strictly increasing so enqueue order survives the (created_at, id) sort inside every chat
+        now = datetime.utcnow()
+        if now <= self._last_created_at:
+            now = self._last_created_at + timedelta(microseconds=1)
+        self._last_created_at = now
+        return now
+
+    @with_async_session
+    async def _insert(self, rows: list[dict], session: AsyncSession | None = None) -> None:
+        messages = await self.messages_repository.insert_many(session=session, rows=rows)
+        self.persisted += len(messages)
+        if self.on_persisted:
+            after_commit(lambda: self.on_persisted(messages))
+
+    async def _flush_forever(self) -> None:
+        while self._running or self._pending:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._ready.wait(), timeout=self.flush_interval)
+            while self._pending:
+                await self._flush()
+
+    async def _flush(self) -> None:
+        if self._ready is not None:
+            self._ready.clear()
+        batch, self._pending = self._pending[: self.batch_size], self._pending[self.batch_size :]
+        if not batch:
+            return
+        self.batches += 1
+        await self._persist(batch)
+
+    async def _persist(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        try:
+            async with self.session_factory() as session, bind_session(session=session):
+                messages = await self.messages_repository.insert_many(session=session, rows=[row for row, _ in batch])
+        except Exception as exc:
+            # one bad row fails the whole statement, the halves are retried until it is the only one left
+            if len(batch) > 1 and not is_unavailable(exc):
+                middle = len(batch) // 2
+                await self._persist(batch[:middle])
+                await self._persist(batch[middle:])
+                return
+            self.failed += len(batch)
+            logger.exception("persisting %s messages failed", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+                    # nobody awaits async acks, retrieve the exception so it is not reported again
+                    future.exception()
+            return
+        self.persisted += len(messages)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        if self.on_persisted:
+            self.on_persisted(messages)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "enqueued": self.enqueued,
+            "persisted": self.persisted,
+            "batches": self.batches,
+            "failed": self.failed,
+        }
+
+
+messages_ingestor = MessagesIngestor(
+    messages_repository=messages_repository,
+    durability=ingest_settings.ingest_durability,
+    batch_size=ingest_settings.ingest_batch_size,
+    flush_interval=ingest_settings.ingest_flush_interval,
+    queue_size=ingest_settings.ingest_queue_size,
+)
@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import logging
+import random
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+import aiosmtplib
+from app.config import mail_settings
+from app.database import async_session, bind_session, on_commit, with_async_session
+from app.models.mail import OutboxMail as OutboxMailModel
+from app.repositories.mail import MailOutboxRepository, mail_outbox_repository
+from app.utils.mail import SMTPConnection, build_message, smtp_connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+
+class MailOutbox:
+    def __init__(
+        self,
+        mail_outbox_repository: MailOutboxRepository,
+        connection_factory: Callable[[], SMTPConnection],
+        mail_from: str,
+        mail_from_name: str,
+        workers: int,
+        batch_size: int,
+        poll_interval: float,
+        lease: float,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        session_factory: Callable[[], AsyncSession] = async_session,
+    ) -> None:
+        self.mail_outbox_repository = mail_outbox_repository
+        self.connection_factory = connection_factory
+        self.mail_from = mail_from
+        self.mail_from_name = mail_from_name
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session_factory = session_factory
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.batches = 0
+        self._connections: list[SMTPConnection] = []
+        self._ready: asyncio.Event | None = None
+        self._running = False
+        self._senders: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._ready = asyncio.Event()
+        self._running = True
+        self._connections = [self.connection_factory() for _ in range(self.workers)]
+        self._senders = [asyncio.create_task(self._send_forever(connection)) for connection in self._connections]
+
+    async def stop(self) -> None:
+        # the batch in flight is finished, anything left waits in the table for the next start
+        self._running = False
+        if self._ready is not None:
+            self._ready.set()
+        await asyncio.gather(*self._senders)
+        self._senders = []
+        for connection in self._connections:
+            await connection.close()
+
+    @with_async_session
+    async def send_mail(self, subject: str, recipients: list[str], body: str, session: AsyncSession | None = None):
+        # stored with the caller's transaction, the senders only hear about it once it is committed
+        mail = await self.mail_outbox_repository.enqueue(
+            session=session, recipients=recipients, subject=subject, body=body
+        )
+        self.enqueued += 1
+        on_commit(session, self.wake)
+        return mail
+
+    def wake(self) -> None:
+        if self._ready is not None:
+            self._ready.set()
+
+    async def _send_forever(self, connection: SMTPConnection) -> None:
+        # woken by commits, the poll picks up retries and whatever the last run left behind
+        while self._running:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._ready.wait(), timeout=self.poll_interval)
+            self._ready.clear()
+            # a full batch means there is probably more waiting
+            while self._running:
+                try:
+                    claimed = await self._send_batch(connection)
+                except Exception:
+                    logger.exception("sending mail from the outbox failed")
+                    break
+                if claimed < self.batch_size:
+                    break
+
+    async def _send_batch(self, connection: SMTPConnection) -> int:
+        async with self.session_factory() as session, bind_session(session=session):
+            mails = await self.mail_outbox_repository.claim(
+                session=session, now=datetime.utcnow(), lease=self.lease, limit=self.batch_size
+            )
+        if not mails:
+            return 0
+        self.batches += 1
+        sent, failed = [], []
+        # one after another over the same connection, smtp has no pipelining across mails
+        unreachable = None
+        for mail in mails:
+            if unreachable is not None:
+                # the server is down, the rest of the batch is rescheduled without waiting on more timeouts
+                failed.append(self._failure(mail=mail, exc=unreachable))
+                continue
+            message = build_message(self.mail_from, self.mail_from_name, mail.recipients, mail.subject, mail.body)
+            try:
+                await connection.send(message)
+            except aiosmtplib.SMTPConnectError as exc:
+                unreachable = exc
+                failed.append(self._failure(mail=mail, exc=exc))
+            except Exception as exc:
+                failed.append(self._failure(mail=mail, exc=exc))
+            else:
+                sent.append(mail.id)
+        async with self.session_factory() as session, bind_session(session=session):
+            await self.mail_outbox_repository.finish(session=session, sent=sent, failed=failed)
+        # counted once the outcome is stored, like the sent ones
+        dead = sum(1 for failure in failed if failure["next_attempt_at"] is None)
+        self.sent += len(sent)
+        self.retried += len(failed) - dead
+        self.dead += dead
+        return len(mails)
+
+    def _failure(self, mail: OutboxMailModel, exc: Exception) -> dict:
+        permanent = isinstance(exc, aiosmtplib.SMTPResponseException) and exc.code >= 500
+        if permanent or mail.attempts >= self.max_attempts:
+            logger.error("giving up on mail %s after %s attempts: %s", mail.id, mail.attempts, exc)
+            next_attempt_at = None
+        else:
+            # exponential with full jitter so a flapping server is not hit by every retry at once
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (mail.attempts - 1))
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=random.uniform(delay / 2, delay))
+        return {"id": mail.id, "next_attempt_at": next_attempt_at, "last_error": str(exc)[:1000]}
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "workers": len(self._senders),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead": self.dead,
+            "batches": self.batches,
+            "connects": sum(connection.connects for connection in self._connections),
+        }
+
+
+mail_outbox = MailOutbox(
+    mail_outbox_repository=mail_outbox_repository,
+    connection_factory=smtp_connection,
+    mail_from=mail_settings.mail_from,
+    mail_from_name=mail_settings.mail_from_name,
+    workers=mail_settings.mail_workers,
+    batch_size=mail_settings.mail_batch_size,
+    poll_interval=mail_settings.mail_poll_interval,
+    lease=mail_settings.mail_lease,
+    max_attempts=mail_settings.mail_max_attempts,
+    backoff_base=mail_settings.mail_backoff_base,
+    backoff_max=mail_settings.mail_backoff_max,
+)
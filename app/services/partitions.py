@@ -0,0 +1,156 @@
+import asyncio
+import contextlib
+import gzip
+import logging
+import os
+import tempfile
+from collections.abc import Callable
+from datetime import datetime
+
+from app.config import partition_settings
+from app.database import async_session, bind_session
+from app.repositories.partitions import PartitionsRepository, partitions_repository
+from app.utils.partitions import PARTITIONED, add_months, month_start, partition_name
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# advisory lock shared by every worker
+MAINTENANCE_LOCK = "partition_maintenance"
+# detaching needs a brief exclusive lock on the parent, behind a long query it gives up and retries next run
+DETACH_LOCK_TIMEOUT = 2
+
+
+def _open_archive(directory: str) -> tuple[str, gzip.GzipFile]:
+    os.makedirs(directory, exist_ok=True)
+    descriptor, path = tempfile.mkstemp(dir=directory, prefix=".archive-")
+    return path, gzip.GzipFile(fileobj=os.fdopen(descriptor, "wb"), mode="wb")
+
+
+def _publish_archive(temporary: str, archive: gzip.GzipFile, path: str) -> None:
+    archive.close()
+    with open(temporary, "rb") as file:
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def _discard_archive(temporary: str, archive: gzip.GzipFile) -> None:
+    archive.close()
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(temporary)
+
+
+class PartitionMaintainer:
+    def __init__(
+        self,
+        partitions_repository: PartitionsRepository,
+        premake_months: int,
+        retention_months: int,
+        archive_root: str,
+        interval: float,
+        session_factory: Callable[[], AsyncSession] = async_session,
+    ) -> None:
+        self.partitions_repository = partitions_repository
+        self.premake_months = premake_months
+        self.retention_months = retention_months
+        self.archive_root = archive_root
+        self.interval = interval
+        self.session_factory = session_factory
+        self.created = 0
+        self.detached = 0
+        self.archived = 0
+        self.failed = 0
+        self._wake: asyncio.Event | None = None
+        self._running = False
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._wake = asyncio.Event()
+        self._running = True
+        self._task = asyncio.create_task(self._maintain_forever())
+
+    async def stop(self) -> None:
+        self._running = False
+        if self._task is not None:
+            self._wake.set()
+            await self._task
+            self._task = None
+
+    async def _maintain_forever(self) -> None:
+        # runs at start as well, inserts into a month without a partition fail
+        while self._running:
+            try:
+                await self.maintain(now=datetime.utcnow())
+            except Exception:
+                self.failed += 1
+                logger.exception("partition maintenance failed")
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+
+    async def maintain(self, now: datetime) -> None:
+        current = month_start(now)
+        await self.ensure(start=current, end=add_months(current, self.premake_months + 1))
+        if self.retention_months:
+            await self.archive(before=add_months(current, -self.retention_months))
+
+    async def ensure(self, start: datetime, end: datetime) -> None:
+        async with self.session_factory() as session, bind_session(session=session):
+            if session.bind.dialect.name != "postgresql":
+                return
+            if not await self.partitions_repository.try_lock(session=session, name=MAINTENANCE_LOCK):
+                return
+            self.created += await self.partitions_repository.ensure(session=session, start=start, end=end)
+
+    async def archive(self, before: datetime) -> None:
+        # detached in one short transaction, referencing months go first, then dumped and dropped one by one
+        async with self.session_factory() as session, bind_session(session=session):
+            if session.bind.dialect.name != "postgresql":
+                return
+            if not await self.partitions_repository.try_lock(session=session, name=MAINTENANCE_LOCK):
+                return
+            await self.partitions_repository.set_lock_timeout(session=session, seconds=DETACH_LOCK_TIMEOUT)
+            for parent in PARTITIONED:
+                for _, month in await self.partitions_repository.attached(session, parent):
+                    if month < before:
+                        await self.partitions_repository.detach(session=session, parent=parent, month=month)
+                        self.detached += 1
+        for parent in PARTITIONED:
+            async with self.session_factory() as session:
+                detached = await self.partitions_repository.detached(session, parent)
+            for _, month in detached:
+                await self._archive_partition(name=partition_name(parent, month))
+
+    async def _archive_partition(self, name: str) -> None:
+        async with self.session_factory() as session, bind_session(session=session):
+            if not await self.partitions_repository.try_lock(session=session, name=f"{MAINTENANCE_LOCK}:{name}"):
+                return
+            temporary, archive = await run_in_threadpool(_open_archive, self.archive_root)
+            try:
+
+                async def write(chunk: bytes) -> None:
+                    await run_in_threadpool(archive.write, chunk)
+
+                await self.partitions_repository.copy_out(session=session, name=name, write=write)
+                await run_in_threadpool(
+                    _publish_archive, temporary, archive, os.path.join(self.archive_root, f"{name}.csv.gz")
+                )
+            except BaseException:
+                await run_in_threadpool(_discard_archive, temporary, archive)
+                raise
+            # dropped only once the archive is on disk, a failed run leaves the table for the next one
+            await self.partitions_repository.drop(session=session, name=name)
+        self.archived += 1
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"created": self.created, "detached": self.detached, "archived": self.archived, "failed": self.failed}
+
+
+partition_maintainer = PartitionMaintainer(
+    partitions_repository=partitions_repository,
+    premake_months=partition_settings.partition_premake_months,
+    retention_months=partition_settings.partition_retention_months,
+    archive_root=partition_settings.partition_archive_root,
+    interval=partition_settings.partition_maintenance_interval,
+)
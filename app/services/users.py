@@ -1,28 +1,78 @@
-from app.database import with_async_session
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import partial
+from uuid import UUID
+
+from app.config import cache_settings, jwt_settings, revocation_settings
+from app.database import commit, on_commit, with_async_session, with_replica_session
 from app.models.users import User as UserModel
-from app.repositories.users import UsersRepository, users_repository
+from app.repositories.users import (
+    TokenRevocationsRepository,
+    UsersRepository,
+    token_revocations_repository,
+    users_repository,
+)
+from app.utils.broadcast import BroadcastBackend, chat_broadcast
+from app.utils.cache import TTLCache
+from app.utils.hashing import PasswordHasher, password_hasher
+from app.utils.revocation import RevocationStore
 from fastapi import UploadFile
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 class UsersService:
-    def __init__(self, users_repository: UsersRepository) -> None:
+    def __init__(
+        self,
+        users_repository: UsersRepository,
+        token_revocations_repository: TokenRevocationsRepository,
+        password_hasher: PasswordHasher,
+        revocations: RevocationStore,
+        broadcast: BroadcastBackend,
+    ) -> None:
         self.users_repository = users_repository
+        self.token_revocations_repository = token_revocations_repository
+        self.password_hasher = password_hasher
+        self.revocations = revocations
+        self.broadcast = broadcast
+        self.users_cache = TTLCache(maxsize=cache_settings.auth_cache_size, ttl=cache_settings.auth_cache_ttl)
+        self.purged_at = time.monotonic()
 
     @with_async_session
     async def get_user(self, session: AsyncSession | None = None, **kwargs) -> UserModel | None:
         return await self.users_repository.get(session=session, **kwargs)
 
-    @with_async_session
-    async def search_users(self, session: AsyncSession | None = None, **kwargs) -> list[UserModel] | None:
-        return await self.users_repository.filter(session=session, **kwargs)
+    @with_replica_session
+    async def get_profile(self, user_id: UUID, session: AsyncSession | None = None) -> UserModel | None:
+        # display only, a lagging replica must never decide on passwords or session versions
+        return await self.users_repository.get(session=session, id=user_id)
+
+    async def get_cached_user(self, username: str) -> UserModel | None:
+        if (values := self.users_cache.get(username)) is not None:
+            return UserModel(**values)
+        user = await self.get_user(username=username)
+        if user:
+            self.users_cache.set(username, {column.key: getattr(user, column.key) for column in UserModel.__table__.c})
+        return user
+
+    def invalidate_user(self, user: UserModel) -> None:
+        # dropped here right away, every other worker's cache follows once the event arrives
+        self.users_cache.pop(user.username)
+        self.broadcast.publish({"type": "user", "username": user.username}, key=f"user:{user.username}")
+
+    async def apply_invalidations(self, events: list[dict]) -> None:
+        for event in events:
+            self.users_cache.pop(event["username"])
+
+    @with_replica_session
+    async def search_users(
+        self, data: str, mode: str, limit: int, after: tuple | None = None, session: AsyncSession | None = None
+    ) -> list[tuple[UserModel, float | None, str]]:
+        return await self.users_repository.search(session=session, data=data, mode=mode, limit=limit, after=after)
 
     @with_async_session
     async def create(self, user: UserModel, session: AsyncSession | None = None) -> UserModel:
-        user.password = self.get_password_hash(user.password)
+        user.password = await self.get_password_hash(user.password)
         return await self.users_repository.create(instance=user, session=session)
 
     @with_async_session
@@ -30,29 +80,93 @@ class UsersService:
         self, username: str, password: str, session: AsyncSession | None = None
     ) -> UserModel | bool:
         user = await self.users_repository.get(session=session, username=username)
-        if not user:
+        if not user or not await self.verify_password(plain_password=password, hashed_password=user.password):
             return False
-        return user if self.verify_password(plain_password=password, hashed_password=user.password) else False
+        if upgraded := await self.password_hasher.upgrade(password=password, hashed_password=user.password):
+            await self.update(user=user, password=upgraded)
+        return user
 
     @with_async_session
-    async def update(self, user: UserModel, session: AsyncSession | None = None) -> UserModel:
-        return await self.users_repository.update(instance=user, session=session)
+    async def update(self, user: UserModel, session: AsyncSession | None = None, **values) -> UserModel:
+        # only the given columns are written, the user may be a cached snapshot with stale passwords and versions
+        await self.users_repository.update_where(values, session=session, id=user.id)
+        for key, value in values.items():
+            setattr(user, key, value)
+        on_commit(session, partial(self.invalidate_user, user=user))
+        return user
 
     @with_async_session
     async def update_avatar(self, user: UserModel, photo: UploadFile, session: AsyncSession | None = None) -> UserModel:
-        return await self.users_repository.upload_photo(instance=user, photo=photo, session=session)
+        user = await self.users_repository.upload_photo(instance=user, photo=photo, session=session)
+        on_commit(session, partial(self.invalidate_user, user=user))
+        return user
+
+    def get_avatar(self, user: UserModel, size: int | None = None, image_format: str | None = None) -> str | None:
+        return self.users_repository.download_photo(instance=user, size=size, image_format=image_format)
 
-    def get_avatar(self, user: UserModel) -> str | None:
-        return self.users_repository.download_photo(instance=user)
+    def get_public_avatar(
+        self, user_id: UUID, name: str, size: int | None = None, image_format: str | None = None
+    ) -> str | None:
+        # the name is the content hash from the avatar url, the file is looked up without the user row
+        path = self.users_repository.photo_path(model=UserModel, id=user_id, name=name)
+        return self.users_repository.pick_photo(path=path, size=size, image_format=image_format)
 
     def delete_avatar(self, user: UserModel):
         self.users_repository.delete_photo(instance=user)
 
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        return pwd_context.verify(plain_password, hashed_password)
+    def is_revoked(self, jti: UUID | None, user: UserModel, session_version: int) -> bool:
+        return self.revocations.is_revoked(id=jti, user_id=user.id, session_version=session_version)
+
+    @with_async_session
+    async def revoke_token(
+        self, jti: UUID, user: UserModel, expires_at: datetime, session: AsyncSession | None = None
+    ) -> bool:
+        revoked = await self.token_revocations_repository.revoke(
+            session=session, id=jti, user_id=user.id, expires_at=expires_at
+        )
+        on_commit(session, partial(self.revocations.add, id=jti, user_id=user.id, expires_at=expires_at))
+        return revoked
+
+    @with_async_session
+    async def revoke_sessions(self, user: UserModel, durable: bool = False, session: AsyncSession | None = None) -> int:
+        version = await self.users_repository.bump_session_version(session=session, user_id=user.id)
+        lifetime = max(jwt_settings.access_token_expire_minutes, jwt_settings.refresh_token_expire_minutes)
+        expires_at = datetime.utcnow() + timedelta(minutes=lifetime)
+        await self.token_revocations_repository.revoke(
+            session=session, id=uuid.uuid4(), user_id=user.id, expires_at=expires_at, session_version=version
+        )
+        add = partial(self.revocations.add, id=None, user_id=user.id, expires_at=expires_at, session_version=version)
+        on_commit(session, add)
+        on_commit(session, partial(self.invalidate_user, user=user))
+        if durable:
+            # the caller is about to fail the request, which would roll the revocation back with it
+            await commit(session=session)
+        return version
+
+    @with_async_session
+    async def sync_revocations(self, session: AsyncSession | None = None) -> None:
+        now = datetime.utcnow()
+        since = None
+        if self.revocations.cursor is not None:
+            since = self.revocations.cursor - timedelta(seconds=revocation_settings.revocation_sync_overlap)
+        changes = await self.token_revocations_repository.changes(session=session, now=now, since=since)
+        self.revocations.apply(changes)
+        self.revocations.evict(now=now)
+        if time.monotonic() - self.purged_at > revocation_settings.revocation_purge_interval:
+            self.purged_at = time.monotonic()
+            await self.token_revocations_repository.purge(session=session, now=now)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.password_hasher.verify(plain_password, hashed_password)
 
-    def get_password_hash(self, password) -> str:
-        return pwd_context.hash(password)
+    async def get_password_hash(self, password) -> str:
+        return await self.password_hasher.hash(password)
 
 
-users_service = UsersService(users_repository=users_repository)
+users_service = UsersService(
+    users_repository=users_repository,
+    token_revocations_repository=token_revocations_repository,
+    password_hasher=password_hasher,
+    revocations=RevocationStore(interval=revocation_settings.revocation_sync_interval),
+    broadcast=chat_broadcast,
+)
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -8,6 +10,11 @@ class PostgresSettings(BaseSettings):
     model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
 
     database_url: str
+    database_replica_urls: list[str]
+    database_replica_max_lag: float
+    database_replica_sticky_seconds: float
+    database_replica_sticky_size: int
+    database_replica_check_interval: float
 
     postgres_db: str
     postgres_host: str
@@ -38,6 +45,118 @@ class MailSettings(BaseSettings):
     mail_from: str
     mail_from_name: str
     mail_validate_certs: bool
+    mail_timeout: float
+    mail_idle_timeout: float
+    mail_workers: int
+    mail_batch_size: int
+    mail_poll_interval: float
+    mail_lease: float
+    mail_max_attempts: int
+    mail_backoff_base: float
+    mail_backoff_max: float
+
+
+class PasswordSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    password_schemes: list[str]
+    password_bcrypt_rounds: int
+    password_hash_workers: int
+    password_hash_queue_size: int
+
+
+class CacheSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    auth_cache_size: int
+    auth_cache_ttl: int
+    membership_cache_size: int
+    membership_cache_ttl: int
+
+
+class PaginationSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    page_size: int
+    max_page_size: int
+    inbox_max_unread: int
+
+
+class WebsocketSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    websocket_queue_size: int
+    websocket_slow_consumer_policy: Literal["drop", "disconnect"]
+    websocket_send_timeout: float
+
+
+class BroadcastSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    broadcast_backend: Literal["memory", "postgres"]
+    broadcast_channel: str
+    broadcast_batch_size: int
+    broadcast_flush_interval: float
+
+
+class IngestSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    ingest_durability: Literal["sync", "group", "async"]
+    ingest_batch_size: int
+    ingest_flush_interval: float
+    ingest_queue_size: int
+
+
+class SearchSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    search_max_candidates: int
+
+
+class ExportSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    export_batch_size: int
+    export_max_running: int
+
+
+class PartitionSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    partition_premake_months: int
+    partition_retention_months: int
+    partition_archive_root: str
+    partition_maintenance_interval: float
+
+
+class MediaSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    media_root: str
+    upload_chunk_size: int
+    avatar_max_size: int
+    avatar_content_types: list[str]
+    avatar_sizes: list[int]
+    avatar_formats: list[Literal["webp", "jpeg"]]
+    avatar_quality: int
+    image_workers: int
+    image_max_pixels: int
+
+
+class MetricsSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    slow_query_seconds: float
+    slow_query_sample_rate: float
+
+
+class RevocationSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_file="./.env.example", env_file_encoding="utf-8", extra="allow")
+
+    revocation_sync_interval: float
+    revocation_sync_overlap: float
+    revocation_purge_interval: float
 
 
 class OAuth2Settings(BaseSettings):
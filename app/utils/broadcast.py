@@ -0,0 +1,229 @@
+import abc
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import uuid
+from collections.abc import Awaitable, Callable
+
+import asyncpg
+from app.config import broadcast_settings, database_settings
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads are capped at 8000 bytes, leave room for the batch envelope
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+Handler = Callable[[list[dict]], Awaitable[None]]
+
+
+def event_type(event: dict) -> str:
+    # chat messages predate typed events and carry no type
+    return event.get("type", "message")
+
+
+class BroadcastBackend(abc.ABC):
+    def __init__(self, batch_size: int, flush_interval: float) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.origin = uuid.uuid4().hex
+        self.handlers: dict[str, Handler] = {}
+        self.published = 0
+        self.batches = 0
+        self.received = 0
+        self._pending: dict[str, dict] = {}
+        self._ready: asyncio.Event | None = None
+        self._running = False
+        self._flusher: asyncio.Task | None = None
+
+    def subscribe(self, event_type: str, handler: Handler) -> None:
+        self.handlers[event_type] = handler
+
+    async def start(self, handler: Handler) -> None:
+        self.subscribe("message", handler)
+        self._ready = asyncio.Event()
+        self._running = True
+        self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def stop(self) -> None:
+        # let the flusher drain instead of cancelling it halfway through a batch
+        if self._flusher:
+            self._running = False
+            self._ready.set()
+            await self._flusher
+            self._flusher = None
+        await self._flush()
+
+    def publish(self, event: dict, key: str | None = None) -> None:
+        # one event per message whatever the number of recipients, repeated publishes of a key coalesce
+        self._pending[key or event["message_id"]] = event
+        self.published += 1
+        if self._ready is not None and len(self._pending) >= self.batch_size:
+            self._ready.set()
+
+    async def _flush_forever(self) -> None:
+        while self._running or self._pending:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._ready.wait(), timeout=self.flush_interval)
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if self._ready is not None:
+            self._ready.clear()
+        if not self._pending:
+            return
+        events, self._pending = list(self._pending.values()), {}
+        self.batches += 1
+        await self._deliver(events)
+        try:
+            await self._send(events)
+        except Exception:
+            logger.exception("broadcast of %s events failed", len(events))
+
+    async def _deliver(self, events: list[dict]) -> None:
+        self.received += len(events)
+        # runs of one type go to its handler together, in the order they were published
+        for kind, run in itertools.groupby(events, key=event_type):
+            if (handler := self.handlers.get(kind)) is None:
+                continue
+            batch = list(run)
+            try:
+                await handler(batch)
+            except Exception:
+                logger.exception("delivery of %s %s events failed", len(batch), kind)
+
+    @abc.abstractmethod
+    async def _send(self, events: list[dict]) -> None:
+        # hands the batch to the other workers, the local handlers already had it
+        pass
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "published": self.published,
+            "batches": self.batches,
+            "received": self.received,
+        }
+
+
+class MemoryBroadcast(BroadcastBackend):
+    # backends sharing a bus reach each other, a single worker's bus holds only itself
+    def __init__(self, batch_size: int, flush_interval: float, bus: list["MemoryBroadcast"] | None = None) -> None:
+        super().__init__(batch_size=batch_size, flush_interval=flush_interval)
+        self.bus = [] if bus is None else bus
+
+    async def start(self, handler: Handler) -> None:
+        await super().start(handler=handler)
+        self.bus.append(self)
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self in self.bus:
+            self.bus.remove(self)
+
+    async def _send(self, events: list[dict]) -> None:
+        for backend in list(self.bus):
+            if backend is not self:
+                await backend._deliver(events)
+
+
+class PostgresBroadcast(BroadcastBackend):
+    def __init__(self, dsn: str, channel: str, batch_size: int, flush_interval: float) -> None:
+        super().__init__(batch_size=batch_size, flush_interval=flush_interval)
+        self.dsn = dsn
+        self.channel = channel
+        self.notifications = 0
+        self._listener: asyncpg.Connection | None = None
+        self._sender: asyncpg.Connection | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self, handler: Handler) -> None:
+        await self._listen()
+        await super().start(handler=handler)
+
+    async def stop(self) -> None:
+        await super().stop()
+        for connection in (self._listener, self._sender):
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        self._listener = self._sender = None
+
+    async def _listen(self) -> None:
+        self._listener = await asyncpg.connect(self.dsn)
+        self._listener.add_termination_listener(self._on_terminated)
+        await self._listener.add_listener(self.channel, self._on_notification)
+
+    def _on_terminated(self, connection: asyncpg.Connection) -> None:
+        if not self._running:
+            return
+        logger.warning("broadcast listener lost, reconnecting")
+        self._spawn(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = self.flush_interval
+        while self._running:
+            try:
+                await self._listen()
+                return
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    def _on_notification(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        batch = json.loads(payload)
+        if batch["origin"] == self.origin:
+            return
+        self._spawn(self._deliver(batch["events"]))
+
+    def _spawn(self, coroutine: Awaitable) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, events: list[dict]) -> None:
+        if self._sender is None or self._sender.is_closed():
+            self._sender = await asyncpg.connect(self.dsn)
+        for chunk in self._chunks(events):
+            await self._sender.execute("SELECT pg_notify($1, $2)", self.channel, chunk)
+            self.notifications += 1
+
+    def _chunks(self, events: list[dict]):
+        chunk: list[str] = []
+        size = 0
+        for event in events:
+            encoded = json.dumps(event, separators=(",", ":"))
+            if chunk and size + len(encoded) > NOTIFY_PAYLOAD_LIMIT:
+                yield self._envelope(chunk)
+                chunk, size = [], 0
+            chunk.append(encoded)
+            size += len(encoded) + 1
+        if chunk:
+            yield self._envelope(chunk)
+
+    def _envelope(self, chunk: list[str]) -> str:
+        return f'{{"origin":"{self.origin}","events":[{",".join(chunk)}]}}'
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {**super().stats, "notifications": self.notifications}
+
+
+def postgres_dsn(database_url: str) -> str:
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+if broadcast_settings.broadcast_backend == "postgres":
+    chat_broadcast: BroadcastBackend = PostgresBroadcast(
+        dsn=postgres_dsn(database_settings.database_url),
+        channel=broadcast_settings.broadcast_channel,
+        batch_size=broadcast_settings.broadcast_batch_size,
+        flush_interval=broadcast_settings.broadcast_flush_interval,
+    )
+else:
+    chat_broadcast = MemoryBroadcast(
+        batch_size=broadcast_settings.broadcast_batch_size,
+        flush_interval=broadcast_settings.broadcast_flush_interval,
+    )
@@ -0,0 +1,27 @@
+import base64
+import json
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any
+
+from app.exceptions.pagination import InvalidCursorException
+
+
+def _default(value: Any) -> str:
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps(values, default=_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, *types: Callable[[Any], Any]) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(cast(value) for cast, value in zip(types, values))
+    except (AttributeError, TypeError, ValueError):
+        raise InvalidCursorException()
@@ -0,0 +1,39 @@
+import csv
+import io
+import json
+from collections.abc import Sequence
+
+from app.utils.cursor import encode_cursor
+from sqlalchemy import Row
+
+FIELDS = ("id", "created_at", "from_user_id", "chat_id", "content", "cursor")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _record(row: Row) -> tuple:
+    # every record carries the cursor to resume after it
+    return (
+        str(row.id),
+        row.created_at.isoformat(),
+        str(row.from_user_id),
+        str(row.chat_id),
+        row.content,
+        encode_cursor(row.created_at, row.id),
+    )
+
+
+def export_header(export_format: str) -> bytes:
+    if export_format == "csv":
+        return encode_rows([], export_format, header=True)
+    return b""
+
+
+def encode_rows(rows: Sequence[Row], export_format: str, header: bool = False) -> bytes:
+    if export_format == "ndjson":
+        return "".join(json.dumps(dict(zip(FIELDS, _record(row)))) + "\n" for row in rows).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(FIELDS)
+    writer.writerows(_record(row) for row in rows)
+    return buffer.getvalue().encode()
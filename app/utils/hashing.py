@@ -0,0 +1,95 @@
+import asyncio
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+from app.config import password_settings
+from app.exceptions.users import HashingOverloadedException
+from app.utils.timings import Timings
+from passlib.context import CryptContext
+
+Result = TypeVar("Result")
+
+
+class PasswordHasher:
+    def __init__(self, context: CryptContext, workers: int, queue_size: int) -> None:
+        self.context = context
+        self.workers = workers
+        self.queue_size = queue_size
+        self.submitted = 0
+        self.started = 0
+        self.finished = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait = Timings()
+        self.run = Timings()
+        # bcrypt releases the GIL, so threads hash in parallel without pickling the context
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit(self.context.verify, password, hashed_password)
+
+    async def upgrade(self, password: str, hashed_password: str) -> str | None:
+        if not self.context.needs_update(hashed_password):
+            return None
+        upgraded = await self.hash(password)
+        self.rehashed += 1
+        return upgraded
+
+    async def _submit(self, func: Callable[..., Result], *args) -> Result:
+        if self.submitted - self.finished >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HashingOverloadedException()
+        self.submitted += 1
+        submitted_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._timed, loop, func, submitted_at, *args)
+        finally:
+            self.finished += 1
+
+    def _timed(
+        self, loop: asyncio.AbstractEventLoop, func: Callable[..., Result], submitted_at: float, *args
+    ) -> Result:
+        # runs in a hashing thread, the counters and timings are only ever updated on the event loop
+        started_at = time.perf_counter()
+        loop.call_soon_threadsafe(self._started, started_at - submitted_at)
+        try:
+            return func(*args)
+        finally:
+            loop.call_soon_threadsafe(self.run.observe, time.perf_counter() - started_at)
+
+    def _started(self, waited: float) -> None:
+        self.started += 1
+        self.wait.observe(waited)
+
+    @property
+    def stats(self) -> dict[str, float]:
+        return {
+            "workers": self.workers,
+            "queued": self.submitted - self.started,
+            "running": self.started - self.finished,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "wait_seconds_total": self.wait.seconds_total,
+            "wait_seconds_max": self.wait.seconds_max,
+            "run_seconds_total": self.run.seconds_total,
+            "run_seconds_max": self.run.seconds_max,
+        }
+
+
+# the first scheme hashes new passwords, the others only verify and get rehashed on login
+password_context = CryptContext(schemes=password_settings.password_schemes, deprecated="auto")
+if "bcrypt" in password_settings.password_schemes:
+    password_context.update(bcrypt__rounds=password_settings.password_bcrypt_rounds)
+
+password_hasher = PasswordHasher(
+    context=password_context,
+    workers=password_settings.password_hash_workers,
+    queue_size=password_settings.password_hash_queue_size,
+)
@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import time
+from collections import defaultdict
+from uuid import UUID
+
+from app.config import websocket_settings
+from app.utils.timings import Timings
+from fastapi import WebSocket, status
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket, user_id: UUID, chat_id: UUID, queue_size: int) -> None:
+        self.websocket = websocket
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.queue: asyncio.Queue[tuple[str, float]] = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task | None = None
+
+
+class ChatHub:
+    def __init__(self, queue_size: int, slow_consumer_policy: str, send_timeout: float) -> None:
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout = send_timeout
+        self.rooms: dict[UUID, set[Connection]] = defaultdict(set)
+        self.users: dict[UUID, set[Connection]] = defaultdict(set)
+        self.room_fanout: dict[UUID, Timings] = {}
+        self.fanout = Timings()
+        self.delivery = Timings()
+        self.enqueued = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self._tasks: set[asyncio.Task] = set()
+
+    async def connect(self, websocket: WebSocket, user_id: UUID, chat_id: UUID) -> Connection:
+        await websocket.accept()
+        connection = Connection(websocket=websocket, user_id=user_id, chat_id=chat_id, queue_size=self.queue_size)
+        self.rooms[chat_id].add(connection)
+        self.users[user_id].add(connection)
+        self.room_fanout.setdefault(chat_id, Timings())
+        connection.writer = asyncio.create_task(self._write(connection))
+        return connection
+
+    async def disconnect(self, connection: Connection, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        if not self._discard(connection):
+            return
+        if connection.writer and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        with contextlib.suppress(Exception):
+            await connection.websocket.close(code=code)
+
+    def publish(self, chat_id: UUID, payload: str) -> set[UUID]:
+        started = time.perf_counter()
+        recipients = set()
+        for connection in list(self.rooms.get(chat_id, ())):
+            if self._enqueue(connection=connection, payload=payload, published_at=started):
+                recipients.add(connection.user_id)
+        elapsed = time.perf_counter() - started
+        self.fanout.observe(elapsed)
+        if room := self.room_fanout.get(chat_id):
+            room.observe(elapsed)
+        return recipients
+
+    def send(self, connection: Connection, payload: str) -> bool:
+        return self._enqueue(connection=connection, payload=payload, published_at=time.perf_counter())
+
+    async def leave(self, chat_id: UUID, user_id: UUID) -> None:
+        for connection in [conn for conn in self.users.get(user_id, ()) if conn.chat_id == chat_id]:
+            await self.disconnect(connection, code=status.WS_1008_POLICY_VIOLATION)
+
+    async def close(self) -> None:
+        for connection in [conn for room in self.rooms.values() for conn in room]:
+            await self.disconnect(connection, code=status.WS_1001_GOING_AWAY)
+
+    async def _write(self, connection: Connection) -> None:
+        try:
+            while True:
+                payload, published_at = await connection.queue.get()
+                await asyncio.wait_for(connection.websocket.send_text(payload), timeout=self.send_timeout)
+                self.delivery.observe(time.perf_counter() - published_at)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.slow_disconnects += 1
+            await self.disconnect(connection, code=status.WS_1013_TRY_AGAIN_LATER)
+        except Exception:
+            await self.disconnect(connection)
+
+    def _enqueue(self, connection: Connection, payload: str, published_at: float) -> bool:
+        if connection.queue.full():
+            if self.slow_consumer_policy == "disconnect":
+                self.slow_disconnects += 1
+                task = asyncio.create_task(self.disconnect(connection, code=status.WS_1013_TRY_AGAIN_LATER))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                return False
+            connection.queue.get_nowait()
+            self.dropped += 1
+        connection.queue.put_nowait((payload, published_at))
+        self.enqueued += 1
+        return True
+
+    def _discard(self, connection: Connection) -> bool:
+        room = self.rooms.get(connection.chat_id)
+        if not room or connection not in room:
+            return False
+        room.discard(connection)
+        if not room:
+            del self.rooms[connection.chat_id]
+            self.room_fanout.pop(connection.chat_id, None)
+        user_connections = self.users[connection.user_id]
+        user_connections.discard(connection)
+        if not user_connections:
+            del self.users[connection.user_id]
+        return True
+
+    @property
+    def room_stats(self) -> dict[UUID, dict[str, float]]:
+        return {
+            chat_id: {
+                "fanouts": timings.count,
+                "seconds_total": timings.seconds_total,
+                "seconds_max": timings.seconds_max,
+            }
+            for chat_id, timings in self.room_fanout.items()
+        }
+
+    @property
+    def stats(self) -> dict[str, float]:
+        depths = [conn.queue.qsize() for room in self.rooms.values() for conn in room]
+        return {
+            "connections": len(depths),
+            "rooms": len(self.rooms),
+            "queue_depth": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "published": self.fanout.count,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "fanout_seconds_total": self.fanout.seconds_total,
+            "fanout_seconds_max": self.fanout.seconds_max,
+            "delivered": self.delivery.count,
+            "delivery_seconds_total": self.delivery.seconds_total,
+            "delivery_seconds_max": self.delivery.seconds_max,
+        }
+
+
+chat_hub = ChatHub(
+    queue_size=websocket_settings.websocket_queue_size,
+    slow_consumer_policy=websocket_settings.websocket_slow_consumer_policy,
+    send_timeout=websocket_settings.websocket_send_timeout,
+)
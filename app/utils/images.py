@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.config import media_settings
+from app.exceptions.media import UnsupportedMediaTypeException
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+
+def variant_path(original: str, size: int, image_format: str) -> str:
+    # stored next to the original, <sha256>.<size>.<ext>
+    return f"{os.path.splitext(original)[0]}.{size}.{EXTENSIONS[image_format]}"
+
+
+def render_variants(original: str, sizes: list[int], formats: list[str], quality: int, max_pixels: int) -> list[str]:
+    # runs in a worker process, nothing from the original but the pixels is written back out
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+    paths = []
+    with Image.open(original) as image:
+        image.seek(0)
+        # jpeg decodes straight to a reduced scale, the largest variant still gets enough pixels
+        image.draft("RGB", (max(sizes) * 2, max(sizes) * 2))
+        variant = ImageOps.exif_transpose(image).convert("RGBA")
+        # largest first, each size is scaled down from the previous one instead of the original
+        for size in sorted(sizes, reverse=True):
+            variant = ImageOps.fit(variant, (size, size), method=Image.Resampling.LANCZOS)
+            for image_format in formats:
+                if image_format == "webp":
+                    converted = variant
+                else:
+                    # jpeg has no alpha, transparent areas go white instead of black
+                    converted = Image.alpha_composite(Image.new("RGBA", variant.size, "white"), variant).convert("RGB")
+                path = variant_path(original, size, image_format)
+                with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=".variant-", delete=False) as file:
+                    converted.save(file, format=image_format.upper(), quality=quality, optimize=True)
+                os.replace(file.name, path)
+                paths.append(path)
+    return paths
+
+
+class ImagePipeline:
+    def __init__(self, workers: int, sizes: list[int], formats: list[str], quality: int, max_pixels: int) -> None:
+        self.workers = workers
+        self.sizes = sorted(sizes)
+        self.formats = formats
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self.rendered = 0
+        self.failed = 0
+        self.restarts = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def render(self, original: str) -> list[str]:
+        try:
+            try:
+                paths = await self._render(original)
+            except BrokenProcessPool:
+                # a worker died under some other upload, this one gets a single go on the fresh pool
+                paths = await self._render(original)
+        except (Image.DecompressionBombError, Image.DecompressionBombWarning, UnidentifiedImageError, ValueError):
+            self.failed += 1
+            raise UnsupportedMediaTypeException()
+        except OSError as exc:
+            self.failed += 1
+            # pillow reports undecodable data without an errno, a full or unwritable disk is not the upload's fault
+            if exc.errno is not None:
+                raise
+            raise UnsupportedMediaTypeException()
+        self.rendered += 1
+        return paths
+
+    async def _render(self, original: str) -> list[str]:
+        if self._executor is None:
+            # spawned, forking a process that runs an event loop and thread pools is unsafe
+            context = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        executor = self._executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, render_variants, original, self.sizes, self.formats, self.quality, self.max_pixels
+            )
+        except BrokenProcessPool:
+            # every render in flight sees the same broken pool, only the first one replaces it
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def variants(self, original: str) -> list[str]:
+        return [variant_path(original, size, image_format) for size in self.sizes for image_format in self.formats]
+
+    def pick(self, original: str, size: int, image_format: str) -> str:
+        # the smallest variant that is at least as large as asked for
+        fitting = next((variant for variant in self.sizes if variant >= size), self.sizes[-1])
+        return variant_path(original, fitting, image_format)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"workers": self.workers, "rendered": self.rendered, "failed": self.failed, "restarts": self.restarts}
+
+
+image_pipeline = ImagePipeline(
+    workers=media_settings.image_workers,
+    sizes=media_settings.avatar_sizes,
+    formats=media_settings.avatar_formats,
+    quality=media_settings.avatar_quality,
+    max_pixels=media_settings.image_max_pixels,
+)
@@ -1,27 +1,114 @@
+import time
+from email.message import EmailMessage
+from email.utils import formataddr
+from functools import lru_cache
+from string import Template
+
+import aiosmtplib
 from app.config import mail_settings
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema
-
-
-async def send_mail(subject: str, recipients: list, body: str):
-    message = MessageSchema(subject=subject, recipients=recipients, body=body, subtype="html")
-    conf = ConnectionConfig(
-        MAIL_USERNAME=mail_settings.mail_username,
-        MAIL_PASSWORD=mail_settings.mail_password,
-        MAIL_PORT=mail_settings.mail_port,
-        MAIL_SERVER=mail_settings.mail_server,
-        MAIL_STARTTLS=mail_settings.mail_starttls,
-        MAIL_SSL_TLS=mail_settings.mail_ssl_tls,
-        MAIL_FROM=mail_settings.mail_from,
-        MAIL_FROM_NAME=mail_settings.mail_from_name,
-        USE_CREDENTIALS=True,
-        VALIDATE_CERTS=mail_settings.mail_validate_certs,
+
+
+def build_message(mail_from: str, mail_from_name: str, recipients: list[str], subject: str, body: str) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = formataddr((mail_from_name, mail_from))
+    message["To"] = ", ".join(recipients)
+    message["Subject"] = subject
+    message.set_content(body, subtype="html")
+    return message
+
+
+class SMTPConnection:
+    # one long lived connection per sender, reconnected when it was dropped or sat idle for too long
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: str | None = None,
+        password: str | None = None,
+        start_tls: bool | None = None,
+        use_tls: bool = False,
+        validate_certs: bool = True,
+        timeout: float = 60,
+        idle_timeout: float = 60,
+    ) -> None:
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.use_tls = use_tls
+        self.validate_certs = validate_certs
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.connects = 0
+        self._client: aiosmtplib.SMTP | None = None
+        self._last_used = 0.0
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username or None,
+            password=self.password or None,
+            start_tls=self.start_tls,
+            use_tls=self.use_tls,
+            validate_certs=self.validate_certs,
+            timeout=self.timeout,
+        )
+        await client.connect()
+        self.connects += 1
+        return client
+
+    async def send(self, message: EmailMessage) -> None:
+        reused = self._client is not None and self._client.is_connected
+        if reused and time.monotonic() - self._last_used > self.idle_timeout:
+            await self.close()
+            reused = False
+        if not reused:
+            self._client = await self._connect()
+        try:
+            await self._client.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            await self.close()
+            if not reused:
+                raise
+            # the server closed the idle connection under us, nothing was sent yet
+            self._client = await self._connect()
+            await self._client.send_message(message)
+        except aiosmtplib.SMTPResponseException:
+            # the server refused this mail, the connection itself is still good
+            raise
+        except Exception:
+            await self.close()
+            raise
+        finally:
+            self._last_used = time.monotonic()
+
+    async def close(self) -> None:
+        client, self._client = self._client, None
+        if client is None or not client.is_connected:
+            return
+        try:
+            await client.quit()
+        except aiosmtplib.SMTPException:
+            client.close()
+
+
+def smtp_connection() -> SMTPConnection:
+    return SMTPConnection(
+        hostname=mail_settings.mail_server,
+        port=mail_settings.mail_port,
+        username=mail_settings.mail_username,
+        password=mail_settings.mail_password,
+        start_tls=mail_settings.mail_starttls,
+        use_tls=mail_settings.mail_ssl_tls,
+        validate_certs=mail_settings.mail_validate_certs,
+        timeout=mail_settings.mail_timeout,
+        idle_timeout=mail_settings.mail_idle_timeout,
     )
-    mail = FastMail(conf)
-    await mail.send_message(message)
 
 
-def html_reset_password_mail(reset_password_token: str):
-    return f"""
+RESET_PASSWORD_MAIL = Template("""
         <!DOCTYPE html>
         <html lang="ru">
         <head>
@@ -33,9 +120,19 @@ def html_reset_password_mail(reset_password_token: str):
         <body>
             <h3>С вашего аккаунта пришел запрос на сброс пароля</h3>
             <p>Для продолжения перейдите по
-                <a href="{mail_settings.domain_name}/reset-password/{reset_password_token}"> ссылке</a>
+                <a href="$domain_name/reset-password/$token"> ссылке</a>
             </p>
             <p>Если это были не Вы, смените пароль</p>
         </body>
         </html>
-        """
+        """)
+
+
+@lru_cache
+def _reset_password_template(domain_name: str) -> Template:
+    # everything but the token is rendered once
+    return Template(RESET_PASSWORD_MAIL.safe_substitute(domain_name=domain_name))
+
+
+def html_reset_password_mail(reset_password_token: str):
+    return _reset_password_template(mail_settings.domain_name).substitute(token=reset_password_token)
@@ -0,0 +1,106 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO
+
+from app.exceptions.media import FileTooLargeException, UnsupportedMediaTypeException
+from fastapi import Response, UploadFile
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def sniff_content_type(head: bytes) -> str | None:
+    # the client's content type and filename are not trusted, the first bytes decide
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _open_temporary(directory: str) -> BinaryIO:
+    os.makedirs(directory, exist_ok=True)
+    # next to the destination so the final rename stays on one filesystem and is atomic
+    return tempfile.NamedTemporaryFile(dir=directory, prefix=".upload-", delete=False)
+
+
+def _write(file: BinaryIO, digest, chunk: bytes) -> None:
+    file.write(chunk)
+    digest.update(chunk)
+
+
+def _discard(file: BinaryIO) -> None:
+    file.close()
+    os.remove(file.name)
+
+
+def _publish(file: BinaryIO, path: str) -> None:
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    os.replace(file.name, path)
+
+
+async def save_upload(
+    upload: UploadFile, directory: str, max_size: int, content_types: list[str], chunk_size: int
+) -> str:
+    # copies chunk by chunk off the event loop, the file lands under the sha256 of its content
+    chunk = await upload.read(chunk_size)
+    content_type = sniff_content_type(chunk)
+    if content_type not in content_types or content_type not in EXTENSIONS:
+        raise UnsupportedMediaTypeException()
+    file = await run_in_threadpool(_open_temporary, directory)
+    digest, size = hashlib.sha256(), 0
+    try:
+        while chunk:
+            size += len(chunk)
+            if size > max_size:
+                raise FileTooLargeException()
+            await run_in_threadpool(_write, file, digest, chunk)
+            chunk = await upload.read(chunk_size)
+        path = os.path.join(directory, f"{digest.hexdigest()}.{EXTENSIONS[content_type]}")
+        await run_in_threadpool(_publish, file, path)
+    except BaseException:
+        await run_in_threadpool(_discard, file)
+        raise
+    return path
+
+
+def _remove(paths: tuple[str, ...]) -> None:
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def remove_in_background(*paths: str) -> None:
+    asyncio.get_running_loop().run_in_executor(None, _remove, paths)
+
+
+def etag(path: str) -> str:
+    # file names are content hashes, so the name alone is a strong validator
+    return f'"{os.path.basename(path)}"'
+
+
+def not_modified(tag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    # weak comparison, as If-None-Match requires
+    tags = {value.strip().removeprefix("W/") for value in if_none_match.split(",")}
+    return "*" in tags or tag in tags
+
+
+def file_response(path: str, cache_control: str, if_none_match: str | None = None, headers: dict | None = None):
+    headers = {"ETag": etag(path), "Cache-Control": cache_control, **(headers or {})}
+    if not_modified(headers["ETag"], if_none_match):
+        return Response(status_code=304, headers=headers)
+    # range and if-range requests are answered by the file response itself
+    return FileResponse(path, headers=headers)
@@ -0,0 +1,44 @@
+from collections.abc import Iterable
+from uuid import UUID
+
+from app.utils.cache import TTLCache
+
+
+class MembershipIndex:
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.members = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.chats = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_members(self, chat_id: UUID) -> set[UUID] | None:
+        return self.members.get(chat_id)
+
+    def set_members(self, chat_id: UUID, user_ids: Iterable[UUID]) -> set[UUID]:
+        self.members.set(chat_id, members := set(user_ids))
+        return members
+
+    def get_chats(self, user_id: UUID) -> set[UUID] | None:
+        return self.chats.get(user_id)
+
+    def set_chats(self, user_id: UUID, chat_ids: Iterable[UUID]) -> set[UUID]:
+        self.chats.set(user_id, chats := set(chat_ids))
+        return chats
+
+    def add(self, chat_id: UUID, user_id: UUID) -> None:
+        if (members := self.members.get(chat_id)) is not None:
+            members.add(user_id)
+        if (chats := self.chats.get(user_id)) is not None:
+            chats.add(chat_id)
+
+    def remove(self, chat_id: UUID, user_id: UUID) -> None:
+        if (members := self.members.get(chat_id)) is not None:
+            members.discard(user_id)
+        if (chats := self.chats.get(user_id)) is not None:
+            chats.discard(chat_id)
+
+    def clear(self) -> None:
+        self.members.clear()
+        self.chats.clear()
+
+    @property
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {"members": self.members.stats, "chats": self.chats.stats}
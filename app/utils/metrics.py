@@ -0,0 +1,127 @@
+import logging
+import random
+import time
+from collections.abc import Callable
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float("inf"))
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ["method", "route", "status"]
+)
+request_queries = Histogram("http_request_queries", "SQL statements per request", ["route"], buckets=QUERY_BUCKETS)
+request_db_duration = Histogram("http_request_db_seconds", "Time spent in SQL per request", ["route"])
+query_duration = Histogram("db_query_duration_seconds", "Latency of single SQL statements")
+slow_queries = Counter("db_slow_queries_total", "SQL statements slower than the slow query threshold")
+pool_checkout_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection")
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# mutated in place, sqlalchemy runs cursor events in a greenlet that shares the request context
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # the pool has no event before a checkout, so the wait is timed around the queue get itself
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine: Engine, slow_query_seconds: float, slow_query_sample_rate: float) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - context.query_started
+        query_duration.observe(elapsed)
+        if (stats := request_stats.get()) is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+        if elapsed >= slow_query_seconds:
+            slow_queries.inc()
+            # parameters are left out, they carry password hashes and tokens
+            if random.random() < slow_query_sample_rate:
+                logger.warning("slow query took %.3fs: %s", elapsed, statement[:2000])
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_stats.reset(token)
+            # the template rather than the path keeps ids out of the label values
+            route = getattr(scope.get("route"), "path", "unmatched")
+            request_duration.labels(scope["method"], route, status_code).observe(elapsed)
+            request_queries.labels(route).observe(stats.queries)
+            request_db_duration.labels(route).observe(stats.db_seconds)
+
+
+def _flatten(stats: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix=f"{prefix}{key}_"))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+class StatsCollector:
+    # exposes the stats properties the components already keep, read at scrape time
+    def __init__(self, name: str, source: Callable[[], dict], label: str | None = None) -> None:
+        self.name = name
+        self.source = source
+        self.label = label
+
+    def collect(self):
+        stats = self.source()
+        if self.label is None:
+            for key, value in _flatten(stats).items():
+                yield GaugeMetricFamily(f"{self.name}_{key}", f"{self.name} {key}", value=value)
+            return
+        families: dict[str, GaugeMetricFamily] = {}
+        for label_value, values in stats.items():
+            for key, value in _flatten(values).items():
+                if key not in families:
+                    families[key] = GaugeMetricFamily(f"{self.name}_{key}", f"{self.name} {key}", labels=[self.label])
+                families[key].add_metric([str(label_value)], value)
+        yield from families.values()
@@ -0,0 +1,34 @@
+import re
+from datetime import datetime
+
+# parent table -> partition key, parents that others reference come last so they are detached last
+PARTITIONED = {"messages": "created_at"}
+PARTITION_NAME = re.compile(r"^(?P<parent>[a-z_]+)_p(?P<year>\d{4})(?P<month>\d{2})$")
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    year, month = divmod(value.year * 12 + value.month - 1 + months, 12)
+    return value.replace(year=year, month=month + 1)
+
+
+def months_between(start: datetime, end: datetime) -> list[datetime]:
+    # the first day of every month that overlaps [start, end)
+    months, month = [], month_start(start)
+    while month < end:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def partition_name(parent: str, month: datetime) -> str:
+    return f"{parent}_p{month:%Y%m}"
+
+
+def parse_partition(name: str) -> tuple[str, datetime] | None:
+    if (match := PARTITION_NAME.match(name)) is None or match["parent"] not in PARTITIONED:
+        return None
+    return match["parent"], datetime(int(match["year"]), int(match["month"]), 1)
@@ -0,0 +1,118 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+from collections.abc import Callable, Hashable
+
+from app.utils.cache import TTLCache
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# seconds behind the primary, an idle standby that replayed everything it received is not behind at all
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def is_unavailable(exc: BaseException) -> bool:
+    # the replica could not be reached or dropped the connection, the statement itself was fine
+    if isinstance(exc, DBAPIError):
+        # no statement means the error came from connecting
+        return exc.connection_invalidated or exc.statement is None
+    return isinstance(exc, (OSError, asyncio.TimeoutError))
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        session_factories: list[Callable[[], AsyncSession]],
+        max_lag: float,
+        sticky_seconds: float,
+        sticky_size: int,
+        check_interval: float,
+    ) -> None:
+        self.session_factories = session_factories
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # who wrote recently reads from the primary until the replicas have caught up with it
+        self.sticky = TTLCache(maxsize=sticky_size, ttl=sticky_seconds)
+        # None until a check succeeds, so nothing is routed to a replica that was never seen healthy
+        self.lags: list[float | None] = [None] * len(session_factories)
+        self.routed = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self._next = itertools.count()
+        self._checker: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self.session_factories:
+            await self.check()
+            self._checker = asyncio.create_task(self._check_forever())
+
+    async def stop(self) -> None:
+        if self._checker:
+            self._checker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._checker
+            self._checker = None
+
+    async def _check_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    async def check(self) -> None:
+        self.lags = await asyncio.gather(*(self._lag(session_factory) for session_factory in self.session_factories))
+
+    async def _lag(self, session_factory: Callable[[], AsyncSession]) -> float | None:
+        try:
+            async with session_factory() as session:
+                if session.bind.dialect.name != "postgresql":
+                    return float(await asyncio.wait_for(session.scalar(text("SELECT 0")), self.check_interval))
+                lag = await asyncio.wait_for(session.scalar(LAG_QUERY), self.check_interval)
+        except Exception:
+            self.failures += 1
+            logger.warning("replica health check failed", exc_info=True)
+            return None
+        return None if lag is None else float(lag)
+
+    def healthy(self) -> list[Callable[[], AsyncSession]]:
+        return [
+            session_factory
+            for session_factory, lag in zip(self.session_factories, self.lags)
+            if lag is not None and lag <= self.max_lag
+        ]
+
+    def stick(self, key: Hashable | None) -> None:
+        if key is not None:
+            self.sticky.set(key, True)
+
+    def pick(self, key: Hashable | None = None) -> Callable[[], AsyncSession] | None:
+        # round robin over the healthy replicas, None sends the read to the primary
+        if not self.session_factories:
+            return None
+        if (key is not None and self.sticky.get(key)) or not (healthy := self.healthy()):
+            self.fallbacks += 1
+            return None
+        self.routed += 1
+        return healthy[next(self._next) % len(healthy)]
+
+    def mark_unavailable(self, session_factory: Callable[[], AsyncSession]) -> None:
+        # out of rotation until the next check reaches it again
+        self.failures += 1
+        self.lags[self.session_factories.index(session_factory)] = None
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "replicas": len(self.session_factories),
+            "healthy": len(self.healthy()),
+            "sticky": len(self.sticky),
+            "routed": self.routed,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+        }
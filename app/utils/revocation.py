@@ -0,0 +1,81 @@
+import asyncio
+import contextlib
+import logging
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import datetime
+from uuid import UUID
+
+from app.models.users import TokenRevocation as TokenRevocationModel
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationStore:
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.tokens: dict[UUID, datetime] = {}
+        self.versions: dict[UUID, tuple[int, datetime]] = {}
+        # revoked_at of the newest row seen, the next sync only reads what came after it
+        self.cursor: datetime | None = None
+        self.syncs = 0
+        self.failures = 0
+        self.rejected = 0
+        self._syncer: asyncio.Task | None = None
+
+    async def start(self, sync: Callable[[], Awaitable[None]]) -> None:
+        self._syncer = asyncio.create_task(self._sync_forever(sync))
+
+    async def stop(self) -> None:
+        if self._syncer:
+            self._syncer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._syncer
+            self._syncer = None
+
+    async def _sync_forever(self, sync: Callable[[], Awaitable[None]]) -> None:
+        while True:
+            try:
+                await sync()
+                self.syncs += 1
+            except Exception:
+                # keep serving from what is known, the next sync catches up
+                self.failures += 1
+                logger.exception("token revocation sync failed")
+            await asyncio.sleep(self.interval)
+
+    def add(self, id: UUID, user_id: UUID, expires_at: datetime, session_version: int | None = None) -> None:
+        if session_version is None:
+            self.tokens[id] = expires_at
+        elif user_id not in self.versions or self.versions[user_id][0] < session_version:
+            self.versions[user_id] = (session_version, expires_at)
+
+    def apply(self, revocations: Iterable[TokenRevocationModel]) -> None:
+        for revocation in revocations:
+            self.add(
+                id=revocation.id,
+                user_id=revocation.user_id,
+                expires_at=revocation.expires_at,
+                session_version=revocation.session_version,
+            )
+            if self.cursor is None or self.cursor < revocation.revoked_at:
+                self.cursor = revocation.revoked_at
+
+    def evict(self, now: datetime) -> None:
+        self.tokens = {id: expires_at for id, expires_at in self.tokens.items() if expires_at > now}
+        self.versions = {user_id: item for user_id, item in self.versions.items() if item[1] > now}
+
+    def is_revoked(self, id: UUID | None, user_id: UUID, session_version: int) -> bool:
+        revoked = id in self.tokens or (user_id in self.versions and session_version < self.versions[user_id][0])
+        if revoked:
+            self.rejected += 1
+        return revoked
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "tokens": len(self.tokens),
+            "versions": len(self.versions),
+            "syncs": self.syncs,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
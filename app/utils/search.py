@@ -0,0 +1,35 @@
+import re
+
+# put around matches by ts_headline and by the sqlite fallback, control characters do not occur in typed text
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+HEADLINE_OPTIONS = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=35, MinWords=15"
+
+
+def search_terms(query: str) -> list[str]:
+    # the sqlite fallback only knows plain words, websearch operators and excluded words are dropped
+    return [term for negated, term in re.findall(r"(-?)(\w+)", query.lower()) if not negated and term != "or"]
+
+
+def mark_terms(content: str, terms: list[str]) -> str:
+    if not terms:
+        return content
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    return pattern.sub(lambda match: f"{HIGHLIGHT_START}{match.group()}{HIGHLIGHT_STOP}", content)
+
+
+def split_highlights(headline: str) -> tuple[str, list[tuple[int, int]]]:
+    # the snippet without markers and the [start, end) offsets of every highlighted match in it
+    snippet, highlights, start = [], [], None
+    length = 0
+    for part in re.split(f"([{HIGHLIGHT_START}{HIGHLIGHT_STOP}])", headline):
+        if part == HIGHLIGHT_START:
+            start = length
+        elif part == HIGHLIGHT_STOP:
+            if start is not None:
+                highlights.append((start, length))
+            start = None
+        else:
+            snippet.append(part)
+            length += len(part)
+    return "".join(snippet), highlights
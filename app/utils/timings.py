@@ -0,0 +1,10 @@
+class Timings:
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.seconds_total += seconds
+        self.seconds_max = max(self.seconds_max, seconds)
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import time
+import uuid
+
+from app.config import broadcast_settings, database_settings
+from app.utils.broadcast import PostgresBroadcast, postgres_dsn
+
+
+async def run_worker(index: int, dsn: str, channel: str, messages: int, recipients: int, ready, start, results) -> None:
+    received: set[str] = set()
+    deliveries = 0
+
+    async def handler(events: list[dict]) -> None:
+        nonlocal deliveries
+        for event in events:
+            received.add(event["message_id"])
+            # every worker fans out to its own sockets, NOTIFY traffic does not depend on this
+            deliveries += recipients
+
+    backend = PostgresBroadcast(
+        dsn=dsn,
+        channel=channel,
+        batch_size=broadcast_settings.broadcast_batch_size,
+        flush_interval=broadcast_settings.broadcast_flush_interval,
+    )
+    await backend.start(handler=handler)
+    ready.release()
+    while not start.is_set():
+        await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    if index == 0:
+        for idx in range(messages):
+            backend.publish({"chat_id": str(uuid.uuid4()), "message_id": str(uuid.uuid4()), "payload": f"m{idx}"})
+            if idx % broadcast_settings.broadcast_batch_size == 0:
+                await asyncio.sleep(0)
+    deadline = started + 30
+    while len(received) < messages and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await backend.stop()
+    results.put(
+        {
+            "worker": index,
+            "received": len(received),
+            "deliveries": deliveries,
+            "seconds": round(elapsed, 3),
+            **backend.stats,
+        }
+    )
+
+
+def worker(index: int, dsn: str, channel: str, messages: int, recipients: int, ready, start, results) -> None:
+    asyncio.run(run_worker(index, dsn, channel, messages, recipients, ready, start, results))
+
+
+def main(database_url: str, workers: int, messages: int, recipients: int) -> int:
+    context = multiprocessing.get_context("spawn")
+    ready, start, results = context.Semaphore(0), context.Event(), context.Queue()
+    channel = f"broadcast_check_{uuid.uuid4().hex[:8]}"
+    processes = [
+        context.Process(
+            target=worker,
+            args=(idx, postgres_dsn(database_url), channel, messages, recipients, ready, start, results),
+        )
+        for idx in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.acquire()
+    start.set()
+    reports = sorted((results.get(timeout=60) for _ in processes), key=lambda report: report["worker"])
+    for process in processes:
+        process.join()
+
+    failures = 0
+    for report in reports:
+        status = "ok  " if report["received"] == messages else "FAIL"
+        failures += status == "FAIL"
+        print(f"{status} {report}")
+    notifications = reports[0]["notifications"]
+    print(f"{messages} messages, {notifications} notifications, {notifications / messages:.3f} per message")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every worker process receives every broadcast message")
+    parser.add_argument("--database-url", default=database_settings.database_url)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--recipients", type=int, default=50)
+    args = parser.parse_args()
+    sys.exit(
+        main(
+            database_url=args.database_url,
+            workers=args.workers,
+            messages=args.messages,
+            recipients=args.recipients,
+        )
+    )
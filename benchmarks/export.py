@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from app.database import Base
+from app.models.chats import Chat, Message
+from app.models.users import User
+from app.repositories.chats import messages_repository
+from app.services.export import MessagesExporter
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+
+async def seed(session_factory, chat_id: uuid.UUID, messages: int) -> None:
+    user_id = uuid.uuid4()
+    async with session_factory() as session:
+        session.add_all([User(id=user_id, username=f"export-{chat_id}", password="-"), Chat(id=chat_id, name="export")])
+        await session.flush()
+        started = datetime(2024, 1, 1)
+        for offset in range(0, messages, 10_000):
+            rows = [
+                {
+                    "id": uuid.uuid4(),
+                    "created_at": started + timedelta(seconds=idx),
+                    "from_user_id": user_id,
+                    "chat_id": chat_id,
+                    "content": f"message {idx} " + "x" * 100,
+                }
+                for idx in range(offset, min(offset + 10_000, messages))
+            ]
+            await session.execute(insert(Message), rows)
+        await session.commit()
+
+
+async def in_memory(session_factory, chat_id: uuid.UUID) -> int:
+    # the previous way, every message as an orm object and one json array
+    async with session_factory() as session:
+        messages = (await session.execute(select(Message).where(Message.chat_id == chat_id))).scalars().all()
+        body = json.dumps(
+            [
+                {
+                    "id": str(message.id),
+                    "created_at": message.created_at.isoformat(),
+                    "from_user_id": str(message.from_user_id),
+                    "chat_id": str(message.chat_id),
+                    "content": message.content,
+                }
+                for message in messages
+            ]
+        ).encode()
+    return len(body)
+
+
+async def streamed(exporter: MessagesExporter, chat_id: uuid.UUID, client_delay: float) -> int:
+    size = 0
+    async for chunk in exporter.export(chat_id=chat_id, export_format="ndjson"):
+        size += len(chunk)
+        # a slow client, the export only moves on once the previous chunk is taken
+        await asyncio.sleep(client_delay)
+    return size
+
+
+async def probe(session_factory, done: asyncio.Event) -> list[float]:
+    latencies = []
+    while not done.is_set():
+        started = time.perf_counter()
+        async with session_factory() as session:
+            await session.scalar(select(func.count()).select_from(Chat))
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+async def measure(name: str, session_factory, export) -> None:
+    done = asyncio.Event()
+    prober = asyncio.create_task(probe(session_factory=session_factory, done=done))
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    size = await export()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    done.set()
+    latencies = await prober
+    print(
+        f"{name:>9}: {size >> 20:4}MB in {elapsed:6.2f}s  peak traced {peak >> 20:5}MB  "
+        f"unrelated queries p50 {statistics.median(latencies):7.2f}ms  max {max(latencies):7.2f}ms"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(directory, 'export.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        for messages in args.messages:
+            chat_id = uuid.uuid4()
+            await seed(session_factory=session_factory, chat_id=chat_id, messages=messages)
+            exporter = MessagesExporter(
+                messages_repository=messages_repository,
+                batch_size=args.batch_size,
+                max_running=1,
+                session_factory=session_factory,
+            )
+            print(f"{messages} messages")
+            await measure("in memory", session_factory, lambda: in_memory(session_factory, chat_id))
+            await measure("streamed", session_factory, lambda: streamed(exporter, chat_id, args.client_delay))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare memory of loading and of streaming a chat export")
+    parser.add_argument("--messages", type=int, nargs="+", default=[50_000, 200_000])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--client-delay", type=float, default=0.001)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import tempfile
+import time
+import uuid
+
+from app.database import Base, bind_session
+from app.models.chats import Chat as ChatModel
+from app.models.chats import Message as MessageModel
+from app.models.users import User as UserModel
+from app.repositories.chats import messages_repository
+from app.services.ingest import MessagesIngestor
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+
+async def seed(session_factory, chats: int) -> tuple[uuid.UUID, list[uuid.UUID]]:
+    async with session_factory() as session, bind_session(session=session):
+        user = UserModel(username=f"sender-{uuid.uuid4().hex[:8]}", password="-")
+        rooms = [ChatModel(name=f"room-{idx}") for idx in range(chats)]
+        session.add(user)
+        session.add_all(rooms)
+        await session.flush()
+        return user.id, [room.id for room in rooms]
+
+
+async def sender(ingestor: MessagesIngestor, user_id: uuid.UUID, chat_id: uuid.UUID, messages: int) -> None:
+    for idx in range(messages):
+        await ingestor.submit(chat_id=chat_id, from_user_id=user_id, content=f"message {idx}")
+
+
+async def sync_sender(session_factory, ingestor, user_id, chat_id, messages) -> None:
+    # a websocket in sync mode binds one unit of work per inbound message
+    for idx in range(messages):
+        async with session_factory() as session, bind_session(session=session):
+            await ingestor.submit(chat_id=chat_id, from_user_id=user_id, content=f"message {idx}")
+
+
+async def measure(session_factory, durability: str, args: argparse.Namespace) -> None:
+    user_id, chat_ids = await seed(session_factory=session_factory, chats=args.chats)
+    ingestor = MessagesIngestor(
+        messages_repository=messages_repository,
+        durability=durability,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        queue_size=args.queue_size,
+        session_factory=session_factory,
+    )
+    await ingestor.start()
+    started = time.perf_counter()
+    per_sender = args.messages // (args.chats * args.senders)
+    tasks = []
+    for chat_id in chat_ids:
+        for _ in range(args.senders):
+            if durability == "sync":
+                tasks.append(sync_sender(session_factory, ingestor, user_id, chat_id, per_sender))
+            else:
+                tasks.append(sender(ingestor, user_id, chat_id, per_sender))
+    await asyncio.gather(*tasks)
+    acked = time.perf_counter() - started
+    await ingestor.stop()
+    persisted = time.perf_counter() - started
+
+    async with session_factory() as session:
+        total = per_sender * args.senders * args.chats
+        for chat_id in chat_ids:
+            query = (
+                select(MessageModel.created_at, MessageModel.content)
+                .where(MessageModel.chat_id == chat_id)
+                .order_by(MessageModel.created_at, MessageModel.id)
+            )
+            stamps = [row.created_at for row in (await session.execute(query)).all()]
+            if stamps != sorted(set(stamps)):
+                raise RuntimeError(f"{durability}: messages of chat {chat_id} are out of order")
+        count = await session.scalar(
+            select(func.count()).select_from(MessageModel).where(MessageModel.chat_id.in_(chat_ids))
+        )
+    if count != total:
+        raise RuntimeError(f"{durability}: persisted {count} of {total} messages")
+    print(
+        f"{durability:>5}: {total / acked:9.0f} acks/s  {total / persisted:9.0f} persisted/s  "
+        f"{ingestor.stats['batches']} batches"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        # a file database so concurrent sync-mode transactions get their own connections
+        database_url = args.database_url or f"sqlite+aiosqlite:///{directory}/ingest.db"
+        engine = create_async_engine(database_url)
+        if database_url.startswith("sqlite"):
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        for durability in args.durability:
+            await measure(session_factory=session_factory, durability=durability, args=args)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare message ingest throughput per durability mode")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--durability", nargs="+", default=["sync", "group", "async"])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--senders", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--flush-interval", type=float, default=0.01)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+
+import httpx
+import websockets
+from app.database import Base
+from app.models import chats as chat_models  # noqa: F401, registers the tables on Base.metadata
+from app.models import mail as mail_models  # noqa: F401
+from app.models import users as user_models  # noqa: F401
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy.ext.asyncio import create_async_engine
+
+PASSWORD = "load-password"
+SCENARIOS = ("register_login", "me", "chats_all", "messages", "websocket")
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float, queries: float | None) -> dict:
+    milliseconds = [seconds * 1000 for seconds in latencies] or [0.0]
+    return {
+        "operations": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(milliseconds, 0.5), 2),
+        "p95_ms": round(percentile(milliseconds, 0.95), 2),
+        "p99_ms": round(percentile(milliseconds, 0.99), 2),
+        "queries_per_request": None if queries is None else round(queries, 2),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def scrape_queries(client: httpx.AsyncClient) -> dict[str, list[float]]:
+    # route template -> [statements, requests] from the server's own histogram
+    totals: dict[str, list[float]] = {}
+    response = await client.get("/metrics")
+    for family in text_string_to_metric_families(response.text):
+        if family.name != "http_request_queries":
+            continue
+        for sample in family.samples:
+            totals.setdefault(sample.labels.get("route"), [0.0, 0.0])
+            if sample.name.endswith("_sum"):
+                totals[sample.labels["route"]][0] = sample.value
+            elif sample.name.endswith("_count"):
+                totals[sample.labels["route"]][1] = sample.value
+    return totals
+
+
+def queries_per_request(before: dict, after: dict, routes: tuple[str, ...]) -> float | None:
+    statements = sum(after.get(route, [0, 0])[0] - before.get(route, [0, 0])[0] for route in routes)
+    requests = sum(after.get(route, [0, 0])[1] - before.get(route, [0, 0])[1] for route in routes)
+    return statements / requests if requests else None
+
+
+async def drive(
+    operation: Callable[[int], Awaitable[None]], operations: int, concurrency: int
+) -> tuple[list[float], int, float]:
+    latencies, errors, indexes = [], 0, iter(range(operations))
+
+    async def worker() -> None:
+        nonlocal errors
+        for idx in indexes:
+            started = time.perf_counter()
+            try:
+                await operation(idx)
+            except (httpx.HTTPError, OSError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+class Load:
+    def __init__(self, client: httpx.AsyncClient, base_url: str, args: argparse.Namespace) -> None:
+        self.client = client
+        self.ws_url = base_url.replace("http", "ws", 1)
+        self.args = args
+        self.run_id = uuid.uuid4().hex[:8]
+        self.tokens: list[str] = []
+        self.chat_id: str | None = None
+
+    def headers(self, idx: int) -> dict[str, str]:
+        return {"Authorization": f"Bearer {self.tokens[idx % len(self.tokens)]}"}
+
+    async def register_login(self, name: str) -> str:
+        response = await self.client.post(
+            "/users/register/", json={"username": name, "email": f"{name}@example.com", "password": PASSWORD}
+        )
+        response.raise_for_status()
+        response = await self.client.post("/users/login/", data={"username": name, "password": PASSWORD})
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+    async def setup(self) -> None:
+        members = max(self.args.concurrency, self.args.ws_clients + 1)
+        for idx in range(members):
+            self.tokens.append(await self.register_login(f"load-{self.run_id}-{idx}"))
+        response = await self.client.post(
+            "/chats/new/",
+            json={"name": f"load-{self.run_id}", "private": True, "active": True},
+            headers=self.headers(0),
+        )
+        response.raise_for_status()
+        chats = (await self.client.get("/chats/all/", headers=self.headers(0))).json()
+        self.chat_id = next(chat["id"] for chat in chats if chat["name"] == f"load-{self.run_id}")
+        for idx in range(1, members):
+            user = (await self.client.get("/users/me/", headers=self.headers(idx))).json()
+            response = await self.client.post(
+                f"/chats/{self.chat_id}/add-member/", json={"id": user["id"]}, headers=self.headers(0)
+            )
+            response.raise_for_status()
+        async with websockets.connect(self.socket_url(0)) as websocket:
+            for idx in range(self.args.messages):
+                await websocket.send(f"seed {idx}")
+            acked = 0
+            while acked < self.args.messages:
+                acked += "ack" in json.loads(await websocket.recv())
+
+    def socket_url(self, idx: int) -> str:
+        return f"{self.ws_url}/chats/{self.chat_id}/?token={self.tokens[idx % len(self.tokens)]}"
+
+    async def http_scenario(
+        self, routes: tuple[str, ...], operation: Callable[[int], Awaitable[None]], operations: int
+    ) -> dict:
+        before = await scrape_queries(self.client)
+        latencies, errors, elapsed = await drive(operation, operations, self.args.concurrency)
+        after = await scrape_queries(self.client)
+        return summarize(latencies, errors, elapsed, queries_per_request(before, after, routes))
+
+    async def get(self, url: str, idx: int) -> None:
+        response = await self.client.get(url, headers=self.headers(idx))
+        response.raise_for_status()
+
+    async def websocket(self) -> dict:
+        # one sender, every other member listening; latency is send until the last listener has the frame
+        received: dict[str, list[float]] = {}
+        listeners = [await websockets.connect(self.socket_url(idx)) for idx in range(1, self.args.ws_clients + 1)]
+
+        async def listen(websocket) -> None:
+            for _ in range(self.args.ws_messages):
+                frame = json.loads(await websocket.recv())
+                received.setdefault(frame.get("content"), []).append(time.perf_counter())
+
+        tasks = [asyncio.create_task(listen(websocket)) for websocket in listeners]
+        sent: dict[str, float] = {}
+        started = time.perf_counter()
+        async with websockets.connect(self.socket_url(0)) as sender:
+            for idx in range(self.args.ws_messages):
+                content = f"load {idx}"
+                sent[content] = time.perf_counter()
+                await sender.send(content)
+                while "ack" not in json.loads(await sender.recv()):
+                    pass
+            try:
+                await asyncio.wait_for(asyncio.gather(*tasks), timeout=self.args.ws_timeout)
+            except asyncio.TimeoutError:
+                pass
+        elapsed = time.perf_counter() - started
+        for websocket in listeners:
+            await websocket.close()
+        latencies = [
+            max(received[content]) - sent_at
+            for content, sent_at in sent.items()
+            if len(received.get(content, ())) == len(listeners)
+        ]
+        report = summarize(latencies, len(sent) - len(latencies), elapsed, None)
+        report["deliveries_per_second"] = round(len(latencies) * len(listeners) / elapsed, 1)
+        return report
+
+    async def run(self, scenarios: list[str]) -> dict[str, dict]:
+        await self.setup()
+        messages_url = f"/chats/{self.chat_id}/messages/"
+        runs = {
+            "register_login": lambda: self.http_scenario(
+                ("/users/register/", "/users/login/"),
+                lambda idx: self.register_login(f"load-{self.run_id}-op-{idx}"),
+                self.args.logins,
+            ),
+            "me": lambda: self.http_scenario(
+                ("/users/me/",), lambda idx: self.get("/users/me/", idx), self.args.requests
+            ),
+            "chats_all": lambda: self.http_scenario(
+                ("/chats/all/",), lambda idx: self.get("/chats/all/", idx), self.args.requests
+            ),
+            "messages": lambda: self.http_scenario(
+                ("/chats/{chat_id}/messages/",), lambda idx: self.get(messages_url, idx), self.args.requests
+            ),
+            "websocket": self.websocket,
+        }
+        return {name: await runs[name]() for name in scenarios}
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in report["scenarios"].items():
+        if (base := baseline["scenarios"].get(name)) is None:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']} < baseline {base['throughput']}")
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        # query counts are deterministic, any growth is a regression
+        if result["queries_per_request"] is not None and base["queries_per_request"] is not None:
+            if result["queries_per_request"] > base["queries_per_request"] + 0.01:
+                regressions.append(
+                    f"{name}: {result['queries_per_request']} queries/request > "
+                    f"baseline {base['queries_per_request']}"
+                )
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{name}: {result['errors']} errors > baseline {base['errors']}")
+    return regressions
+
+
+async def prepare_sqlite(database_url: str) -> None:
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with {server.returncode}")
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def run(args: argparse.Namespace, directory: str) -> dict:
+    # an existing postgres database is expected to be migrated already
+    database_url = args.database_url or f"sqlite+aiosqlite:///{directory}/load.db"
+    if database_url.startswith("sqlite"):
+        await prepare_sqlite(database_url)
+    port = free_port()
+    env = {**os.environ, "DATABASE_URL": database_url, "PASSWORD_BCRYPT_ROUNDS": str(args.bcrypt_rounds)}
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"]
+    server = subprocess.Popen(command + ["--workers", str(args.workers)], env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency + 1)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+            await wait_ready(client=client, server=server, timeout=args.timeout)
+            scenarios = await Load(client=client, base_url=base_url, args=args).run(args.scenarios)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat(),
+            "database": database_url.split(":", 1)[0],
+            "python": platform.python_version(),
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "bcrypt_rounds": args.bcrypt_rounds,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def main(args: argparse.Namespace) -> int:
+    if args.report:
+        with open(args.report) as file:
+            report = json.load(file)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            report = asyncio.run(run(args, directory))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            report["regressions"] = compare(report, json.load(file), args.tolerance)
+    print(json.dumps(report, indent=2))
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API and websockets, report as JSON")
+    parser.add_argument("--database-url", default=None, help="a migrated postgres database, sqlite when omitted")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=200, help="messages seeded into the benchmark chat")
+    parser.add_argument("--ws-clients", type=int, default=50)
+    parser.add_argument("--ws-messages", type=int, default=200)
+    parser.add_argument("--ws-timeout", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", default=None, help="write the report here, e.g. to store a baseline")
+    parser.add_argument("--baseline", default=None, help="flag regressions against this stored report")
+    parser.add_argument("--report", default=None, help="compare this stored report instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+import httpx
+from app.database import Base, get_session
+from app.main import app
+from app.services.users import users_service
+from app.utils.hashing import PasswordHasher
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+PASSWORD = "storm-password"
+
+
+class InlineHasher(PasswordHasher):
+    # hashing on the event loop, the way UsersService did before the executor
+    async def _submit(self, func, *args):
+        self.submitted += 1
+        self.started += 1
+        try:
+            return func(*args)
+        finally:
+            self.finished += 1
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def login(client: httpx.AsyncClient, username: str) -> str:
+    response = await client.post("/users/login/", data={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def storm(client: httpx.AsyncClient, username: str, deadline: float) -> int:
+    logins = 0
+    while time.perf_counter() < deadline:
+        await login(client=client, username=username)
+        logins += 1
+    return logins
+
+
+async def probe(client: httpx.AsyncClient, token: str, deadline: float, interval: float) -> list[float]:
+    latencies = []
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get("/users/me/", headers={"Authorization": f"Bearer {token}"})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def measure(client: httpx.AsyncClient, name: str, args: argparse.Namespace) -> None:
+    token = await login(client=client, username="storm-0")
+    deadline = time.perf_counter() + args.duration
+    results = await asyncio.gather(
+        probe(client=client, token=token, deadline=deadline, interval=args.interval),
+        *(storm(client=client, username=f"storm-{idx}", deadline=deadline) for idx in range(args.concurrency)),
+    )
+    latencies, logins = [seconds * 1000 for seconds in results[0]], sum(results[1:])
+    print(
+        f"{name:>8}: {logins / args.duration:7.1f} logins/s  {len(latencies):5} unrelated requests  "
+        f"p50 {statistics.median(latencies):7.2f}ms  p95 {percentile(latencies, 0.95):7.2f}ms  "
+        f"p99 {percentile(latencies, 0.99):7.2f}ms  max {max(latencies):7.2f}ms"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{directory}/login_storm.db")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+        async def override_session():
+            async with session_factory() as session:
+                yield session
+
+        app.dependency_overrides[get_session] = override_session
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for idx in range(args.concurrency):
+                response = await client.post(
+                    "/users/register/",
+                    json={"username": f"storm-{idx}", "email": f"storm-{idx}@example.com", "password": PASSWORD},
+                )
+                response.raise_for_status()
+            executor_hasher = users_service.password_hasher
+            print(f"{args.concurrency} concurrent logins for {args.duration}s, {executor_hasher.workers} hash workers")
+            users_service.password_hasher = InlineHasher(
+                context=executor_hasher.context, workers=1, queue_size=args.concurrency
+            )
+            await measure(client=client, name="inline", args=args)
+            users_service.password_hasher = executor_hasher
+            await measure(client=client, name="executor", args=args)
+            print(executor_hasher.stats)
+        app.dependency_overrides.clear()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure unrelated request latency during a login storm")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--interval", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import socket
+import statistics
+import tempfile
+import time
+
+import httpx
+from aiosmtpd.controller import Controller
+from app.config import mail_settings
+from app.database import Base, get_session
+from app.main import app
+from app.routers import users as users_router
+from app.services.mail import mail_outbox
+from app.utils.mail import SMTPConnection, build_message
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+PASSWORD = "mail-password"
+
+
+class SlowSink:
+    # stands in for a remote server, every round trip of the handshake and the data costs the same latency
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.delivered = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.latency)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        await asyncio.sleep(self.latency)
+        self.delivered += 1
+        return "250 Message accepted for delivery"
+
+
+class InlineMailer:
+    # the previous path: a fresh connection and handshake per mail, awaited inside the request
+    def __init__(self, connection_factory) -> None:
+        self.connection_factory = connection_factory
+
+    async def send_mail(self, subject: str, recipients: list[str], body: str) -> None:
+        connection = self.connection_factory()
+        message = build_message(mail_settings.mail_from, mail_settings.mail_from_name, recipients, subject, body)
+        try:
+            await connection.send(message)
+        finally:
+            await connection.close()
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def forgot_password(client: httpx.AsyncClient, email: str, semaphore: asyncio.Semaphore) -> float:
+    async with semaphore:
+        started = time.perf_counter()
+        (await client.post("/users/forgot-password/", json={"email": email})).raise_for_status()
+        return (time.perf_counter() - started) * 1000
+
+
+async def measure(client: httpx.AsyncClient, name: str, sink: SlowSink, args: argparse.Namespace) -> None:
+    delivered = sink.delivered
+    semaphore = asyncio.Semaphore(args.concurrency)
+    started = time.perf_counter()
+    latencies = await asyncio.gather(
+        *(forgot_password(client, f"mail-{idx % args.users}@example.com", semaphore) for idx in range(args.mails))
+    )
+    while sink.delivered - delivered < args.mails:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{name:>7}: {args.mails / elapsed:7.1f} mails/s  request p50 {statistics.median(latencies):7.2f}ms  "
+        f"p95 {percentile(latencies, 0.95):7.2f}ms  max {max(latencies):7.2f}ms"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    sink = SlowSink(latency=args.latency / 1000)
+    controller = Controller(sink, hostname="127.0.0.1", port=port)
+    controller.start()
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{directory}/mail.db")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+        async def override_session():
+            async with session_factory() as session:
+                yield session
+
+        def connection_factory() -> SMTPConnection:
+            return SMTPConnection(hostname="127.0.0.1", port=port, start_tls=False)
+
+        app.dependency_overrides[get_session] = override_session
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+            for idx in range(args.users):
+                user = {"username": f"mail-{idx}", "email": f"mail-{idx}@example.com", "password": PASSWORD}
+                (await client.post("/users/register/", json=user)).raise_for_status()
+            print(
+                f"{args.mails} reset mails, {args.concurrency} concurrent requests, {args.latency}ms smtp round trips"
+            )
+            users_router.mail_outbox = InlineMailer(connection_factory=connection_factory)
+            await measure(client=client, name="inline", sink=sink, args=args)
+            users_router.mail_outbox = mail_outbox
+            mail_outbox.connection_factory = connection_factory
+            mail_outbox.session_factory = session_factory
+            mail_outbox.workers = args.workers
+            await mail_outbox.start()
+            await measure(client=client, name="outbox", sink=sink, args=args)
+            await mail_outbox.stop()
+            print(mail_outbox.stats)
+        app.dependency_overrides.clear()
+        await engine.dispose()
+    controller.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare request latency and throughput of inline and outbox mail")
+    parser.add_argument("--mails", type=int, default=200)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=mail_settings.mail_workers)
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds per smtp round trip")
+    asyncio.run(main(parser.parse_args()))
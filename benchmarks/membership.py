@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import time
+import uuid
+
+from app.database import Base, bind_session
+from app.models.chats import Chat as ChatModel
+from app.models.chats import UserChat as UserChatModel
+from app.models.users import User as UserModel
+from app.repositories.chats import users_chats_repository
+from app.services.chats import chats_service
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+
+async def seed(session: AsyncSession, members: int) -> tuple[uuid.UUID, uuid.UUID]:
+    chat = ChatModel(name="benchmark")
+    users = [UserModel(username=f"member-{idx}", password="-") for idx in range(members)]
+    session.add(chat)
+    session.add_all(users)
+    await session.flush()
+    session.add_all(UserChatModel(chat_id=chat.id, user_id=user.id) for user in users)
+    await session.commit()
+    return chat.id, users[0].id
+
+
+async def send_before(session: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID) -> int:
+    chat_users = await users_chats_repository.filter(session=session, chat_id=chat_id)
+    if user_id not in [chat_user.user_id for chat_user in chat_users]:
+        raise RuntimeError("sender is not a member")
+    chat_users = await users_chats_repository.filter(session=session, chat_id=chat_id)
+    return len([chat_user.user_id for chat_user in chat_users])
+
+
+async def send_after(session: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID) -> int:
+    if not await chats_service.is_member(chat_id=chat_id, user_id=user_id):
+        raise RuntimeError("sender is not a member")
+    return len(await chats_service.get_members(chat_id=chat_id))
+
+
+async def measure(send, session_factory, messages: int, chat_id: uuid.UUID, user_id: uuid.UUID) -> float:
+    started = time.perf_counter()
+    for _ in range(messages):
+        async with session_factory() as session, bind_session(session=session):
+            await send(session, chat_id, user_id)
+    return messages / (time.perf_counter() - started)
+
+
+async def main(database_url: str, members: int, messages: int) -> None:
+    engine = create_async_engine(database_url, poolclass=StaticPool)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_factory() as session:
+        chat_id, user_id = await seed(session=session, members=members)
+
+    chats_service.membership.clear()
+    before = await measure(send_before, session_factory, messages, chat_id, user_id)
+    after = await measure(send_after, session_factory, messages, chat_id, user_id)
+    print(f"members={members} messages={messages}")
+    print(f"before: {before:,.0f} messages/s")
+    print(f"after:  {after:,.0f} messages/s ({after / before:.1f}x)")
+    print(f"index:  {chats_service.membership.stats}")
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Permission check and fan-out lookup throughput")
+    parser.add_argument("--database-url", default="sqlite+aiosqlite://")
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(database_url=args.database_url, members=args.members, messages=args.messages))
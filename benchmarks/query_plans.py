@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import uuid
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from app.config import database_settings
+from app.database import bind_session
+from app.models.chats import Chat as ChatModel
+from app.models.chats import Message as MessageModel
+from app.models.chats import ReadWatermark as ReadWatermarkModel
+from app.models.chats import UserChat as UserChatModel
+from app.models.users import User as UserModel
+from app.repositories.partitions import partitions_repository
+from app.services.chats import chats_service
+from app.services.users import users_service
+from app.utils.partitions import parse_partition
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+HOT_TABLES = {"users", "users_chats", "messages", "read_watermarks"}
+# indexes each service call must be served by, a plan that stops using one is a regression
+# even when the planner found another way around the seq scan. search is left out, common terms
+# are served by the recency index and rare ones by the GIN index
+EXPECTED_INDEXES = {
+    "UsersService.get_user(username)": {"users_username_key"},
+    "UsersService.get_user(email)": {"users_email_key"},
+    "ChatsService.get_chats": {"ix_users_chats_user_id", "chats_pkey"},
+    "ChatsService.load_members": {"ix_users_chats_chat_id_user_id"},
+    "ChatsService.get_inbox": {
+        "ix_users_chats_user_id",
+        "ix_messages_chat_id_created_at_id",
+        "ix_read_watermarks_chat_id_user_id",
+    },
+    "ChatsService.get_read_watermarks": {"ix_read_watermarks_chat_id_user_id"},
+    "ChatsService.get_messages": {"ix_messages_chat_id_created_at_id"},
+    "ChatsService.get_messages(before)": {"ix_messages_chat_id_created_at_id"},
+    "ChatsService.get_messages(after)": {"ix_messages_chat_id_created_at_id"},
+}
+# every index of a partition is attached to the index of the same name on its parent
+PARENT_INDEXES = (
+    "SELECT child.relname, parent.relname FROM pg_inherits "
+    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+    "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+    "WHERE child.relkind = 'i'"
+)
+
+
+@dataclass
+class Seed:
+    user: dict
+    chat_id: uuid.UUID
+    message: dict
+
+
+async def seed(session: AsyncSession, users: int, chats: int, members: int, messages: int) -> Seed:
+    started = datetime(2024, 1, 1)
+    await partitions_repository.ensure(session=session, start=started, end=started + timedelta(seconds=messages))
+    conn = await session.connection()
+    user_rows = [
+        {"id": uuid.uuid4(), "username": f"user-{idx}", "email": f"user-{idx}@example.com", "password": "-"}
+        for idx in range(users)
+    ]
+    chat_rows = [{"id": uuid.uuid4(), "name": f"chat-{idx}"} for idx in range(chats)]
+    member_rows, message_rows, read_rows = [], [], []
+    for chat in chat_rows:
+        chat_members = random.sample(user_rows, members)
+        member_rows.extend({"chat_id": chat["id"], "user_id": user["id"]} for user in chat_members)
+        chat_messages = []
+        for idx in range(messages):
+            message_id = uuid.uuid4()
+            chat_messages.append(
+                {
+                    "id": message_id,
+                    "chat_id": chat["id"],
+                    "from_user_id": random.choice(chat_members)["id"],
+                    "content": f"message {idx}",
+                    "created_at": started + timedelta(seconds=idx),
+                }
+            )
+        message_rows.extend(chat_messages)
+        for user in chat_members:
+            read = random.choice(chat_messages)
+            read_rows.append(
+                {
+                    "chat_id": chat["id"],
+                    "user_id": user["id"],
+                    "message_created_at": read["created_at"],
+                    "message_id": read["id"],
+                    "read_at": started,
+                }
+            )
+    await conn.execute(insert(UserModel), user_rows)
+    await conn.execute(insert(ChatModel), chat_rows)
+    await conn.execute(insert(UserChatModel), member_rows)
+    await conn.execute(insert(MessageModel), message_rows)
+    await conn.execute(insert(ReadWatermarkModel), read_rows)
+    for table in HOT_TABLES | {"chats"}:
+        await conn.exec_driver_sql(f"ANALYZE {table}")
+    member = next(row for row in member_rows if row["chat_id"] == chat_rows[0]["id"])
+    user = next(row for row in user_rows if row["id"] == member["user_id"])
+    message = next(
+        row for row in message_rows if row["chat_id"] == chat_rows[0]["id"] and row["content"] == "message 1"
+    )
+    return Seed(user=user, chat_id=chat_rows[0]["id"], message=message)
+
+
+def service_calls(data: Seed) -> dict[str, Callable[[], Awaitable]]:
+    cursor = (data.message["created_at"], data.message["id"])
+    return {
+        "UsersService.get_user(username)": lambda: users_service.get_user(username=data.user["username"]),
+        "UsersService.get_user(email)": lambda: users_service.get_user(email=data.user["email"]),
+        "ChatsService.get_chats": lambda: chats_service.get_chats(user_id=data.user["id"]),
+        "ChatsService.load_members": lambda: chats_service.load_members(chat_id=data.chat_id),
+        "ChatsService.get_inbox": lambda: chats_service.get_inbox(user_id=data.user["id"], limit=50),
+        "ChatsService.get_read_watermarks": lambda: chats_service.get_read_watermarks(chat_id=data.chat_id),
+        "ChatsService.get_messages": lambda: chats_service.get_messages(chat_id=data.chat_id, limit=50),
+        "ChatsService.get_messages(before)": lambda: chats_service.get_messages(
+            chat_id=data.chat_id, limit=50, before=cursor
+        ),
+        "ChatsService.get_messages(after)": lambda: chats_service.get_messages(
+            chat_id=data.chat_id, limit=50, after=cursor
+        ),
+        "ChatsService.search_messages": lambda: chats_service.search_messages(
+            chat_ids=[data.chat_id], terms="message", limit=20
+        ),
+    }
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        # a scan of a monthly partition counts against its parent
+        table = plan.get("Relation Name")
+        table = partition[0] if (partition := parse_partition(table or "")) else table
+        if table in HOT_TABLES:
+            found.append(table)
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def used_indexes(plan: dict, parents: dict[str, str]) -> set[str]:
+    found = set()
+    if index := plan.get("Index Name"):
+        found.add(parents.get(index, index))
+    for child in plan.get("Plans", []):
+        found |= used_indexes(child, parents)
+    return found
+
+
+async def main(database_url: str, users: int, chats: int, members: int, messages: int) -> int:
+    engine = create_async_engine(database_url)
+    captured: list[tuple[str, tuple]] = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    failures = 0
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        session = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False)
+        data = await seed(session=session, users=users, chats=chats, members=members, messages=messages)
+        # with seq scans priced out the planner only picks one when no index can serve the query
+        await conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        parents = dict((await conn.exec_driver_sql(PARENT_INDEXES)).all())
+        for name, call in service_calls(data=data).items():
+            users_service.users_cache.clear()
+            chats_service.membership.clear()
+            captured.clear()
+            async with bind_session(session=session):
+                await call()
+            statements = list(captured)
+            indexes = set()
+            for statement, parameters in statements:
+                result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+                plan = result.scalar()
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                indexes |= used_indexes(plan[0]["Plan"], parents)
+                if tables := seq_scans(plan[0]["Plan"]):
+                    failures += 1
+                    print(f"FAIL {name}: seq scan on {', '.join(sorted(set(tables)))}\n  {' '.join(statement.split())}")
+            if missing := EXPECTED_INDEXES.get(name, set()) - indexes:
+                failures += 1
+                print(f"FAIL {name}: {', '.join(sorted(missing))} not used, the plans use {', '.join(sorted(indexes))}")
+            else:
+                print(f"ok   {name}: {', '.join(sorted(indexes))}")
+        await session.close()
+        await transaction.rollback()
+    await engine.dispose()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fail when a service query plans a seq scan on a hot table or stops using its index"
+    )
+    parser.add_argument("--database-url", default=database_settings.database_url)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+    sys.exit(
+        asyncio.run(
+            main(
+                database_url=args.database_url,
+                users=args.users,
+                chats=args.chats,
+                members=args.members,
+                messages=args.messages,
+            )
+        )
+    )
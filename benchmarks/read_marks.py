@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from app.database import Base
+from app.models.chats import Chat as ChatModel
+from app.models.chats import Message as MessageModel
+from app.models.chats import ReadWatermark as ReadWatermarkModel
+from app.models.chats import UserChat as UserChatModel
+from app.models.users import User as UserModel
+from app.repositories.chats import read_watermarks_repository
+from app.repositories.partitions import partitions_repository
+from sqlalchemy import Column, DateTime, Index, MetaData, Table, Uuid, event, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+# the per-message table the watermarks replaced, dropped from the schema and only created here to compare
+read_statuses = Table(
+    "read_statuses",
+    MetaData(),
+    Column("id", Uuid, primary_key=True, default=uuid.uuid4),
+    Column("read_at", DateTime, default=datetime.utcnow, nullable=False),
+    Column("user_id", Uuid, nullable=False),
+    Column("message_id", Uuid, nullable=False),
+    Column("message_created_at", DateTime, nullable=False),
+    Index("ix_read_statuses_message_id_user_id", "message_id", "user_id", unique=True),
+)
+
+
+class Writes:
+    def __init__(self) -> None:
+        self.statements = 0
+        self.rows = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if statement.lstrip().upper().startswith(("INSERT", "UPDATE")):
+            self.statements += 1
+            self.rows += max(cursor.rowcount, 0)
+
+
+async def seed(session: AsyncSession, members: int, messages: int) -> tuple[uuid.UUID, list[uuid.UUID], list[dict]]:
+    chat_id = uuid.uuid4()
+    user_ids = [uuid.uuid4() for _ in range(members)]
+    started = datetime(2024, 1, 1)
+    message_rows = [
+        {
+            "id": uuid.uuid4(),
+            "chat_id": chat_id,
+            "from_user_id": user_ids[idx % members],
+            "content": f"message {idx}",
+            "created_at": started + timedelta(milliseconds=idx),
+        }
+        for idx in range(messages)
+    ]
+    await session.execute(
+        insert(UserModel), [{"id": user_id, "username": str(user_id), "password": "-"} for user_id in user_ids]
+    )
+    if session.bind.dialect.name == "postgresql":
+        await partitions_repository.ensure(session=session, start=started, end=message_rows[-1]["created_at"])
+    await session.execute(insert(ChatModel), [{"id": chat_id, "name": "large room"}])
+    await session.execute(insert(UserChatModel), [{"chat_id": chat_id, "user_id": user_id} for user_id in user_ids])
+    await session.execute(insert(MessageModel), message_rows)
+    return chat_id, user_ids, message_rows
+
+
+async def per_message(session: AsyncSession, chat_id, user_ids, batch: list[dict]) -> None:
+    # the previous fan-out: one read_statuses row per recipient per message
+    for message in batch:
+        await session.execute(
+            insert(read_statuses),
+            [
+                {"message_id": message["id"], "message_created_at": message["created_at"], "user_id": user_id}
+                for user_id in user_ids
+            ],
+        )
+
+
+async def watermarks(session: AsyncSession, chat_id, user_ids, batch: list[dict]) -> None:
+    marks = [(chat_id, user_id, message["created_at"], message["id"]) for message in batch for user_id in user_ids]
+    await read_watermarks_repository.advance(session=session, marks=marks)
+
+
+async def measure(engine, name: str, write, model, args: argparse.Namespace) -> None:
+    writes = Writes()
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        session = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False)
+        chat_id, user_ids, messages = await seed(session=session, members=args.members, messages=args.messages)
+        event.listen(engine.sync_engine, "after_cursor_execute", writes)
+        started = time.perf_counter()
+        for offset in range(0, len(messages), args.batch_size):
+            await write(session, chat_id, user_ids, messages[offset : offset + args.batch_size])
+        elapsed = time.perf_counter() - started
+        event.remove(engine.sync_engine, "after_cursor_execute", writes)
+        table_rows = await session.scalar(select(func.count()).select_from(model))
+        await session.close()
+        await transaction.rollback()
+    print(
+        f"{name:>13}: {writes.statements:6} statements  {writes.rows:9} rows written  "
+        f"{writes.rows / args.messages:8.1f} rows/message  {table_rows:9} rows stored  {elapsed:7.3f}s"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or f"sqlite+aiosqlite:///{directory}/read_marks.db"
+        engine = create_async_engine(database_url)
+        async with engine.begin() as conn:
+            if database_url.startswith("sqlite"):
+                await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(read_statuses.create)
+        print(f"{args.members} members, {args.messages} messages delivered in batches of {args.batch_size}")
+        try:
+            await measure(engine, "read_statuses", per_message, read_statuses, args)
+            await measure(engine, "watermarks", watermarks, ReadWatermarkModel, args)
+        finally:
+            async with engine.begin() as conn:
+                await conn.run_sync(read_statuses.drop)
+            await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare read-mark write amplification on a large room")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
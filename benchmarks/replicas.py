@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import collections
+import time
+import uuid
+
+import httpx
+from app.config import database_settings
+from app.database import engine, replica_sessionmaker, replicas
+from app.main import app
+from app.services.users import users_service
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+PASSWORD = "replica-password"
+# statements per database, counted at the cursor
+COUNTS = collections.Counter()
+
+
+def count_statements(sync_engine, name: str) -> None:
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        COUNTS[name] += 1
+
+
+async def clone(database_url: str, name: str) -> str:
+    # a snapshot of the primary that never catches up, the worst case for reading your own writes
+    url = make_url(database_url)
+    admin = create_async_engine(url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    async with admin.connect() as conn:
+        await conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        await conn.exec_driver_sql(f'CREATE DATABASE "{name}" TEMPLATE "{url.database}"')
+    await admin.dispose()
+    return url.set(database=name).render_as_string(hide_password=False)
+
+
+async def drop(database_url: str, name: str) -> None:
+    admin = create_async_engine(make_url(database_url).set(database="postgres"), isolation_level="AUTOCOMMIT")
+    async with admin.connect() as conn:
+        await conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    await admin.dispose()
+
+
+async def seed(client: httpx.AsyncClient, prefix: str, users: int) -> tuple[list[dict], list[str]]:
+    headers, chat_ids = [], []
+    for idx in range(users):
+        user = {"username": f"{prefix}-{idx}", "email": f"{prefix}-{idx}@example.com", "password": PASSWORD}
+        (await client.post("/users/register/", json=user)).raise_for_status()
+        response = await client.post("/users/login/", data={"username": user["username"], "password": PASSWORD})
+        headers.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+        chat = {"name": f"{prefix}-chat-{idx}", "private": False, "active": True}
+        (await client.post("/chats/new/", json=chat, headers=headers[-1])).raise_for_status()
+    for header in headers:
+        chats = (await client.get("/chats/all/", headers=header)).json()
+        chat_ids.extend(chat["id"] for chat in chats)
+    return headers, chat_ids
+
+
+async def reader(client: httpx.AsyncClient, header: dict, chat_id: str, prefix: str, deadline: float) -> int:
+    requests = 0
+    while time.perf_counter() < deadline:
+        for path in (
+            "/chats/all/",
+            "/chats/inbox/",
+            f"/chats/{chat_id}/messages/",
+            f"/chats/{chat_id}/members/",
+            f"/users/search/{prefix}",
+        ):
+            (await client.get(path, headers=header)).raise_for_status()
+            requests += 1
+    return requests
+
+
+async def measure(
+    client: httpx.AsyncClient, name: str, headers: list[dict], chat_ids: list[str], prefix: str, seconds: float
+) -> None:
+    COUNTS.clear()
+    # the caches would hide most reads, each round starts cold
+    users_service.users_cache.clear()
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    requests = sum(
+        await asyncio.gather(
+            *(
+                reader(client=client, header=header, chat_id=chat_id, prefix=prefix, deadline=deadline)
+                for header, chat_id in zip(headers, chat_ids)
+            )
+        )
+    )
+    elapsed = time.perf_counter() - started
+    total = sum(COUNTS.values()) or 1
+    print(
+        f"{name:>13}: {requests / elapsed:7.1f} req/s  statements on primary {COUNTS['primary']:6} "
+        f"({COUNTS['primary'] / total:4.0%})  on replica {COUNTS['replica']:6} ({COUNTS['replica'] / total:4.0%})"
+    )
+
+
+async def full_name(client: httpx.AsyncClient, header: dict) -> str:
+    # the profile is read from a replica unless the user wrote recently, the auth lookup stays on the primary
+    return (await client.get("/users/me/", headers=header)).json()["full_name"]
+
+
+async def main(args: argparse.Namespace) -> None:
+    prefix = f"replica-{uuid.uuid4().hex[:8]}"
+    replica_name = f"{make_url(args.database_url).database}_replica_standin"
+    count_statements(engine.sync_engine, "primary")
+    replicas.sticky.ttl = args.sticky_seconds
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+        headers, chat_ids = await seed(client=client, prefix=prefix, users=args.concurrency)
+        # the template must have no other connections while it is copied
+        await engine.dispose()
+        replica_url = await clone(database_url=args.database_url, name=replica_name)
+        session_factory = replica_sessionmaker(replica_url)
+        count_statements(session_factory.kw["bind"].sync_engine, "replica")
+        try:
+            await measure(client, "primary only", headers, chat_ids, prefix, args.seconds)
+            replicas.session_factories = [session_factory]
+            # seeding pinned every user to the primary, the readers below do not write
+            replicas.sticky.clear()
+            await replicas.check()
+            print(f"replica lag {replicas.lags}, healthy {len(replicas.healthy())}")
+            await measure(client, "with replica", headers, chat_ids, prefix, args.seconds)
+
+            # a write pins the writer to the primary, the stand-in never sees it
+            writer = headers[0]
+            update = {"full_name": "after the write", "email": f"{prefix}-0@example.com"}
+            (await client.put("/users/update/", json=update, headers=writer)).raise_for_status()
+            print(f"writer reads back right away: {await full_name(client, writer)!r}")
+            await asyncio.sleep(args.sticky_seconds)
+            print(f"writer after {args.sticky_seconds}s, from the replica: {await full_name(client, writer)!r}")
+
+            # the replica goes away under load, reads fall back to the primary and it leaves the rotation
+            await drop(database_url=args.database_url, name=replica_name)
+            await measure(client, "replica gone", headers, chat_ids, prefix, args.seconds)
+            await replicas.check()
+            print(f"after the check: healthy {len(replicas.healthy())}  {replicas.stats}")
+        finally:
+            replicas.session_factories, replicas.lags = [], []
+            await session_factory.kw["bind"].dispose()
+            await drop(database_url=args.database_url, name=replica_name)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Route reads to a stand-in replica, check read-your-writes and the fallback to the primary"
+    )
+    parser.add_argument("--database-url", default=database_settings.database_url)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--sticky-seconds", type=float, default=2)
+    asyncio.run(main(parser.parse_args()))
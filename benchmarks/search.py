@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from app.config import database_settings
+from app.database import bind_session
+from app.repositories.partitions import partitions_repository
+from app.services.chats import chats_service
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
+
+STARTED = datetime(2024, 1, 1)
+# zipf-like: the first words are in most messages, the last ones in a handful
+VOCABULARY = [f"w{idx}" for idx in range(5000)]
+
+
+async def seed(conn: AsyncConnection, chats: int, messages: int, user_chats: int) -> tuple[list[uuid.UUID], uuid.UUID]:
+    # generated server side, round tripping tens of millions of rows through python would dominate the run
+    user_id = uuid.uuid4()
+    await conn.exec_driver_sql(
+        "INSERT INTO users (id, username, email, password) VALUES ($1, 'search-user', 'search@example.com', '-')",
+        (user_id,),
+    )
+    await conn.exec_driver_sql(
+        "INSERT INTO chats (id, name, private, active) "
+        "SELECT gen_random_uuid(), 'chat-' || idx, false, true FROM generate_series(1, $1) AS idx",
+        (chats,),
+    )
+    await conn.exec_driver_sql(
+        "INSERT INTO users_chats (id, chat_id, user_id) "
+        "SELECT gen_random_uuid(), id, $1 FROM (SELECT id FROM chats ORDER BY random() LIMIT $2) AS picked",
+        (user_id, user_chats),
+    )
+    await conn.exec_driver_sql(
+        "INSERT INTO messages (id, created_at, from_user_id, chat_id, content) "
+        "SELECT gen_random_uuid(), $6::timestamp + idx * interval '1 second', $1, chat_ids[1 + idx % $2], "
+        "(SELECT string_agg(vocabulary[1 + floor(power(random(), 3) * $3)::int], ' ') "
+        " FROM generate_series(1, 8) AS word WHERE idx IS NOT NULL) "
+        "FROM generate_series(1, $4) AS idx, (SELECT array_agg(id) AS chat_ids FROM chats) AS all_chats, "
+        "(SELECT $5::text[] AS vocabulary) AS words",
+        (user_id, chats, len(VOCABULARY), messages, VOCABULARY, STARTED),
+    )
+    await conn.exec_driver_sql("ANALYZE messages")
+    await conn.exec_driver_sql("ANALYZE users_chats")
+    chat_ids = (await conn.exec_driver_sql("SELECT chat_id FROM users_chats WHERE user_id = $1", (user_id,))).scalars()
+    return list(chat_ids), user_id
+
+
+async def main(args: argparse.Namespace) -> None:
+    engine = create_async_engine(args.database_url)
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        session = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False)
+        await partitions_repository.ensure(
+            session=session, start=STARTED, end=STARTED + timedelta(seconds=args.messages + 1)
+        )
+        started = time.perf_counter()
+        chat_ids, _ = await seed(conn=conn, chats=args.chats, messages=args.messages, user_chats=args.user_chats)
+        print(f"seeded {args.messages} messages in {args.chats} chats in {time.perf_counter() - started:.0f}s")
+        for terms in ("w0", "w10", "w200", "w4000", "w0 w10", '"w1 w2"', "w3 -w0"):
+            latencies = []
+            for _ in range(args.repeat):
+                began = time.perf_counter()
+                async with bind_session(session=session):
+                    rows = await chats_service.search_messages(chat_ids=chat_ids, terms=terms, limit=args.limit)
+                latencies.append((time.perf_counter() - began) * 1000)
+            print(
+                f"{terms:>10}: {len(rows):3} hits  p50 {statistics.median(latencies):7.2f}ms  "
+                f"max {max(latencies):7.2f}ms"
+            )
+        await session.close()
+        await transaction.rollback()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure message search latency on a large, migrated database")
+    parser.add_argument("--database-url", default=database_settings.database_url)
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--chats", type=int, default=10_000)
+    parser.add_argument("--user-chats", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import io
+import math
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+from app.config import media_settings
+from app.database import Base, get_session
+from app.main import app
+from app.repositories.users import UsersRepository
+from app.services.users import users_service
+from PIL import Image
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+PASSWORD = "upload-password"
+BOUNDARY = "benchmark-boundary"
+
+
+class InlinePhotoRepository(UsersRepository):
+    # the previous upload path: the whole file in memory, blocking writes on the event loop
+    async def upload_photo(self, instance, photo, session):
+        photo_path = os.path.join(media_settings.media_root, "user", str(instance.id), "inline")
+        os.makedirs(os.path.dirname(photo_path), exist_ok=True)
+        with open(photo_path, "wb") as buffer:
+            buffer.write(await photo.read())
+        await self.update_where({"avatar": photo_path}, session=session, id=instance.id)
+        instance.avatar = photo_path
+        return instance
+
+
+def noise_png(size_mb: int) -> bytes:
+    # random pixels do not compress, so the file is about as large as the raw image
+    side = int(math.sqrt((size_mb << 20) / 3))
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(buffer, format="PNG", compress_level=0)
+    return buffer.getvalue()
+
+
+async def multipart(payload: bytes):
+    # streamed in small chunks so the client does not hold copies of the body
+    yield (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="photo"; filename="avatar.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode()
+    for offset in range(0, len(payload), 1 << 16):
+        yield payload[offset : offset + (1 << 16)]
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def probe(client: httpx.AsyncClient, headers: dict, done: asyncio.Event) -> list[float]:
+    latencies = []
+    while not done.is_set():
+        started = time.perf_counter()
+        (await client.get("/users/me/", headers=headers)).raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+async def measure(client: httpx.AsyncClient, name: str, tokens: list[str], payload: bytes) -> None:
+    done = asyncio.Event()
+    headers = [{"Authorization": f"Bearer {token}"} for token in tokens]
+    # the first user probes, the others upload
+    prober = asyncio.create_task(probe(client=client, headers=headers[0], done=done))
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    responses = await asyncio.gather(
+        *(
+            client.post(
+                "/users/avatar/",
+                content=multipart(payload),
+                headers={**header, "Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+            )
+            for header in headers[1:]
+        )
+    )
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    done.set()
+    latencies = await prober
+    for response in responses:
+        response.raise_for_status()
+    print(
+        f"{name:>9}: {len(tokens) - 1} x {len(payload) >> 20}MB in {elapsed:6.2f}s  peak traced {peak >> 20:5}MB  "
+        f"unrelated requests p50 {statistics.median(latencies):7.2f}ms  max {max(latencies):7.2f}ms"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        media_settings.media_root = directory
+        media_settings.avatar_max_size = args.size_mb << 21
+        engine = create_async_engine(f"sqlite+aiosqlite:///{directory}/uploads.db")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+        async def override_session():
+            async with session_factory() as session:
+                yield session
+
+        app.dependency_overrides[get_session] = override_session
+        payload = noise_png(args.size_mb)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+            tokens = []
+            for idx in range(args.concurrency + 1):
+                user = {"username": f"upload-{idx}", "email": f"upload-{idx}@example.com", "password": PASSWORD}
+                (await client.post("/users/register/", json=user)).raise_for_status()
+                response = await client.post("/users/login/", data={"username": user["username"], "password": PASSWORD})
+                tokens.append(response.json()["access_token"])
+            # spawn the image workers before measuring
+            warmup = {"photo": ("avatar.png", noise_png(1), "image/png")}
+            headers = {"Authorization": f"Bearer {tokens[0]}"}
+            (await client.post("/users/avatar/", files=warmup, headers=headers)).raise_for_status()
+            streaming_repository = users_service.users_repository
+            users_service.users_repository = InlinePhotoRepository()
+            await measure(client=client, name="inline", tokens=tokens, payload=payload)
+            users_service.users_repository = streaming_repository
+            await measure(client=client, name="streaming", tokens=tokens, payload=payload)
+        app.dependency_overrides.clear()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare memory and loop stalls of concurrent avatar uploads")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -7,8 +7,10 @@ from sqlalchemy.ext.asyncio import AsyncEngine
 
 from app.models.users import *
 from app.models.chats import *
+from app.models.mail import *
 from alembic import context
 from app.config import database_settings
+from app.utils.partitions import parse_partition
 
 
 config = context.config
@@ -22,6 +24,27 @@ config.set_section_option("alembic", "sqlalchemy.url", database_settings.databas
 
 target_metadata = Base.metadata
 
+# created by hand written migrations only, the models cannot express them and sqlite cannot create them
+MIGRATION_ONLY = {
+    "search_vector",
+    "ix_messages_chat_id_search_vector",
+    "ix_users_username_prefix",
+    "ix_users_username_trgm",
+    "ix_users_email_lower",
+}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "table" and parse_partition(name):
+        # monthly partitions are created and dropped by the app, not by migrations
+        return False
+    if type_ == "foreign_key_constraint" and reflected:
+        # postgres clones a foreign key to a partitioned table for every partition it references
+        referred = object.elements[0].target_fullname.split(".")[-2]
+        if parse_partition(referred):
+            return False
+    return not (reflected and compare_to is None and name in MIGRATION_ONLY)
+
 
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
@@ -36,6 +59,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -45,7 +69,7 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -0,0 +1,39 @@
+"""add hot path indexes
+
+Revision ID: 3133f1b30f47
+Revises: c0cb43dfeded
+Create Date: 2026-10-18 10:00:12.403118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3133f1b30f47'
+down_revision = 'c0cb43dfeded'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # unique indexes below would fail on rows duplicated before they existed
+    op.execute(
+        "DELETE FROM users_chats a USING users_chats b "
+        "WHERE a.chat_id = b.chat_id AND a.user_id = b.user_id AND a.ctid > b.ctid"
+    )
+    op.execute(
+        "DELETE FROM read_statuses a USING read_statuses b "
+        "WHERE a.message_id = b.message_id AND a.user_id = b.user_id AND a.ctid > b.ctid"
+    )
+    op.create_index('ix_messages_chat_id_created_at_id', 'messages', ['chat_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_users_chats_chat_id_user_id', 'users_chats', ['chat_id', 'user_id'], unique=True)
+    op.create_index('ix_users_chats_user_id', 'users_chats', ['user_id'], unique=False)
+    op.create_index('ix_read_statuses_message_id_user_id', 'read_statuses', ['message_id', 'user_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_read_statuses_message_id_user_id', table_name='read_statuses')
+    op.drop_index('ix_users_chats_user_id', table_name='users_chats')
+    op.drop_index('ix_users_chats_chat_id_user_id', table_name='users_chats')
+    op.drop_index('ix_messages_chat_id_created_at_id', table_name='messages')
@@ -0,0 +1,35 @@
+"""add user search indexes
+
+Revision ID: cf2c0f9e7941
+Revises: 3133f1b30f47
+Create Date: 2026-10-18 10:30:41.882310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cf2c0f9e7941'
+down_revision = '3133f1b30f47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_users_username_prefix', 'users', [sa.text('lower(username) COLLATE "C"')], unique=False)
+    op.create_index(
+        'ix_users_username_trgm',
+        'users',
+        [sa.text('lower(username) gin_trgm_ops')],
+        unique=False,
+        postgresql_using='gin',
+    )
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_email_lower', table_name='users')
+    op.drop_index('ix_users_username_trgm', table_name='users')
+    op.drop_index('ix_users_username_prefix', table_name='users')
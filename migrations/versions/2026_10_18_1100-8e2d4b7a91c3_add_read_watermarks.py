@@ -0,0 +1,44 @@
+"""add read watermarks
+
+Revision ID: 8e2d4b7a91c3
+Revises: cf2c0f9e7941
+Create Date: 2026-10-18 11:00:27.104532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2d4b7a91c3'
+down_revision = 'cf2c0f9e7941'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('read_watermarks',
+    sa.Column('id', sa.UUID(), server_default=sa.text('gen_random_uuid()'), nullable=False),
+    sa.Column('chat_id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('message_created_at', sa.DateTime(), nullable=False),
+    sa.Column('message_id', sa.UUID(), nullable=False),
+    sa.Column('read_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_read_watermarks_chat_id_user_id', 'read_watermarks', ['chat_id', 'user_id'], unique=True)
+    # the newest message each member has read becomes their watermark, read_statuses is dropped when messages are partitioned
+    op.execute(
+        "INSERT INTO read_watermarks (chat_id, user_id, message_created_at, message_id, read_at) "
+        "SELECT DISTINCT ON (messages.chat_id, read_statuses.user_id) "
+        "messages.chat_id, read_statuses.user_id, messages.created_at, messages.id, read_statuses.read_at "
+        "FROM read_statuses JOIN messages ON messages.id = read_statuses.message_id "
+        "ORDER BY messages.chat_id, read_statuses.user_id, messages.created_at DESC, messages.id DESC"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_read_watermarks_chat_id_user_id', table_name='read_watermarks')
+    op.drop_table('read_watermarks')
@@ -0,0 +1,36 @@
+"""add mail outbox
+
+Revision ID: 5c0e8a2f7d13
+Revises: 3b7f1c9d4e26
+Create Date: 2026-10-18 13:00:41.902315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0e8a2f7d13'
+down_revision = '3b7f1c9d4e26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('mail_outbox',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('recipients', sa.JSON(), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_mail_outbox_next_attempt_at', 'mail_outbox', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_mail_outbox_next_attempt_at', table_name='mail_outbox')
+    op.drop_table('mail_outbox')
@@ -0,0 +1,63 @@
+"""add message search
+
+Revision ID: 9d4a6e1b2f58
+Revises: 5c0e8a2f7d13
+Create Date: 2026-10-18 14:00:27.519804
+
+"""
+from uuid import UUID
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4a6e1b2f58'
+down_revision = '5c0e8a2f7d13'
+branch_labels = None
+depends_on = None
+
+# rows filled per statement, each batch commits on its own so no lock is held for long
+BACKFILL_BATCH_SIZE = 10000
+BACKFILL = (
+    "WITH batch AS (SELECT id FROM messages WHERE id > :after ORDER BY id LIMIT :batch_size) "
+    "UPDATE messages SET search_vector = to_tsvector('simple', content) "
+    "FROM batch WHERE messages.id = batch.id RETURNING messages.id"
+)
+
+
+def upgrade() -> None:
+    # btree_gin lets one GIN index answer both the chat scope and the text match
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    # a generated column would rewrite messages under an exclusive lock, a nullable one is added in place
+    op.add_column('messages', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    # new and edited messages get their vector from the trigger, 'simple' matches the config the queries use
+    op.execute(
+        "CREATE TRIGGER messages_search_vector_update BEFORE INSERT OR UPDATE OF content ON messages "
+        "FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.simple', content)"
+    )
+    with op.get_context().autocommit_block():
+        # existing rows are filled in keyset batches while writes go on
+        after = UUID(int=0)
+        while True:
+            batch = op.get_bind().execute(sa.text(BACKFILL), {'after': after, 'batch_size': BACKFILL_BATCH_SIZE})
+            if not (ids := batch.scalars().all()):
+                break
+            after = max(ids)
+        # built without blocking writes, the GIN pending list then absorbs new messages incrementally
+        op.create_index(
+            'ix_messages_chat_id_search_vector',
+            'messages',
+            ['chat_id', 'search_vector'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_chat_id_search_vector', table_name='messages', postgresql_concurrently=True)
+    op.execute("DROP TRIGGER messages_search_vector_update ON messages")
+    op.drop_column('messages', 'search_vector')
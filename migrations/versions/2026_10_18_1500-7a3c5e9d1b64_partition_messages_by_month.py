@@ -0,0 +1,110 @@
+"""partition messages by month
+
+Revision ID: 7a3c5e9d1b64
+Revises: 9d4a6e1b2f58
+Create Date: 2026-10-18 15:00:41.862017
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3c5e9d1b64'
+down_revision = '9d4a6e1b2f58'
+branch_labels = None
+depends_on = None
+
+# months created ahead of now, the app keeps extending this with PARTITION_PREMAKE_MONTHS
+PREMAKE_MONTHS = 3
+
+
+def create_monthly_partitions(parent: str, key: str, source: str) -> None:
+    # one partition for every month that has rows and for the months ahead
+    months = op.get_bind().execute(
+        sa.text(
+            "SELECT generate_series("
+            f"date_trunc('month', coalesce((SELECT min({key}) FROM {source}), now())), "
+            f"date_trunc('month', now()) + interval '{PREMAKE_MONTHS} months', interval '1 month')::date"
+        )
+    ).scalars()
+    for month in months:
+        next_month = month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+        op.execute(
+            f"CREATE TABLE {parent}_p{month:%Y%m} PARTITION OF {parent} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month:%Y-%m-%d}')"
+        )
+
+
+def upgrade() -> None:
+    # read watermarks replaced read_statuses, nothing has written to it since and it is not carried over
+    op.drop_table('read_statuses')
+    # rewritten into a partitioned table, writes to messages are blocked until the copy is done,
+    # the search vector is generated by the new table and its trigger goes with the old one
+    op.rename_table('messages', 'messages_unpartitioned')
+    op.execute(
+        "CREATE TABLE messages ("
+        "id uuid NOT NULL DEFAULT gen_random_uuid(), "
+        "created_at timestamp without time zone NOT NULL, "
+        "from_user_id uuid NOT NULL, "
+        "chat_id uuid NOT NULL, "
+        "content varchar(255) NOT NULL, "
+        "search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED"
+        ") PARTITION BY RANGE (created_at)"
+    )
+    create_monthly_partitions('messages', 'created_at', 'messages_unpartitioned')
+    op.execute(
+        "INSERT INTO messages (id, created_at, from_user_id, chat_id, content) "
+        "SELECT id, created_at, from_user_id, chat_id, content FROM messages_unpartitioned"
+    )
+    # the old table holds the constraint and index names, it goes before the new ones are created
+    op.drop_table('messages_unpartitioned')
+    # built once after the copy, every partition gets its own index
+    op.create_primary_key('messages_pkey', 'messages', ['id', 'created_at'])
+    op.create_foreign_key('messages_chat_id_fkey', 'messages', 'chats', ['chat_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('messages_from_user_id_fkey', 'messages', 'users', ['from_user_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_messages_chat_id_created_at_id', 'messages', ['chat_id', 'created_at', 'id'], unique=False)
+    op.create_index(
+        'ix_messages_chat_id_search_vector', 'messages', ['chat_id', 'search_vector'], unique=False, postgresql_using='gin'
+    )
+
+
+def downgrade() -> None:
+    # archived months are not brought back, read_statuses returns empty
+    op.rename_table('messages', 'messages_partitioned')
+    op.create_table('messages',
+    sa.Column('id', sa.UUID(), server_default=sa.text('gen_random_uuid()'), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('from_user_id', sa.UUID(), nullable=False),
+    sa.Column('chat_id', sa.UUID(), nullable=False),
+    sa.Column('content', sa.String(length=255), nullable=False),
+    sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True),
+    )
+    op.create_table('read_statuses',
+    sa.Column('id', sa.UUID(), server_default=sa.text('gen_random_uuid()'), nullable=False),
+    sa.Column('read_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('message_id', sa.UUID(), nullable=False),
+    )
+    op.execute(
+        "INSERT INTO messages (id, created_at, from_user_id, chat_id, content, search_vector) "
+        "SELECT id, created_at, from_user_id, chat_id, content, search_vector FROM messages_partitioned"
+    )
+    op.execute(
+        "CREATE TRIGGER messages_search_vector_update BEFORE INSERT OR UPDATE OF content ON messages "
+        "FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.simple', content)"
+    )
+    # dropping the parent drops every partition with it
+    op.drop_table('messages_partitioned')
+    op.create_primary_key('messages_pkey', 'messages', ['id'])
+    op.create_foreign_key('messages_chat_id_fkey', 'messages', 'chats', ['chat_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('messages_from_user_id_fkey', 'messages', 'users', ['from_user_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_messages_chat_id_created_at_id', 'messages', ['chat_id', 'created_at', 'id'], unique=False)
+    op.create_index(
+        'ix_messages_chat_id_search_vector', 'messages', ['chat_id', 'search_vector'], unique=False, postgresql_using='gin'
+    )
+    op.create_primary_key('read_statuses_pkey', 'read_statuses', ['id'])
+    op.create_foreign_key('read_statuses_user_id_fkey', 'read_statuses', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('read_statuses_message_id_fkey', 'read_statuses', 'messages', ['message_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_read_statuses_message_id_user_id', 'read_statuses', ['message_id', 'user_id'], unique=True)
@@ -1,18 +1,15 @@
 import nox
 from dotenv import load_dotenv
 
+nox.options.sessions = ["format", "lint", "query_plans"]
+
 
 @nox.session
 def format(session: nox.Session) -> None:
     session.install("ufmt", "black", "isort")
     session.run("ufmt", "format", "app", "tests")
     session.run("black", "--config=configs/.black.toml", "app", "tests")
-    session.run(
-        "isort",
-        "--sp=configs/.isort.cfg",
-        "app",
-        "tests"
-    )
+    session.run("isort", "--sp=configs/.isort.cfg", "app", "tests")
 
 
 @nox.session
@@ -38,3 +35,88 @@ def lint(session: nox.Session) -> None:
 #     load_dotenv(dotenv_path="./.env.example")
 #     session.install("-r", "requirements.txt")
 #     session.run("pytest")
+
+
+@nox.session
+def membership(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.membership", *session.posargs)
+
+
+@nox.session
+def query_plans(session: nox.Session) -> None:
+    # fails when a service query plans a seq scan or stops using its index, needs the migrated postgres database
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.query_plans", *session.posargs)
+
+
+@nox.session
+def broadcast(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.broadcast", *session.posargs)
+
+
+@nox.session
+def ingest(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.ingest", *session.posargs)
+
+
+@nox.session
+def read_marks(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.read_marks", *session.posargs)
+
+
+@nox.session
+def login_storm(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.login_storm", *session.posargs)
+
+
+@nox.session
+def load(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.load", *session.posargs)
+
+
+@nox.session
+def uploads(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.uploads", *session.posargs)
+
+
+@nox.session
+def mail(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.mail", *session.posargs)
+
+
+@nox.session
+def search(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.search", *session.posargs)
+
+
+@nox.session
+def export(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.export", *session.posargs)
+
+
+@nox.session
+def replicas(session: nox.Session) -> None:
+    load_dotenv(dotenv_path="./.env.example")
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.replicas", *session.posargs)
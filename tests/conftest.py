@@ -1,8 +1,16 @@
-from collections.abc import AsyncGenerator
+import socket
+from collections.abc import AsyncGenerator, Generator
 
+import pytest
 import pytest_asyncio
+from aiosmtpd.controller import Controller
+from app.controllers.users import users_controller
 from app.database import Base, get_session
 from app.main import app as main_app
+from app.services.chats import chats_service
+from app.services.mail import mail_outbox
+from app.services.users import users_service
+from app.utils.mail import SMTPConnection
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
@@ -25,6 +33,9 @@ async def app() -> AsyncGenerator:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     yield main_app
+    users_controller.tokens_cache.clear()
+    users_service.users_cache.clear()
+    chats_service.membership.clear()
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
 
@@ -33,7 +44,7 @@ async def app() -> AsyncGenerator:
 async def db_session(app: FastAPI) -> AsyncGenerator:
     connection = await engine.connect()
     transaction = await connection.begin()
-    session = Session(bind=connection)
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
     yield session
     await session.close()
     await transaction.rollback()
@@ -48,3 +59,45 @@ async def client(app: FastAPI, db_session: Session) -> AsyncGenerator | TestClie
     app.dependency_overrides[get_session] = _get_test_db
     with TestClient(app) as client:
         yield client
+
+
+class SMTPSink:
+    # keeps every envelope that reaches the local smtp server, replies queued by a test are answered first
+    def __init__(self) -> None:
+        self.envelopes = []
+        self.replies: list[str] = []
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        if self.replies:
+            return self.replies.pop(0)
+        self.envelopes.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def smtp_server(db_session: Session) -> Generator:
+    # request it before client, the outbox opens its connections when the app starts
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    sink = SMTPSink()
+    controller = Controller(sink, hostname="127.0.0.1", port=port)
+    controller.start()
+    defaults = (
+        mail_outbox.connection_factory,
+        mail_outbox.session_factory,
+        mail_outbox.poll_interval,
+        mail_outbox.workers,
+    )
+    mail_outbox.connection_factory = lambda: SMTPConnection(hostname="127.0.0.1", port=port, start_tls=False)
+    # a single sender joins the test transaction like the request sessions do, and only runs once a request committed
+    mail_outbox.session_factory = lambda: Session(bind=db_session.bind, join_transaction_mode="create_savepoint")
+    mail_outbox.poll_interval, mail_outbox.workers = 3600, 1
+    yield sink
+    (
+        mail_outbox.connection_factory,
+        mail_outbox.session_factory,
+        mail_outbox.poll_interval,
+        mail_outbox.workers,
+    ) = defaults
+    controller.stop()
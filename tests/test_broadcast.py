@@ -0,0 +1,204 @@
+import asyncio
+import uuid
+from uuid import UUID
+
+import pytest
+from app.controllers.chats import ChatsController
+from app.services.chats import ChatsService, chats_service
+from app.services.export import messages_exporter
+from app.services.ingest import messages_ingestor
+from app.utils.broadcast import BroadcastBackend, MemoryBroadcast
+from app.utils.hub import ChatHub
+from fastapi import status
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+        self.closed_with: int | None = None
+
+    async def accept(self) -> None:
+        return None
+
+    async def send_text(self, text: str) -> None:
+        self.sent.append(text)
+
+    async def close(self, code: int) -> None:
+        self.closed_with = code
+
+
+async def settle() -> None:
+    # lets the hub writers drain their queues
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def workers(count: int) -> list[tuple[MemoryBroadcast, ChatHub]]:
+    bus: list[MemoryBroadcast] = []
+    return [
+        (
+            MemoryBroadcast(batch_size=100, flush_interval=0.001, bus=bus),
+            ChatHub(queue_size=8, slow_consumer_policy="drop", send_timeout=1),
+        )
+        for _ in range(count)
+    ]
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        BroadcastBackend(batch_size=1, flush_interval=1)
+
+
+async def test_messages_reach_sockets_on_every_worker():
+    chat_id = uuid.uuid4()
+    sockets = []
+    for backend, hub in (instances := workers(2)):
+
+        async def deliver(events: list[dict], hub: ChatHub = hub) -> None:
+            for event in events:
+                hub.publish(chat_id=UUID(event["chat_id"]), payload=event["payload"])
+
+        sockets.append(websocket := FakeWebSocket())
+        await hub.connect(websocket=websocket, user_id=uuid.uuid4(), chat_id=chat_id)
+        await backend.start(handler=deliver)
+
+    first = instances[0][0]
+    first.publish({"chat_id": str(chat_id), "message_id": str(uuid.uuid4()), "payload": "hello"})
+    for backend, _ in instances:
+        await backend.stop()
+    await settle()
+    assert [websocket.sent for websocket in sockets] == [["hello"], ["hello"]]
+    assert [backend.received for backend, _ in instances] == [1, 1]
+
+
+async def test_typed_events_go_to_their_handler_in_order():
+    (first, _), (second, _) = workers(2)
+    received = []
+
+    async def record(events: list[dict]) -> None:
+        received.extend(events)
+
+    await first.start(handler=record)
+    second.subscribe("member", record)
+    await second.start(handler=record)
+    first.publish({"chat_id": "c", "message_id": "m1", "payload": "one"})
+    first.publish({"type": "member", "chat_id": "c", "user_id": "u", "action": "add"}, key="member:c:u")
+    first.publish({"type": "member", "chat_id": "c", "user_id": "u", "action": "remove"}, key="member:c:u")
+    first.publish({"chat_id": "c", "message_id": "m2", "payload": "two"})
+    await first.stop()
+    await second.stop()
+    # the first worker has no member handler, repeated publishes of a key coalesce to the last one
+    assert [event.get("message_id") or event["action"] for event in received] == [
+        "m1",
+        "m2",
+        "m1",
+        "remove",
+        "m2",
+    ]
+
+
+async def chat_workers(count: int) -> list[ChatsController]:
+    # what every process builds at startup, with its own index, hub and broadcast
+    controllers = []
+    for backend, hub in workers(count):
+        service = ChatsService(
+            chats_repository=chats_service.chats_repository,
+            messages_repository=chats_service.messages_repository,
+            users_chats_repository=chats_service.users_chats_repository,
+            read_watermarks_repository=chats_service.read_watermarks_repository,
+            broadcast=backend,
+        )
+        controller = ChatsController(
+            chats_service=service, hub=hub, broadcast=backend, ingestor=messages_ingestor, exporter=messages_exporter
+        )
+        backend.subscribe("member", controller.apply_membership)
+        await backend.start(handler=controller.deliver)
+        controllers.append(controller)
+    return controllers
+
+
+async def test_membership_changes_reach_every_worker():
+    chat_id, staying, leaving, joining = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    first, second = await chat_workers(2)
+    for controller in (first, second):
+        controller.chats_service.membership.set_members(chat_id, [staying, leaving])
+    # what remove_member and add_member run once their transaction commits
+    first.chats_service.publish_membership(chat_id, leaving, "remove")
+    first.chats_service.publish_membership(chat_id, joining, "add")
+    for controller in (first, second):
+        await controller.broadcast.stop()
+    for controller in (first, second):
+        assert not await controller.chats_service.is_member(chat_id=chat_id, user_id=leaving)
+        assert await controller.chats_service.is_member(chat_id=chat_id, user_id=joining)
+        assert await controller.chats_service.is_member(chat_id=chat_id, user_id=staying)
+
+
+async def test_removed_member_is_disconnected_on_every_worker():
+    chat_id, member, other = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    first, second = await chat_workers(2)
+    sockets = {}
+    for controller in (first, second):
+        for user_id in (member, other):
+            sockets[controller, user_id] = websocket = FakeWebSocket()
+            await controller.hub.connect(websocket=websocket, user_id=user_id, chat_id=chat_id)
+    first.chats_service.publish_membership(chat_id, member, "remove")
+    for controller in (first, second):
+        await controller.broadcast.stop()
+    await settle()
+    for controller in (first, second):
+        assert sockets[controller, member].closed_with == status.WS_1008_POLICY_VIOLATION
+        assert sockets[controller, other].closed_with is None
+
+
+class SlowWebSocket(FakeWebSocket):
+    # every send waits until the test lets it through
+    def __init__(self) -> None:
+        super().__init__()
+        self.unblocked = asyncio.Event()
+
+    async def send_text(self, text: str) -> None:
+        await self.unblocked.wait()
+        await super().send_text(text)
+
+
+async def slow_and_fast_consumer(hub: ChatHub) -> tuple[SlowWebSocket, FakeWebSocket]:
+    chat_id = uuid.uuid4()
+    slow, fast = SlowWebSocket(), FakeWebSocket()
+    for websocket in (slow, fast):
+        await hub.connect(websocket=websocket, user_id=uuid.uuid4(), chat_id=chat_id)
+    for idx in range(6):
+        hub.publish(chat_id=chat_id, payload=f"message {idx}")
+        await settle()
+    return slow, fast
+
+
+async def test_slow_consumer_loses_its_oldest_messages():
+    hub = ChatHub(queue_size=2, slow_consumer_policy="drop", send_timeout=1)
+    slow, fast = await slow_and_fast_consumer(hub)
+    slow.unblocked.set()
+    await settle()
+    # the first one was already being sent, of the rest only the newest fit the queue
+    assert slow.sent == ["message 0", "message 4", "message 5"]
+    assert fast.sent == [f"message {idx}" for idx in range(6)]
+    assert (hub.stats["dropped"], hub.stats["slow_disconnects"]) == (3, 0)
+    await hub.close()
+
+
+async def test_slow_consumer_is_disconnected_when_its_queue_is_full():
+    hub = ChatHub(queue_size=2, slow_consumer_policy="disconnect", send_timeout=1)
+    slow, fast = await slow_and_fast_consumer(hub)
+    assert slow.closed_with == status.WS_1013_TRY_AGAIN_LATER
+    assert fast.closed_with is None
+    assert fast.sent == [f"message {idx}" for idx in range(6)]
+    assert (hub.stats["connections"], hub.stats["dropped"], hub.stats["slow_disconnects"]) == (1, 0, 1)
+    await hub.close()
+
+
+async def test_stalled_send_disconnects_after_the_timeout():
+    hub = ChatHub(queue_size=8, slow_consumer_policy="drop", send_timeout=0.01)
+    chat_id = uuid.uuid4()
+    await hub.connect(websocket=(stalled := SlowWebSocket()), user_id=uuid.uuid4(), chat_id=chat_id)
+    hub.publish(chat_id=chat_id, payload="hello")
+    await asyncio.sleep(0.05)
+    assert stalled.closed_with == status.WS_1013_TRY_AGAIN_LATER
+    assert (hub.stats["connections"], hub.stats["slow_disconnects"]) == (0, 1)
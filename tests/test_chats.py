@@ -0,0 +1,294 @@
+import csv
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from app.config import pagination_settings, search_settings
+from app.models.chats import Chat as ChatModel
+from app.models.chats import Message as MessageModel
+from app.repositories.chats import messages_repository, read_watermarks_repository
+from app.services.export import messages_exporter
+from app.utils.cursor import encode_cursor
+from fastapi.testclient import TestClient
+from sqlalchemy import create_mock_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def register(client: TestClient, username: str) -> tuple[dict, str]:
+    user = {"username": username, "email": f"{username}@example.com", "password": "password"}
+    assert client.post("/users/register/", json=user).status_code == 201
+    response = client.post("/users/login/", data={"username": username, "password": "password"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return headers, client.get("/users/me/", headers=headers).json()["id"]
+
+
+async def read_up_to(db_session: AsyncSession, chat_id: str, user_ids: list[str], contents: list[str]) -> None:
+    messages = [
+        MessageModel(
+            chat_id=uuid.UUID(chat_id),
+            from_user_id=uuid.UUID(user_ids[0]),
+            content=content,
+            created_at=datetime(2024, 1, 1) + timedelta(minutes=idx),
+        )
+        for idx, content in enumerate(contents)
+    ]
+    db_session.add_all(messages)
+    await db_session.flush()
+    last = messages[-1]
+    marks = [(last.chat_id, uuid.UUID(user_id), last.created_at, last.id) for user_id in user_ids]
+    await read_watermarks_repository.advance(session=db_session, marks=marks)
+    await db_session.commit()
+
+
+def test_members_who_left_are_not_counted_as_readers(client: TestClient, db_session: AsyncSession):
+    owner, owner_id = register(client, "alice")
+    _, member_id = register(client, "bob")
+    client.post("/chats/new/", json={"name": "chat", "private": True, "active": True}, headers=owner)
+    chat_id = client.get("/chats/all/", headers=owner).json()[0]["id"]
+    client.post(f"/chats/{chat_id}/add-member/", json={"id": member_id}, headers=owner)
+    client.portal.call(read_up_to, db_session, chat_id, [owner_id, member_id], ["one", "two"])
+
+    path = f"/chats/{chat_id}/messages/?read_statuses=count"
+    assert [item["read_count"] for item in client.get(path, headers=owner).json()["items"]] == [2, 2]
+    client.request("DELETE", f"/chats/{chat_id}/remove-member/", json={"id": member_id}, headers=owner)
+    assert [item["read_count"] for item in client.get(path, headers=owner).json()["items"]] == [1, 1]
+    full = client.get(f"/chats/{chat_id}/messages/", headers=owner).json()["items"]
+    assert [[mark["user_id"] for mark in item["read_statuses"]] for item in full] == [[owner_id], [owner_id]]
+
+
+async def test_bulk_delete_matches_the_whole_primary_key(client: TestClient, db_session: AsyncSession):
+    _, user_id = register(client, "alice")
+    chat = ChatModel(name="chat")
+    db_session.add(chat)
+    await db_session.flush()
+    # in a partitioned table the same id can come back in another month
+    message_id = uuid.uuid4()
+    january, february = (
+        MessageModel(id=message_id, chat_id=chat.id, from_user_id=uuid.UUID(user_id), content="", created_at=created_at)
+        for created_at in (datetime(2024, 1, 1), datetime(2024, 2, 1))
+    )
+    db_session.add_all([january, february])
+    await db_session.flush()
+
+    await messages_repository.bulk_delete([january], session=db_session)
+    remaining = await messages_repository.filter(session=db_session, id=message_id)
+    assert [message.created_at for message in remaining] == [datetime(2024, 2, 1)]
+
+
+async def post(db_session: AsyncSession, chat_id: str, user_id: str, count: int) -> None:
+    db_session.add_all(
+        MessageModel(
+            chat_id=uuid.UUID(chat_id),
+            from_user_id=uuid.UUID(user_id),
+            content=f"message {idx}",
+            created_at=datetime(2024, 1, 1) + timedelta(minutes=idx),
+        )
+        for idx in range(count)
+    )
+    await db_session.commit()
+
+
+def test_inbox_stops_counting_unread_messages_at_the_cap(client: TestClient, db_session: AsyncSession, monkeypatch):
+    monkeypatch.setattr(pagination_settings, "inbox_max_unread", 5)
+    owner, owner_id = register(client, "alice")
+    _, member_id = register(client, "bob")
+    for name, count in (("quiet", 4), ("busy", 7)):
+        client.post("/chats/new/", json={"name": name, "private": True, "active": True}, headers=owner)
+        chat_id = next(chat["id"] for chat in client.get("/chats/all/", headers=owner).json() if chat["name"] == name)
+        client.post(f"/chats/{chat_id}/add-member/", json={"id": member_id}, headers=owner)
+        client.portal.call(post, db_session, chat_id, member_id, count)
+    client.portal.call(post, db_session, chat_id, owner_id, 1)
+
+    inbox = {chat["name"]: chat for chat in client.get("/chats/inbox/", headers=owner).json()["items"]}
+    assert (inbox["quiet"]["unread_count"], inbox["quiet"]["unread_label"]) == (4, "4")
+    # the owner's own message is not unread, seven from bob are counted up to the cap
+    assert (inbox["busy"]["unread_count"], inbox["busy"]["unread_label"]) == (5, "4+")
+
+
+async def post_at(db_session: AsyncSession, chat_id: str, user_id: str, created_at: list[datetime]) -> list[str]:
+    messages = [
+        MessageModel(chat_id=uuid.UUID(chat_id), from_user_id=uuid.UUID(user_id), content="", created_at=moment)
+        for moment in created_at
+    ]
+    db_session.add_all(messages)
+    await db_session.commit()
+    return [str(message.id) for message in sorted(messages, key=lambda message: (message.created_at, message.id))]
+
+
+def test_cursor_pages_neither_skip_nor_repeat_messages_posted_at_the_same_time(
+    client: TestClient, db_session: AsyncSession
+):
+    owner, owner_id = register(client, "alice")
+    client.post("/chats/new/", json={"name": "chat", "private": True, "active": True}, headers=owner)
+    chat_id = client.get("/chats/all/", headers=owner).json()[0]["id"]
+    # five messages share one timestamp, every page boundary falls inside the tie
+    moments = [datetime(2024, 1, 1)] + [datetime(2024, 1, 2)] * 5 + [datetime(2024, 1, 3)]
+    ordered = client.portal.call(post_at, db_session, chat_id, owner_id, moments)
+
+    path = f"/chats/{chat_id}/messages/?limit=2"
+    page = client.get(path, headers=owner).json()
+    seen = [item["id"] for item in page["items"]]
+    while page["has_more"]:
+        page = client.get(f"{path}&before={page['before_cursor']}", headers=owner).json()
+        seen = [item["id"] for item in page["items"]] + seen
+    assert seen == ordered
+
+    page = client.get(f"{path}&after={encode_cursor(datetime(1970, 1, 1), uuid.UUID(int=0))}", headers=owner).json()
+    seen = [item["id"] for item in page["items"]]
+    while page["has_more"]:
+        page = client.get(f"{path}&after={page['after_cursor']}", headers=owner).json()
+        seen += [item["id"] for item in page["items"]]
+    assert seen == ordered
+
+
+def test_tampered_cursors_are_rejected(client: TestClient):
+    owner, _ = register(client, "alice")
+    client.post("/chats/new/", json={"name": "chat", "private": True, "active": True}, headers=owner)
+    chat_id = client.get("/chats/all/", headers=owner).json()[0]["id"]
+    cursor = encode_cursor(datetime(2024, 1, 1), uuid.uuid4())
+    for tampered in (cursor[:-3], cursor + "x", encode_cursor("yesterday", uuid.uuid4()), encode_cursor(1, 2, 3)):
+        response = client.get(f"/chats/{chat_id}/messages/?before={tampered}", headers=owner)
+        assert response.status_code == 400, tampered
+        assert response.json() == {"detail": "Invalid pagination cursor"}
+
+
+def test_export_resumes_after_the_cursor_of_any_record(client: TestClient, db_session: AsyncSession, monkeypatch):
+    sessions = []
+
+    def session_factory() -> AsyncSession:
+        sessions.append(AsyncSession(bind=db_session.bind, join_transaction_mode="create_savepoint"))
+        return sessions[-1]
+
+    monkeypatch.setattr(messages_exporter, "session_factory", session_factory)
+    monkeypatch.setattr(messages_exporter, "batch_size", 2)
+    owner, owner_id = register(client, "alice")
+    client.post("/chats/new/", json={"name": "chat", "private": True, "active": True}, headers=owner)
+    chat_id = client.get("/chats/all/", headers=owner).json()[0]["id"]
+    moments = [datetime(2024, 1, 1)] + [datetime(2024, 1, 2)] * 5 + [datetime(2024, 1, 3)]
+    ordered = client.portal.call(post_at, db_session, chat_id, owner_id, moments)
+
+    path = f"/chats/{chat_id}/export/"
+    records = [json.loads(line) for line in client.get(path, headers=owner).text.splitlines()]
+    assert [record["id"] for record in records] == ordered
+    # every batch is read in a short session of its own, the last one finds nothing more
+    assert len(sessions) == 4
+    # a download cut inside the tie resumes after its last record, nothing lost or repeated
+    resumed = client.get(path, params={"cursor": records[2]["cursor"]}, headers=owner).text.splitlines()
+    assert [json.loads(line)["id"] for line in resumed] == ordered[3:]
+    params = {"format": "csv", "cursor": records[5]["cursor"]}
+    rows = csv.DictReader(client.get(path, params=params, headers=owner).text.splitlines())
+    assert [row["id"] for row in rows] == ordered[6:]
+    assert client.get(path, params={"cursor": records[-1]["cursor"]}, headers=owner).text == ""
+
+
+def new_chat(client: TestClient, headers: dict, name: str) -> str:
+    assert client.post("/chats/new/", json={"name": name, "private": True, "active": True}, headers=headers).is_success
+    return next(chat["id"] for chat in client.get("/chats/all/", headers=headers).json() if chat["name"] == name)
+
+
+async def post_contents(db_session: AsyncSession, chat_id: str, user_id: str, contents: list[str]) -> None:
+    db_session.add_all(
+        MessageModel(
+            chat_id=uuid.UUID(chat_id),
+            from_user_id=uuid.UUID(user_id),
+            content=content,
+            created_at=datetime(2024, 1, 1) + timedelta(minutes=idx),
+        )
+        for idx, content in enumerate(contents)
+    )
+    await db_session.commit()
+
+
+def test_search_ranks_and_highlights_matches_in_the_users_chats(client: TestClient, db_session: AsyncSession):
+    owner, owner_id = register(client, "alice")
+    stranger, stranger_id = register(client, "bob")
+    work, lunch = new_chat(client, owner, "work"), new_chat(client, owner, "lunch")
+    client.portal.call(post_contents, db_session, work, owner_id, ["Deploy the API", "the api docs are out of date"])
+    client.portal.call(post_contents, db_session, lunch, owner_id, ["api?"])
+    client.portal.call(post_contents, db_session, new_chat(client, stranger, "private"), stranger_id, ["api"])
+
+    # shorter messages rank higher, the match counts for more of them
+    items = client.get("/chats/search/", params={"q": "api"}, headers=owner).json()["items"]
+    assert [item["content"] for item in items] == ["api?", "Deploy the API", "the api docs are out of date"]
+    assert [(item["snippet"], item["highlights"]) for item in items[:2]] == [
+        ("api?", [[0, 3]]),
+        ("Deploy the API", [[11, 14]]),
+    ]
+    items = client.get("/chats/search/", params={"q": "API docs -lunch", "chat_id": work}, headers=owner).json()
+    assert [item["content"] for item in items["items"]] == ["the api docs are out of date"]
+    assert client.get("/chats/search/", params={"q": "api", "chat_id": work}, headers=stranger).status_code == 403
+
+
+def test_search_pages_through_ranked_matches(client: TestClient, db_session: AsyncSession):
+    owner, owner_id = register(client, "alice")
+    chat_id = new_chat(client, owner, "chat")
+    contents = ["api", "an api", "api api", "the api", "one api"]
+    client.portal.call(post_contents, db_session, chat_id, owner_id, contents)
+
+    page = client.get("/chats/search/", params={"q": "api", "limit": 2}, headers=owner).json()
+    seen = [item["content"] for item in page["items"]]
+    while page["cursor"]:
+        params = {"q": "api", "limit": 2, "cursor": page["cursor"]}
+        page = client.get("/chats/search/", params=params, headers=owner).json()
+        seen += [item["content"] for item in page["items"]]
+    assert sorted(seen) == sorted(contents)
+    assert seen[0] == "api"
+
+
+def test_search_ranks_only_the_newest_candidates(client: TestClient, db_session: AsyncSession, monkeypatch):
+    monkeypatch.setattr(search_settings, "search_max_candidates", 3)
+    owner, owner_id = register(client, "alice")
+    chat_id = new_chat(client, owner, "chat")
+    # the best match is the oldest one, past the cap it is not even ranked
+    client.portal.call(post_contents, db_session, chat_id, owner_id, ["api", "old api", "an api", "the api", "new api"])
+
+    items = client.get("/chats/search/", params={"q": "api"}, headers=owner).json()["items"]
+    assert sorted(item["content"] for item in items) == ["an api", "new api", "the api"]
+
+
+async def test_postgres_searches_the_vector_of_the_newest_candidates():
+    statements = []
+
+    class Session:
+        bind = create_mock_engine("postgresql://", executor=None)
+
+        async def execute(self, statement):
+            statements.append(statement.compile(dialect=postgresql.dialect()))
+            return Result()
+
+    class Result:
+        def all(self):
+            return []
+
+    chat_id = uuid.uuid4()
+    assert await messages_repository.search(Session(), [chat_id], "api -docs", limit=20, max_candidates=500) == []
+    (statement,) = statements
+    sql = " ".join(str(statement).split())
+    assert "messages.search_vector @@ websearch_to_tsquery(" in sql
+    assert "ts_rank_cd(messages.search_vector, websearch_to_tsquery(" in sql
+    assert "ts_headline(" in sql
+    assert {"api -docs", 500, 20} <= {value for value in statement.params.values() if not isinstance(value, list)}
+
+
+async def test_watermarks_only_move_forward(client: TestClient, db_session: AsyncSession):
+    owner, owner_id = register(client, "alice")
+    chat_id, user_id = uuid.UUID(new_chat(client, owner, "chat")), uuid.UUID(owner_id)
+    # posted at one timestamp, ordered by id alone
+    first, second, third = sorted((datetime(2024, 1, 1), uuid.uuid4()) for _ in range(3))
+    newest = (datetime(2024, 1, 2), uuid.uuid4())
+
+    async def advance(*positions: tuple[datetime, uuid.UUID]) -> tuple[datetime, uuid.UUID]:
+        marks = [(chat_id, user_id, created_at, message_id) for created_at, message_id in positions]
+        await read_watermarks_repository.advance(session=db_session, marks=marks)
+        (mark,) = await read_watermarks_repository.filter(session=db_session, chat_id=chat_id)
+        await db_session.refresh(mark)
+        return mark.message_created_at, mark.message_id
+
+    assert await advance(second) == second
+    # late and replayed deliveries leave the watermark where it is
+    assert await advance(first) == second
+    assert await advance(second) == second
+    assert await advance(third) == third
+    # a batch carrying several marks for one member keeps the newest, whatever the order
+    assert await advance(newest, first) == newest
@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+from app.exceptions.users import HashingOverloadedException
+from app.utils.hashing import PasswordHasher
+from passlib.context import CryptContext
+
+CONTEXT = CryptContext(schemes=["bcrypt", "md5_crypt"], deprecated="auto", bcrypt__rounds=4)
+
+
+async def test_counters_add_up_after_concurrent_hashes():
+    hasher = PasswordHasher(context=CONTEXT, workers=4, queue_size=64)
+    hashes = await asyncio.gather(*(hasher.hash(f"password {idx}") for idx in range(32)))
+    assert await hasher.verify("password 7", hashes[7])
+    stats = hasher.stats
+    assert (stats["submitted"], stats["queued"], stats["running"]) == (33, 0, 0)
+    assert hasher.wait.count == hasher.run.count == 33
+
+
+async def test_rehash_is_counted_once_it_succeeded():
+    hasher = PasswordHasher(context=CONTEXT, workers=1, queue_size=0)
+    legacy = CONTEXT.handler("md5_crypt").hash("password")
+    assert await hasher.upgrade(password="password", hashed_password=legacy)
+    assert hasher.stats["rehashed"] == 1
+    # the only worker is busy, the rehash is rejected and not counted
+    busy = asyncio.ensure_future(hasher.hash("another password"))
+    await asyncio.sleep(0)
+    with pytest.raises(HashingOverloadedException):
+        await hasher.upgrade(password="password", hashed_password=legacy)
+    await busy
+    assert hasher.stats["rehashed"] == 1
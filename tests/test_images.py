@@ -0,0 +1,44 @@
+import os
+
+import pytest
+from app.exceptions.media import UnsupportedMediaTypeException
+from app.utils.images import ImagePipeline
+from PIL import Image
+
+
+async def test_render_survives_a_dead_worker(tmp_path):
+    original = str(tmp_path / "original.png")
+    Image.new("RGB", (64, 64), "red").save(original)
+    pipeline = ImagePipeline(workers=1, sizes=[16, 32], formats=["webp"], quality=80, max_pixels=1 << 20)
+    try:
+        assert await pipeline.render(original) == pipeline.variants(original)[::-1]
+        # killed from outside, the way the kernel ends a worker that ran out of memory
+        for process in pipeline._executor._processes.values():
+            process.kill()
+            process.join()
+        paths = await pipeline.render(original)
+    finally:
+        pipeline.shutdown()
+    assert all(os.path.exists(path) for path in paths)
+    assert pipeline.stats == {"workers": 1, "rendered": 2, "failed": 0, "restarts": 1}
+
+
+async def test_only_undecodable_uploads_are_unsupported(tmp_path):
+    pipeline = ImagePipeline(workers=1, sizes=[16], formats=["webp"], quality=80, max_pixels=1 << 20)
+    not_an_image = str(tmp_path / "not-an-image.png")
+    with open(not_an_image, "wb") as file:
+        file.write(b"plain text")
+    truncated = str(tmp_path / "truncated.png")
+    Image.effect_noise((64, 64), 64).save(truncated)
+    os.truncate(truncated, os.path.getsize(truncated) // 2)
+    missing = str(tmp_path / "missing" / "original.png")
+    try:
+        for original in (not_an_image, truncated):
+            with pytest.raises(UnsupportedMediaTypeException):
+                await pipeline.render(original)
+        # the disk failing is a server error, not a bad upload
+        with pytest.raises(FileNotFoundError):
+            await pipeline.render(missing)
+    finally:
+        pipeline.shutdown()
+    assert pipeline.stats == {"workers": 1, "rendered": 0, "failed": 3, "restarts": 0}
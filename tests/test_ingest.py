@@ -0,0 +1,38 @@
+import asyncio
+import uuid
+
+from app.models.chats import Message as MessageModel
+from app.repositories.chats import messages_repository
+from app.services.ingest import MessagesIngestor
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from tests.conftest import Session
+
+
+async def test_bad_message_fails_alone(db_session: AsyncSession):
+    ingestor = MessagesIngestor(
+        messages_repository=messages_repository,
+        durability="group",
+        batch_size=8,
+        flush_interval=0.01,
+        queue_size=8,
+        session_factory=lambda: Session(bind=db_session.bind, join_transaction_mode="create_savepoint"),
+    )
+    await ingestor.start()
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+    # content is not nullable, the insert of a batch holding the fourth message fails
+    contents = ["one", "two", "three", None, "five", "six"]
+    results = await asyncio.gather(
+        *(ingestor.submit(chat_id=chat_id, from_user_id=user_id, content=content) for content in contents),
+        return_exceptions=True,
+    )
+    await ingestor.stop()
+    assert [isinstance(result, Exception) for result in results] == [False, False, False, True, False, False]
+    assert ingestor.stats == {
+        "pending": 0,
+        "enqueued": 6,
+        "persisted": 5,
+        "batches": 1,
+        "failed": 1,
+    }
+    assert await db_session.scalar(select(func.count()).select_from(MessageModel)) == 5
@@ -0,0 +1,79 @@
+import time
+from collections.abc import Callable
+from datetime import datetime
+
+from app.models.mail import OutboxMail as OutboxMailModel
+from app.services.mail import mail_outbox
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+EMAIL = "alice@example.com"
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def forgot_password(client: TestClient) -> None:
+    response = client.post("/users/forgot-password/", json={"email": EMAIL})
+    assert response.status_code == 202, response.text
+
+
+def outbox(client: TestClient, db_session: AsyncSession) -> list[OutboxMailModel]:
+    result = client.portal.call(db_session.scalars, select(OutboxMailModel).execution_options(populate_existing=True))
+    return list(result.all())
+
+
+def register(client: TestClient) -> None:
+    user = {"username": "alice", "email": EMAIL, "password": "password"}
+    assert client.post("/users/register/", json=user).status_code == 201
+
+
+def test_reset_mail_reaches_the_server(smtp_server, client):
+    register(client)
+    sent = mail_outbox.sent
+    forgot_password(client)
+    wait_for(lambda: mail_outbox.sent == sent + 1)
+    (envelope,) = smtp_server.envelopes
+    assert envelope.rcpt_tos == [EMAIL]
+    assert b"Subject: Reset password" in envelope.content
+    assert b"/reset-password/" in envelope.content
+
+
+def test_temporary_failure_is_retried_with_backoff(smtp_server, client, db_session):
+    register(client)
+    retried = mail_outbox.retried
+    smtp_server.replies.append("451 Try again later")
+    forgot_password(client)
+    wait_for(lambda: mail_outbox.retried == retried + 1)
+    (mail,) = outbox(client, db_session)
+    assert mail.attempts == 1
+    assert mail.next_attempt_at > datetime.utcnow()
+    assert "451" in mail.last_error
+    assert smtp_server.envelopes == []
+
+
+def test_permanent_failure_is_given_up(smtp_server, client, db_session):
+    register(client)
+    dead = mail_outbox.dead
+    smtp_server.replies.append("550 No such mailbox")
+    forgot_password(client)
+    wait_for(lambda: mail_outbox.dead == dead + 1)
+    (mail,) = outbox(client, db_session)
+    assert mail.attempts == 1
+    assert mail.next_attempt_at is None
+    assert "550" in mail.last_error
+
+
+def test_senders_reuse_their_connection(smtp_server, client):
+    register(client)
+    sent = mail_outbox.sent
+    for count in range(1, 4):
+        forgot_password(client)
+        wait_for(lambda: mail_outbox.sent == sent + count)
+    assert len(smtp_server.envelopes) == 3
+    assert mail_outbox.stats["connects"] == mail_outbox.stats["workers"] == 1
@@ -0,0 +1,123 @@
+import io
+import os
+import time
+from collections.abc import Callable
+
+from app.config import media_settings
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def register(client: TestClient, username: str) -> dict:
+    user = {"username": username, "email": f"{username}@example.com", "password": "password"}
+    assert client.post("/users/register/", json=user).status_code == 201
+    response = client.post("/users/login/", data={"username": username, "password": "password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def png(color: str, noise: bool = False) -> bytes:
+    image = Image.effect_noise((256, 256), 64).convert("RGB") if noise else Image.new("RGB", (64, 64), color)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def upload(client: TestClient, headers: dict, content: bytes, content_type: str = "image/png") -> int:
+    files = {"photo": ("avatar.png", content, content_type)}
+    return client.post("/users/avatar/", files=files, headers=headers).status_code
+
+
+def stored(root) -> list[str]:
+    return sorted(os.path.join(path, name)[len(str(root)) :] for path, _, names in os.walk(root) for name in names)
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5) -> None:
+    # files of a failed or replaced upload are removed in the background
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_oversized_and_mistyped_uploads_leave_nothing_behind(client: TestClient, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_settings, "media_root", str(tmp_path))
+    monkeypatch.setattr(media_settings, "avatar_max_size", 16 * 1024)
+    headers = register(client, "alice")
+
+    assert upload(client, headers, png("red", noise=True)) == 413
+    # the declared type and the file name are ignored, the content is what counts
+    assert upload(client, headers, b"#!/bin/sh\nrm -rf /\n" * 100) == 415
+    assert upload(client, headers, b"GIF89a" + b"\x00" * 100, content_type="image/png") == 415
+    wait_for(lambda: stored(tmp_path) == [])
+    assert client.get("/users/avatar/", headers=headers).json() == {"detail": "no avatar"}
+
+
+def test_a_new_avatar_replaces_the_old_one_only_once_it_is_complete(client: TestClient, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_settings, "media_root", str(tmp_path))
+    monkeypatch.setattr(media_settings, "avatar_max_size", 16 * 1024)
+    headers = register(client, "alice")
+    red, blue = png("red"), png("blue")
+
+    assert upload(client, headers, red) == 200
+    old = stored(tmp_path)
+    assert client.get("/users/avatar/", headers=headers).content == red
+    # a failed replacement keeps serving the avatar that was there
+    assert upload(client, headers, png("blue", noise=True)) == 413
+    assert stored(tmp_path) == old
+    assert client.get("/users/avatar/", headers=headers).content == red
+
+    assert upload(client, headers, blue) == 200
+    assert client.get("/users/avatar/", headers=headers).content == blue
+    # the old original and its variants go once the new one is committed
+    wait_for(lambda: not set(old) & set(stored(tmp_path)))
+    new = stored(tmp_path)
+    assert len(new) == len(old) == 1 + len(media_settings.avatar_sizes) * len(media_settings.avatar_formats)
+    assert not [name for name in new if os.path.basename(name).startswith(".")]
+
+
+def test_avatars_revalidate_with_etags_and_serve_ranges(client: TestClient, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_settings, "media_root", str(tmp_path))
+    headers = register(client, "alice")
+    red = png("red")
+    assert upload(client, headers, red) == 200
+    url = client.get("/users/me/", headers=headers).json()["avatar_url"]
+
+    response = client.get(url)
+    assert response.content == red
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    tag = response.headers["ETag"]
+    for if_none_match in (tag, f"W/{tag}", f'"other", {tag}', "*"):
+        response = client.get(url, headers={"If-None-Match": if_none_match})
+        assert (response.status_code, response.content, response.headers["ETag"]) == (304, b"", tag)
+    assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+    response = client.get(url, headers={"Range": "bytes=0-9"})
+    assert (response.status_code, response.content) == (206, red[:10])
+    assert response.headers["Content-Range"] == f"bytes 0-9/{len(red)}"
+    assert client.get(url, headers={"Range": "bytes=-5", "If-Range": tag}).content == red[-5:]
+    # a stale If-Range gets the whole file instead of a piece of the wrong one
+    response = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert (response.status_code, response.content) == (200, red)
+
+    # variants are validated on their own, and the negotiated one varies with the accept header
+    response = client.get(url, params={"size": 32}, headers={"Accept": "image/webp"})
+    assert response.headers["Content-Type"] == "image/webp"
+    assert response.headers["Vary"] == "Accept"
+    assert response.headers["ETag"] != tag
+    assert client.get(url, params={"size": 32}, headers={"If-None-Match": response.headers["ETag"]}).status_code == 200
+
+
+def test_own_avatar_is_revalidated_after_every_change(client: TestClient, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_settings, "media_root", str(tmp_path))
+    headers = register(client, "alice")
+    assert upload(client, headers, png("red")) == 200
+    response = client.get("/users/avatar/", headers=headers)
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    tag = response.headers["ETag"]
+    assert client.get("/users/avatar/", headers={**headers, "If-None-Match": tag}).status_code == 304
+
+    # the url stays the same, the etag is what tells the cache the avatar changed
+    blue = png("blue")
+    assert upload(client, headers, blue) == 200
+    response = client.get("/users/avatar/", headers={**headers, "If-None-Match": tag})
+    assert (response.status_code, response.content) == (200, blue)
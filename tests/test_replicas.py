@@ -0,0 +1,99 @@
+import uuid
+from collections.abc import AsyncGenerator
+
+import pytest
+import pytest_asyncio
+from app import database
+from app.database import Base, replica_sessionmaker, set_actor
+from app.models.users import User as UserModel
+from app.services.users import users_service
+from app.utils.broadcast import MemoryBroadcast
+from app.utils.replicas import ReplicaRouter
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+USER_ID = uuid.uuid4()
+
+
+def sqlite_url(path) -> str:
+    return f"sqlite+aiosqlite:///{path}"
+
+
+async def seed(url: str, full_name: str) -> None:
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with sessionmaker(engine, class_=AsyncSession)() as session:
+        session.add(UserModel(id=USER_ID, username="reader", password="hash", full_name=full_name))
+        await session.commit()
+    await engine.dispose()
+
+
+def router(*session_factories) -> ReplicaRouter:
+    return ReplicaRouter(
+        session_factories=list(session_factories), max_lag=1, sticky_seconds=60, sticky_size=100, check_interval=1
+    )
+
+
+@pytest_asyncio.fixture
+async def primary(tmp_path, monkeypatch) -> AsyncGenerator:
+    # the same user on both databases, the full name tells which one answered
+    await seed(sqlite_url(tmp_path / "primary.db"), full_name="on the primary")
+    engine = create_async_engine(sqlite_url(tmp_path / "primary.db"))
+    monkeypatch.setattr(database, "async_session", sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(users_service, "broadcast", MemoryBroadcast(batch_size=100, flush_interval=1))
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def replica(tmp_path, primary, monkeypatch) -> AsyncGenerator:
+    await seed(sqlite_url(tmp_path / "replica.db"), full_name="on the replica")
+    session_factory = replica_sessionmaker(sqlite_url(tmp_path / "replica.db"))
+    monkeypatch.setattr(database, "replicas", replicas := router(session_factory))
+    await replicas.check()
+    yield replicas
+    await session_factory.kw["bind"].dispose()
+
+
+async def test_profile_reads_go_to_the_replica(replica):
+    assert (await users_service.get_profile(user_id=USER_ID)).full_name == "on the replica"
+    # authentication never trusts a replica
+    assert (await users_service.get_user(username="reader")).full_name == "on the primary"
+    assert replica.stats["routed"] == 1
+
+
+async def test_reads_stick_to_the_primary_after_a_write(replica):
+    set_actor("reader")
+    user = await users_service.get_user(username="reader")
+    await users_service.update(user=user, full_name="written")
+    assert (await users_service.get_profile(user_id=USER_ID)).full_name == "written"
+    assert replica.stats["fallbacks"] == 1
+    # someone else still reads from the replica
+    set_actor("someone else")
+    assert (await users_service.get_profile(user_id=USER_ID)).full_name == "on the replica"
+
+
+async def test_unavailable_replica_falls_back_to_the_primary(tmp_path, primary, monkeypatch):
+    replicas = router(replica_sessionmaker(sqlite_url(tmp_path / "missing" / "replica.db")))
+    # healthy at the last check, gone by the time the read runs
+    replicas.lags = [0.0]
+    monkeypatch.setattr(database, "replicas", replicas)
+    assert (await users_service.get_profile(user_id=USER_ID)).full_name == "on the primary"
+    assert replicas.lags == [None]
+    assert replicas.stats["failures"] == 1
+    # out of rotation until a check reaches it again
+    await replicas.check()
+    assert replicas.healthy() == []
+
+
+@pytest.mark.parametrize("lag", [5.0, None])
+async def test_lagging_replica_is_skipped(replica, monkeypatch, lag):
+    async def behind(session_factory) -> float | None:
+        return lag
+
+    monkeypatch.setattr(replica, "_lag", behind)
+    await replica.check()
+    assert (await users_service.get_profile(user_id=USER_ID)).full_name == "on the primary"
+    assert replica.stats["healthy"] == 0
+    assert replica.stats["fallbacks"] == 1
@@ -0,0 +1,140 @@
+from app.controllers.users import users_controller
+from app.models.users import User as UserModel
+from app.services.users import UsersService, users_service
+from app.utils.broadcast import MemoryBroadcast
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def ignore(events: list[dict]) -> None:
+    return None
+
+
+async def users_workers(count: int) -> list[UsersService]:
+    bus: list[MemoryBroadcast] = []
+    services = []
+    for _ in range(count):
+        backend = MemoryBroadcast(batch_size=100, flush_interval=0.001, bus=bus)
+        service = UsersService(
+            users_repository=users_service.users_repository,
+            token_revocations_repository=users_service.token_revocations_repository,
+            password_hasher=users_service.password_hasher,
+            revocations=users_service.revocations,
+            broadcast=backend,
+        )
+        backend.subscribe("user", service.apply_invalidations)
+        await backend.start(handler=ignore)
+        services.append(service)
+    return services
+
+
+async def test_cached_users_are_dropped_on_every_worker():
+    first, second = await users_workers(2)
+    for service in (first, second):
+        service.users_cache.set("alice", {"username": "alice"})
+        service.users_cache.set("bob", {"username": "bob"})
+    first.invalidate_user(user=first.users_repository.model(username="alice"))
+    for service in (first, second):
+        await service.broadcast.stop()
+    for service in (first, second):
+        assert service.users_cache.get("alice") is None
+        assert service.users_cache.get("bob") == {"username": "bob"}
+
+
+def login(client: TestClient, username: str, password: str) -> dict:
+    response = client.post("/users/login/", data={"username": username, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_stale_cached_user_cannot_revert_password_or_session_version(client: TestClient, db_session: AsyncSession):
+    user = {"username": "alice", "email": "alice@example.com", "password": "old-password"}
+    assert client.post("/users/register/", json=user).status_code == 201
+    headers = login(client, username="alice", password="old-password")
+    assert client.get("/users/me/", headers=headers).status_code == 200
+    stale = users_service.users_cache.get("alice")
+
+    change = {"old_password": "old-password", "password": "new-password", "new_password": "new-password"}
+    assert client.post("/users/change-password/", json=change, headers=headers).status_code == 202
+    query = select(UserModel.password, UserModel.session_version).where(UserModel.username == "alice")
+    changed = client.portal.call(db_session.execute, query)
+    password, session_version = changed.one()
+    assert session_version == stale["session_version"] + 1
+
+    # a worker that has not dropped its entry yet serves the old snapshot to the next request
+    headers = login(client, username="alice", password="new-password")
+    users_service.users_cache.set("alice", stale)
+    update = {"full_name": "Alice", "email": "alice@example.com"}
+    assert client.put("/users/update/", json=update, headers=headers).status_code == 200
+
+    assert client.portal.call(db_session.execute, query).one() == (password, session_version)
+    assert client.post("/users/login/", data={"username": "alice", "password": "old-password"}).status_code == 401
+    assert (
+        client.get("/users/me/", headers=login(client, username="alice", password="new-password")).json()["full_name"]
+        == "Alice"
+    )
+
+
+def start_session(client: TestClient, username: str, password: str) -> tuple[dict, str]:
+    response = client.post("/users/login/", data={"username": username, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}, response.cookies["refresh_token"]
+
+
+def refresh(client: TestClient, refresh_token: str) -> int:
+    return client.post("/users/refresh-token/", params={"refresh_token": refresh_token}).status_code
+
+
+def test_logout_rejects_both_tokens(client: TestClient):
+    user = {"username": "alice", "email": "alice@example.com", "password": "password"}
+    assert client.post("/users/register/", json=user).status_code == 201
+    headers, refresh_token = start_session(client, username="alice", password="password")
+    assert client.request("DELETE", "/users/logout/", headers=headers).status_code == 200
+
+    assert client.get("/users/me/", headers=headers).status_code == 401
+    assert refresh(client, refresh_token) == 401
+
+
+def test_replayed_refresh_token_ends_every_session(client: TestClient):
+    user = {"username": "alice", "email": "alice@example.com", "password": "password"}
+    assert client.post("/users/register/", json=user).status_code == 201
+    headers, refresh_token = start_session(client, username="alice", password="password")
+    other_headers, other_refresh_token = start_session(client, username="alice", password="password")
+    assert refresh(client, refresh_token) == 200
+    rotated = client.cookies["refresh_token"]
+
+    # the rotated token is presented again, whoever holds it now is not the user
+    assert refresh(client, refresh_token) == 401
+    assert client.get("/users/me/", headers=headers).status_code == 401
+    assert client.get("/users/me/", headers=other_headers).status_code == 401
+    assert refresh(client, other_refresh_token) == 401
+    assert refresh(client, rotated) == 401
+    assert client.get("/users/me/", headers=login(client, username="alice", password="password")).status_code == 200
+
+
+def test_reset_link_works_once(client: TestClient):
+    user = {"username": "alice", "email": "alice@example.com", "password": "password"}
+    assert client.post("/users/register/", json=user).status_code == 201
+    token = users_controller.create_token(subject="alice@example.com", token_type="reset")
+
+    reset = {"password": "new-password", "confirm_password": "new-password"}
+    assert client.post(f"/users/reset-password/{token}", json=reset).status_code == 202
+    reset = {"password": "other-password", "confirm_password": "other-password"}
+    assert client.post(f"/users/reset-password/{token}", json=reset).status_code == 401
+    assert client.post("/users/login/", data={"username": "alice", "password": "other-password"}).status_code == 401
+    login(client, username="alice", password="new-password")
+
+
+def test_password_change_rejects_older_tokens(client: TestClient):
+    user = {"username": "alice", "email": "alice@example.com", "password": "old-password"}
+    assert client.post("/users/register/", json=user).status_code == 201
+    headers, refresh_token = start_session(client, username="alice", password="old-password")
+    other_headers, other_refresh_token = start_session(client, username="alice", password="old-password")
+
+    change = {"old_password": "old-password", "password": "new-password", "new_password": "new-password"}
+    assert client.post("/users/change-password/", json=change, headers=headers).status_code == 202
+    for stale_headers, stale_refresh_token in ((headers, refresh_token), (other_headers, other_refresh_token)):
+        assert client.get("/users/me/", headers=stale_headers).status_code == 401
+        assert refresh(client, stale_refresh_token) == 401
+    assert client.get("/users/me/", headers=login(client, username="alice", password="new-password")).status_code == 200